@@ -35,9 +35,10 @@ class WriteDAGManager:
 
         job_keys = {'HistosData', 'HistosMC',
                     'CountsData', 'CountsMC',
+                    'FusedData', 'FusedMC',
                     'HaddHistoData', 'HaddHistoMC',
                     'HaddCountsData', 'HaddCountsMC',
-                    'EffSF', 'EffSFAgg', 'Discr',
+                    'EffSF', 'EffSFAgg', 'EffSFRender', 'Discr',
                     'Union', 'Closure'}
         for k in jobs:
             assert k in job_keys
@@ -89,6 +90,15 @@ class WriteDAGManager:
             self.write_string('{} '.format(job_id))
         self.new_line()
 
+    def processing_jobs(self, mode, dtype):
+        """
+        Histos or counts jobs for Data or MC.
+        Single-pass (fused) jobs replace both when present.
+        """
+        if 'Fused' + dtype in self.jobs:
+            return self.jobs['Fused' + dtype]
+        return self.jobs[mode + dtype]
+
     def write_configuration(self):
         # https://research.cs.wisc.edu/htcondor/manual/v7.6/2_10DAGMan_Applications.html#SECTION003109000000000000000
         # dot -Tps dag.dot -o dag.ps
@@ -96,55 +106,27 @@ class WriteDAGManager:
         #self.this_file.write('DAGMAN_HOLD_CLAIM_TIME=30\n')
         self.new_line()
 
+    def write_chain(self, parents, jobs):
+        """Each job is the child of the previous one, the first being the child of `parents`."""
+        for job in jobs:
+            self.write_parent_child_hierarchy(parents=parents, childs=[job])
+            parents = [job]
+
     def write_all(self):
-        # counts to add for data
+        # counts merging layers, per-sample and aggregation steps, for Data and MC
         if self.branch != 'nocounts':
-            p = [x for x in self.jobs['CountsData']]
-            c = [self.jobs['HaddCountsData'][0]]
-            self.write_parent_child_hierarchy(parents=p, childs=c)
-     
-            # counts to add for MC
-            p = [x for x in self.jobs['CountsMC']]
-            c = [self.jobs['HaddCountsMC'][0]]
-            self.write_parent_child_hierarchy(parents=p, childs=c)
-            self.new_line()
-     
-            # counts add aggregation for Data
-            p = [self.jobs['HaddCountsData'][0]]
-            c = [self.jobs['HaddCountsData'][1]]
-            self.write_parent_child_hierarchy(parents=p, childs=c)
-     
-            # counts add aggregation for MC
-            p = [self.jobs['HaddCountsMC'][0]]
-            c = [self.jobs['HaddCountsMC'][1]]
-            self.write_parent_child_hierarchy(parents=p, childs=c)
+            self.write_chain(self.processing_jobs('Counts', 'Data'), self.jobs['HaddCountsData'])
+            self.write_chain(self.processing_jobs('Counts', 'MC'), self.jobs['HaddCountsMC'])
             self.new_line()
 
         if self.branch != 'counts':
-            # histos to hadd for dat
-            p = [x for x in self.jobs['HistosData']]
-            c = [self.jobs['HaddHistoData'][0]]
-            self.write_parent_child_hierarchy(parents=p, childs=c)
-
-            # histos to hadd for MC
-            p = [x for x in self.jobs['HistosMC']]
-            c = [self.jobs['HaddHistoMC'][0]]
-            self.write_parent_child_hierarchy(parents=p, childs=c)
-            self.new_line()
-
-            # hadd aggregation for Data
-            p = [self.jobs['HaddHistoData'][0]]
-            c = [self.jobs['HaddHistoData'][1]]
-            self.write_parent_child_hierarchy(parents=p, childs=c)
-
-            # hadd aggregation for MC
-            p = [self.jobs['HaddHistoMC'][0]]
-            c = [self.jobs['HaddHistoMC'][1]]
-            self.write_parent_child_hierarchy(parents=p, childs=c)
+            # histos merging layers and aggregation, for Data and MC
+            self.write_chain(self.processing_jobs('Histos', 'Data'), self.jobs['HaddHistoData'])
+            self.write_chain(self.processing_jobs('Histos', 'MC'), self.jobs['HaddHistoMC'])
             self.new_line()
 
             # efficiencies/scale factors draw and saving
-            p = [self.jobs['HaddHistoData'][1], self.jobs['HaddHistoMC'][1]]
+            p = [self.jobs['HaddHistoData'][-1], self.jobs['HaddHistoMC'][-1]]
             c = self.jobs['EffSF']
             self.write_parent_child_hierarchy(parents=p, childs=c)
 
@@ -152,6 +134,10 @@ class WriteDAGManager:
             p = self.jobs['EffSF']
             c = self.jobs['EffSFAgg']
             self.write_parent_child_hierarchy(parents=p, childs=c)
+
+            # efficiencies/scale factors plots, drawn from the results stores
+            if 'EffSFRender' in self.jobs:
+                self.write_parent_child_hierarchy(parents=p, childs=self.jobs['EffSFRender'])
         
         if self.branch == 'extra':
             self.new_line()
@@ -28,6 +28,10 @@ def eff_and_sf_outputs(args):
 
 @utils.set_pure_input_namespace
 def eff_and_sf(args):
+    """
+    One job per trigger intersection, or a single batched job computing all intersections
+    with `eff_cpus` processes when `eff_cpus` is positive.
+    """
     outs_job, outs_submit, outs_check, outs_log = eff_and_sf_outputs(args)
 
     #### Write shell executable (python scripts must be wrapped in shell files to run on HTCondor)
@@ -35,7 +39,6 @@ def eff_and_sf(args):
             'outdir'        : args.outdir,
             'mc_name'       : args.mc_name,
             'data_name'     : args.data_name,
-            'triggercomb'   : '${1}',
             'channels'      : ' '.join(args.channels),
             'variables'     : ' '.join(args.variables),
             'configuration' : args.configuration,
@@ -45,6 +48,10 @@ def eff_and_sf(args):
             'canvas_prefix' : args.canvas_prefix}
 
     script = 'run_eff_and_sf.py'
+    if args.eff_cpus > 0:
+        pars['ncpus'] = args.eff_cpus
+    else:
+        pars['triggercomb'] = '${1}'
     comm = utils.build_script_command(name=script, sep=' ', **pars)
     if args.draw_independent_MCs:
         comm += '--draw_independent_MCs '
@@ -62,7 +69,12 @@ def eff_and_sf(args):
                     outfile=outs_check,
                     logfile=outs_log,
                     queue=main.queue,
-                    machine=main.machine)
+                    machine=main.machine,
+                    cpus=max(args.eff_cpus, 1))
+
+    if args.eff_cpus > 0:
+        jw.write_queue()
+        return
 
     cfg = importlib.import_module(args.configuration)
     qlines = []
@@ -1,6 +1,6 @@
 # coding: utf-8
 
-_all_ = [ 'hadd_counts', 'hadd_counts_outputs' ]
+_all_ = [ 'hadd_counts', 'hadd_counts_outputs', 'merged_counts_outputs' ]
 
 import os
 import sys
@@ -11,95 +11,86 @@ import inclusion
 from inclusion.config import main
 from inclusion.utils import utils
 from inclusion.condor.job_writer import JobWriter
+from inclusion.condor.hadd_histo import merge_tree_command, merge_tree_queue_lines
 from inclusion.utils.utils import build_script_command as bsc
 
 @utils.set_pure_input_namespace
-def run_hadd_counts_outputs(args):
-    targets = []
-
-    # add the merge of all the samples first
+def merged_counts_outputs(args):
+    """Counts tensor of each sample, summed over all its files."""
     _tbase1, _tbase2 = utils.hadd_subpaths(args)
-    tbase = _tbase1 + _tbase2
-    for chn in args.channels:
-        t = os.path.join( args.indir, tbase + '_' + chn + '.csv' )
-        targets.append( t )
-
-    # add individual sample merges
-    for smpl in args.samples:
-        tbase = _tbase1 + '_' + smpl + _tbase2
-        for chn in args.channels:
-            t = os.path.join( args.indir, tbase + '_' + chn + '.csv' )
-            targets.append( t )
-    return targets
+    return [os.path.join(args.indir, _tbase1 + '_' + smpl + _tbase2 + '.npz') for smpl in args.samples]
 
 @utils.set_pure_input_namespace
 def hadd_counts_outputs(args):
+    """
+    The counts tensors of each sample are summed first, by a single job or by a merging tree
+    with one set of jobs per layer. The aggregation step writes the tables.
+    """
+    folders = ['HaddCounts' + args.dataset_name]
+    if args.merge_fanin:
+        folders = ['HaddCounts' + args.dataset_name + '_L{}'.format(l)
+                   for l in range(args.merge_depth-1)] + folders
     return JobWriter.define_output( localdir=args.localdir,
-                                    data_folders=['HaddCounts' + args.dataset_name,
-                                                  'HaddCountsAgg' + args.dataset_name],
+                                    data_folders=folders + ['HaddCountsAgg' + args.dataset_name],
                                     tag=args.tag )
 
 @utils.set_pure_input_namespace
 def hadd_counts(args):
-    targets = run_hadd_counts_outputs(args)
+    """
+    Sums the counts tensors of each sample, as arrays, and writes the tables of each channel
+    from the summed tensors. `merge_inputs` gives the files of each sample, as planned by the processing jobs.
+    """
+    merged = merged_counts_outputs(args)
     outs_job, outs_submit, outs_check, outs_log = hadd_counts_outputs(args)
 
     script = 'add_trig_counts.py'
-    pars = {'indir'          : args.indir,
-            'outdir'         : args.outdir,
+    pars = {'outdir'         : args.outdir,
             'subtag'         : args.subtag,
             'tprefix'        : args.tprefix,
-            'dataset_name'   : args.dataset_name}
-    comm_base = bsc(name=script, sep=' ', **pars)
+            'dataset_name'   : args.dataset_name,
+            'channel'        : '${1}',
+            'infile_counts'  : '${@:2}'}
+    comm_agg = bsc(name=script, sep=' ', **pars)
+    comm = bsc(name='merge_outputs.py', sep=' ', target='${1}', inputs='${@:2}')
 
-    pars1 = {'outfile_counts'   : '${1}',
-             'sample'           : '${2}',
-             'channel'          : '${3}',
-             'aggregation_step' : '0'}
-    comm1 = comm_base + bsc(name=None, sep=' ', **pars1)
-
-    pars2 = {'channel'          : '${1}',
-             'infile_counts'    : '${2}',
-             'aggregation_step' : '1'}
-    comm2 = comm_base + bsc(name=None, sep=' ', **pars2)
-    
     #### Write shell executable (python scripts must be wrapped in shell files to run on HTCondor)
     jw = JobWriter()
-    for out in outs_job:
-        if out == outs_job[0]:
-            jw.write_shell(filename=out, command=comm1, localdir=args.localdir, machine=main.machine)
-            jw.add_string('echo "{} without aggregation (dataset {}) done."'.format(script, args.dataset_name))
-        elif out == outs_job[1]:
-            jw.write_shell(filename=out, command=comm2, localdir=args.localdir, machine=main.machine)
+    nlayers = len(outs_job) - 1
+    for il,out in enumerate(outs_job):
+        if out == outs_job[-1]:
+            jw.write_shell(filename=out, command=comm_agg, localdir=args.localdir, machine=main.machine)
             jw.add_string('echo "{} with aggregation {} done."'.format(script, args.dataset_name))
+        elif args.merge_fanin:
+            jw.write_shell(filename=out, command=merge_tree_command(il, args.merge_fanin, nlayers),
+                           localdir=args.localdir, machine=main.machine)
+            jw.add_string('echo "Sum of counts (dataset {}, layer {}) done."'.format(args.dataset_name, il))
+        else:
+            jw.write_shell(filename=out, command=comm, localdir=args.localdir, machine=main.machine)
+            jw.add_string('echo "Sum of counts (dataset {}) done."'.format(args.dataset_name))
 
     #### Write submission file
-    inputs_join = {}
-    nchannels = len(args.channels)
-    for out1,out2,out3,out4 in zip(outs_job,outs_submit,outs_check,outs_log):
+    inputs = [args.merge_inputs[smpl] for smpl in args.samples]
+    for il,(out1,out2,out3,out4) in enumerate(zip(outs_job,outs_submit,outs_check,outs_log)):
         jw.write_condor(filename=out2,
-                        real_exec=utils.build_script_path(script),
+                        real_exec=utils.build_script_path(script if out1 == outs_job[-1] else 'merge_outputs.py'),
                         shell_exec=out1,
                         outfile=out3,
                         logfile=out4,
                         queue=main.queue,
                         machine=main.machine)
 
-        qvars = None
+        qvars = ('myoutput', 'myinputs')
         qlines = []
-        if out1 == outs_job[0]:
-            qvars = ('myoutput', 'channel', 'sample')
-            for it,t in enumerate(targets[nchannels:]):
-                smpl = args.samples[ int(it/nchannels) ]
-                chn = args.channels[ int(it%nchannels) ]
-                if chn not in inputs_join:
-                    inputs_join[chn] = []
-                inputs_join[chn].append(t)
-                qlines.append('  {}, {}, {}'.format(t,smpl,chn))
-
-        elif out1 == outs_job[1]:
+        if out1 == outs_job[-1]:
             qvars = ('channel', 'myinputs')
-            for ichn,chn in enumerate(args.channels):
-                qlines.append(" {}, '{}'".format(chn, ' '.join(inputs_join[chn])))
+            for chn in args.channels:
+                qlines.append('  {}, {}'.format(chn, ' '.join(merged)))
+        elif args.merge_fanin:
+            # the input files are only passed to the first layer
+            qvars = ('myoutput', 'ninputs', 'index', 'myinputs')[:4 if il == 0 else 3]
+            qlines = merge_tree_queue_lines(merged, inputs, args.merge_fanin, nlayers, il)
+        else:
+            for t,inp in zip(merged, inputs):
+                qlines.append('  {}, {}'.format(t, ' '.join(inp)))
 
         jw.write_queue( qvars=qvars, qlines=qlines )
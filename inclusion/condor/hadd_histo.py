@@ -1,6 +1,6 @@
 # coding: utf-8
 
-_all_ = [ 'hadd_histo', 'hadd_histo_outputs' ]
+_all_ = [ 'hadd_histo', 'hadd_histo_outputs', 'merge_tree_command', 'merge_tree_queue_lines' ]
 
 import os
 import sys
@@ -9,9 +9,38 @@ sys.path.insert(0, parent_dir)
 
 import inclusion
 from inclusion.config import main
-from inclusion.utils import utils
+from inclusion.utils import utils, merging
 from inclusion.condor.job_writer import JobWriter
 
+def merge_tree_command(layer, fanin, depth):
+    """Shell command of the jobs of one layer, taking the queue variables of `merge_tree_queue_lines`."""
+    comm = utils.build_script_command(name='merge_outputs.py', sep=' ',
+                                      fanin=fanin, nlayers=depth, layer=layer)
+    pars = {'target'  : '${1}',
+            'ninputs' : '${2}',
+            'index'   : '${3}'}
+    if layer == 0:
+        pars['inputs'] = '${@:4}'
+    return comm + utils.build_script_command(name=None, sep=' ', **pars)
+
+def merge_tree_queue_lines(targets, inputs, fanin, depth, layer):
+    """
+    Queue lines of the jobs of one layer, for all merging trees.
+    `targets`: final output of each tree
+    `inputs`: files merged by each tree, defining its shape. Each job of the first layer
+    receives its own chunk of files.
+    """
+    qlines = []
+    for t, files in zip(targets, inputs):
+        n = len(files)
+        njobs = merging.tree_shape(n, fanin, depth)[layer]
+        for index in range(njobs):
+            line = '  {}, {}, {}'.format(t, n, index)
+            if layer == 0:
+                line += ', {}'.format(' '.join(merging.chunk(files, njobs, index)))
+            qlines.append(line)
+    return qlines
+
 @utils.set_pure_input_namespace
 def run_hadd_histo_outputs(args):
     targets = []
@@ -19,13 +48,13 @@ def run_hadd_histo_outputs(args):
     # add the merge of all the samples first
     _tbase1, _tbase2 = utils.hadd_subpaths(args)
     tbase = _tbase1 + _tbase2
-    t = os.path.join( args.indir, tbase + '.root' )
+    t = os.path.join( args.indir, tbase + '.' + args.histos_format )
     targets.append( t )
 
     # add individual sample merges
     for smpl in args.samples:
         tbase = _tbase1 + '_' + smpl + _tbase2
-        t = os.path.join( args.indir, tbase + '.root' )
+        t = os.path.join( args.indir, tbase + '.' + args.histos_format )
         targets.append( t )
         
     return targets
@@ -35,33 +64,55 @@ def hadd_histo_outputs(args):
     """
     Outputs are guaranteed to have the same length.
     Returns all separate paths to avoid code duplication.
+    With a merging tree, the per-sample merge has one set of outputs per layer.
+    The aggregation is always the last one.
     """
+    folders = ['HaddHisto' + args.dataset_name]
+    if args.merge_fanin:
+        folders = ['HaddHisto' + args.dataset_name + '_L{}'.format(l)
+                   for l in range(args.merge_depth-1)] + folders
     ret = JobWriter.define_output( localdir=args.localdir,
-                                   data_folders=['HaddHisto' + args.dataset_name,
-                                                 'HaddHistoAgg' + args.dataset_name],
+                                   data_folders=folders + ['HaddHistoAgg' + args.dataset_name],
                                    tag=args.tag )
     return ret
 
 
 @utils.set_pure_input_namespace
 def hadd_histo(args):
-    """Adds ROOT histograms"""
+    """
+    Adds ROOT histograms or HDF5 histogram shards, depending on `histos_format`.
+    Aggregated shards are also exported to ROOT.
+    With `merge_fanin`, each sample is merged by a tree of jobs running in `merge_depth` layers,
+    each job adding at most `merge_fanin` files. `merge_inputs` gives the files of each sample,
+    as planned by the processing jobs.
+    """
     script = os.path.basename(__file__)
     targets = run_hadd_histo_outputs(args)
     outs_job, outs_submit, outs_check, outs_log = hadd_histo_outputs(args)
+    nlayers = len(outs_job) - 1
     jw = JobWriter()
-    comm = 'hadd -f ${1} ${@:2}'
+    if args.histos_format == 'hdf5':
+        comm = utils.build_script_command(name='merge_outputs.py', sep=' ',
+                                          target='${1}', inputs='${@:2}')
+        comm_agg = comm + '--export_root'
+    else:
+        comm = comm_agg = 'hadd -f ${1} ${@:2}'
 
-    for out in outs_job:
-        jw.write_shell(filename=out, command=comm, localdir=args.localdir, machine=main.machine)
-        if out == outs_job[0]:
-            jw.add_string('echo "{} without aggregation (dataset {}) done."'.format(script, args.dataset_name))
-        elif out == outs_job[1]:
+    for il,out in enumerate(outs_job):
+        if out == outs_job[-1]:
+            jw.write_shell(filename=out, command=comm_agg, localdir=args.localdir, machine=main.machine)
             jw.add_string('echo "{} with aggregation (dataset {}) done."'.format(script, args.dataset_name))
+        elif args.merge_fanin:
+            jw.write_shell(filename=out, command=merge_tree_command(il, args.merge_fanin, nlayers),
+                           localdir=args.localdir, machine=main.machine)
+            jw.add_string('echo "{} without aggregation (dataset {}, layer {}) done."'.format(script, args.dataset_name, il))
+        else:
+            jw.write_shell(filename=out, command=comm, localdir=args.localdir, machine=main.machine)
+            jw.add_string('echo "{} without aggregation (dataset {}) done."'.format(script, args.dataset_name))
 
     #### Write submission file
-    inputs_join = []
-    for out1,out2,out3,out4 in zip(outs_job,outs_submit,outs_check,outs_log):
+    inputs = [args.merge_inputs[smpl] for smpl in args.samples]
+    for il,(out1,out2,out3,out4) in enumerate(zip(outs_job,outs_submit,outs_check,outs_log)):
         jw.write_condor(filename=out2,
                         real_exec='/dev/null',
                         shell_exec=out1,
@@ -70,16 +121,19 @@ def hadd_histo(args):
                         queue=main.queue,
                         machine=main.machine)
 
+        qvars = ('myoutput', 'myinputs')
         qlines = []
-        if out1 == outs_job[0]:
-            for t,smpl in zip(targets[1:], args.samples):
-                inputs = os.path.join(args.indir, smpl, args.tprefix + '*' + args.subtag + '.root')
-                inputs_join.append(t)
-                # join subdatasets (different MC or Data subfolders, ex: TT_fullyHad, TT_semiLep, ...)
-                qlines.append('  {}, {}'.format(t, inputs))
-        elif out1 == outs_job[1]:
+        if out1 == outs_job[-1]:
             # join MC or Data subdatasets into a single one (ex: TT)
-            qlines.append('  {}, {}'.format(targets[0], ' '.join(inputs_join)))
+            qlines.append('  {}, {}'.format(targets[0], ' '.join(targets[1:])))
+        elif args.merge_fanin:
+            # the input files are only passed to the first layer
+            qvars = ('myoutput', 'ninputs', 'index', 'myinputs')[:4 if il == 0 else 3]
+            qlines = merge_tree_queue_lines(targets[1:], inputs, args.merge_fanin, nlayers, il)
+        else:
+            for t,inp in zip(targets[1:], inputs):
+                # join subdatasets (different MC or Data subfolders, ex: TT_fullyHad, TT_semiLep, ...)
+                qlines.append('  {}, {}'.format(t, ' '.join(inp)))
         
-        jw.write_queue( qvars=('myoutput', 'myinputs'),
+        jw.write_queue( qvars=qvars,
                         qlines=qlines )
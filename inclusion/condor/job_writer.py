@@ -96,7 +96,7 @@ class JobWriter:
             raise ValueError('The mode {} is not supported.'.format(mode))
 
     def write_condor(self, filename, shell_exec, real_exec, outfile, logfile,
-                     queue, machine):
+                     queue, machine, cpus=1):
         self.filenames.append(filename)
         batch_name = os.path.dirname(shell_exec).split('/')[-1]
         m = self.endl.join(('Universe = vanilla',
@@ -110,7 +110,7 @@ class JobWriter:
                             'should_transfer_files = YES',
                             'notify_user = {}'.format(main.email),
                             'notification = Error', #options: complete, error, never
-                            self.condor_specific_content(queue=queue, machine=machine)))
+                            self.condor_specific_content(queue=queue, machine=machine, cpus=cpus)))
         m += self.endl
         with open(filename, 'w') as self.f:
             self.f.write(m)
@@ -163,7 +163,7 @@ class JobWriter:
             self.f.write(m)
         os.system('chmod u+rwx '+ filename)
 
-    def condor_specific_content(self, queue, machine):
+    def condor_specific_content(self, queue, machine, cpus=1):
         if 'llr' in machine:
             assert queue in ('short', 'long')
             assert machine in ('llrt3condor', 'llrt3condor7')
@@ -175,11 +175,13 @@ class JobWriter:
             elif machine == 'llrt3condor7':
                 t3 = "t3_tst"
             m += 2*self.endl + 'include : /opt/exp_soft/cms/t3/t3queue |'
+            if cpus > 1:
+                m += self.endl + 'request_cpus = {}'.format(cpus)
 
         elif machine == "lxplus":
             m = ('requirements = (OpSysAndVer =?= "AlmaLinux9")' +
                  self.endl + '+JobFlavour = "longlunch"' +
-                 self.endl + 'RequestCpus = 1'
+                 self.endl + 'RequestCpus = {}'.format(cpus)
                  )
            
             
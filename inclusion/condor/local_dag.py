@@ -0,0 +1,250 @@
+# coding: utf-8
+
+_all_ = [ 'LocalDAGExecutor', 'parse_dag', 'parse_submission' ]
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 3 * '/..')
+sys.path.insert(0, parent_dir)
+
+import re
+import json
+import time
+import shlex
+import hashlib
+import argparse
+import subprocess
+import collections
+import concurrent.futures as cf
+
+def parse_dag(fname):
+    """
+    Jobs and dependencies of a DAG written by `WriteDAGManager`.
+    Returns a dict mapping job ids to submission files, in order of appearance,
+    and a dict mapping job ids to the set of their parents.
+    """
+    jobs, parents = {}, {}
+    with open(fname) as f:
+        for line in f:
+            words = line.split()
+            if len(words) == 0:
+                continue
+            if words[0] == 'JOB':
+                jobs[words[1]] = words[2]
+                parents.setdefault(words[1], set())
+            elif words[0] == 'PARENT':
+                ichild = words.index('CHILD')
+                for child in words[ichild+1:]:
+                    parents.setdefault(child, set()).update(words[1:ichild])
+
+    for job, pars in parents.items():
+        missing = [x for x in pars | {job} if x not in jobs]
+        if missing:
+            mes = 'Jobs {} are used in dependencies but not defined in {}.'.format(missing, fname)
+            raise ValueError(mes)
+    return jobs, parents
+
+def _split_item(line, nvars):
+    """Same convention as HTCondor: the last variable gets the remainder of the line."""
+    return re.split(r'[,\s]+', line.strip(), maxsplit=nvars-1)
+
+def parse_submission(fname):
+    """
+    Executable, arguments, output and error files, requested cpus and queue items of a
+    submission file written by `JobWriter`. Each queue item is a dict of the queue variables.
+    """
+    sub = {'items': [{}]}
+    with open(fname) as f:
+        lines = [x.rstrip('\n') for x in f]
+
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        i += 1
+        if line.lower().startswith('queue'):
+            m = re.match(r'queue\s+(.+?)\s+from\s+\($', line, re.IGNORECASE)
+            if m is None:
+                continue
+            qvars = [x.strip() for x in m.group(1).split(',')]
+            sub['items'] = []
+            while lines[i].strip() != ')':
+                if lines[i].strip():
+                    sub['items'].append(dict(zip(qvars, _split_item(lines[i], len(qvars)))))
+                i += 1
+        elif '=' in line and not line.startswith(('#', '+')):
+            key, val = (x.strip() for x in line.split('=', 1))
+            sub[key.lower()] = val
+
+    # `request_cpus` (HTCondor) or `RequestCpus` (CERN)
+    sub['cpus'] = int(sub.get('request_cpus', sub.get('requestcpus', 1)))
+    return sub
+
+def _substitute(s, values):
+    return re.sub(r'\$\((\w+)\)', lambda m: str(values.get(m.group(1), m.group(0))), s)
+
+def _run_item(command, outfile, errfile):
+    start = time.time()
+    os.makedirs(os.path.dirname(outfile), exist_ok=True)
+    with open(outfile, 'w') as fout, open(errfile, 'w') as ferr:
+        proc = subprocess.run(command, stdout=fout, stderr=ferr)
+    return proc.returncode, time.time() - start
+
+class LocalDAGExecutor:
+    """
+    Runs the jobs of a DAG written by `WriteDAGManager` on the local machine,
+    without HTCondor. Each queue item of a submission file is run as a separate process,
+    using the cpus requested by its submission, and the running items use at most `workers` cpus.
+    Items start in order; an item requesting more than `workers` cpus runs alone.
+    A job starts when all its parents succeeded; the children of failed jobs are not run.
+    Completed items are recorded in a state file next to the DAG, so that a new execution
+    of the same DAG only runs what did not complete (unless `resume=False`).
+    """
+    def __init__(self, dagfile, workers=os.cpu_count() or 1, resume=True):
+        self.dagfile = dagfile
+        self.workers = workers
+        self.jobs, self.parents = parse_dag(dagfile)
+        self.subs = {job: parse_submission(sub) for job,sub in self.jobs.items()}
+
+        self.state_file = dagfile + '.local_state.json'
+        self.state = {}
+        if resume and os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                self.state = json.load(f)
+
+        # items of modified submission files are run again, together with all
+        # their descendants, whose inputs change
+        changed = set()
+        for job,sub in self.jobs.items():
+            with open(sub, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            if job not in self.state or self.state[job]['hash'] != digest:
+                self.state[job] = {'hash': digest, 'items': {}, 'wall': 0.}
+                changed.add(job)
+        for job in self.descendants(changed):
+            self.state[job]['items'], self.state[job]['wall'] = {}, 0.
+        self.status = {}
+
+    def descendants(self, jobs):
+        """All jobs depending, directly or not, on any of `jobs`."""
+        res, new = set(), set(jobs)
+        while new:
+            new = {x for x,pars in self.parents.items() if pars & new} - res
+            res |= new
+        return res
+
+    def commands(self, job):
+        """Command, output and error files of each queue item of a job."""
+        sub = self.subs[job]
+        cluster = list(self.jobs).index(job)
+        res = []
+        for iproc, values in enumerate(sub['items']):
+            values = dict(values, Cluster=cluster, Process=iproc)
+            args = shlex.split(_substitute(sub.get('arguments', '').strip('"'), values))
+            outfile = _substitute(sub.get('output', os.devnull), values)
+            errfile = _substitute(sub.get('error', os.devnull), values)
+            res.append(([sub['executable']] + args, outfile, errfile))
+        return res
+
+    def save_state(self):
+        with open(self.state_file, 'w') as f:
+            json.dump(self.state, f, indent=1)
+
+    def done(self, job):
+        return len(self.state[job]['items']) == len(self.subs[job]['items'])
+
+    def run(self):
+        """Runs all jobs. Returns whether all of them succeeded."""
+        for job in self.jobs:
+            self.status[job] = 'done' if self.done(job) else 'pending'
+        if any(x == 'done' for x in self.status.values()):
+            ndone = sum(x == 'done' for x in self.status.values())
+            print('Resuming: {} out of {} jobs already completed.'.format(ndone, len(self.jobs)), flush=True)
+
+        running, started, queued = {}, {}, collections.deque()
+        used = 0 # cpus of the running items
+        with cf.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                for job in self.jobs:
+                    if self.status[job] != 'pending':
+                        continue
+                    pstatus = [self.status[x] for x in self.parents[job]]
+                    if any(x in ('failed', 'skipped') for x in pstatus):
+                        self.status[job] = 'skipped'
+                    elif all(x == 'done' for x in pstatus):
+                        self.status[job] = 'running'
+                        started[job] = time.time()
+                        for iproc, (comm, out, err) in enumerate(self.commands(job)):
+                            if str(iproc) not in self.state[job]['items']:
+                                queued.append((job, iproc, self.subs[job]['cpus'], comm, out, err))
+                        self._check_job(job, running, queued, started)
+
+                while len(queued) > 0 and (used == 0 or used + queued[0][2] <= self.workers):
+                    job, iproc, cpus, comm, out, err = queued.popleft()
+                    running[pool.submit(_run_item, comm, out, err)] = (job, iproc, cpus, err)
+                    used += cpus
+
+                if len(running) == 0:
+                    break
+
+                finished, _ = cf.wait(running, return_when=cf.FIRST_COMPLETED)
+                for fut in finished:
+                    job, iproc, cpus, err = running.pop(fut)
+                    used -= cpus
+                    code, seconds = fut.result()
+                    if code == 0:
+                        self.state[job]['items'][str(iproc)] = seconds
+                    else:
+                        print('Job {} item {} failed with exit code {}. See {}.'.format(
+                            job, iproc, code, err), flush=True)
+                        self.status[job] = 'failed'
+                    self._check_job(job, running, queued, started)
+                self.save_state()
+
+        self.save_state()
+        self.print_report()
+        return all(x == 'done' for x in self.status.values())
+
+    def _check_job(self, job, running, queued, started):
+        if self.status[job] != 'running' or any(x[0] == job for x in list(running.values()) + list(queued)):
+            return
+        if self.done(job):
+            self.status[job] = 'done'
+            self.state[job]['wall'] = time.time() - started[job]
+            print('Job {} done in {:.1f} s.'.format(job, self.state[job]['wall']), flush=True)
+        else:
+            self.status[job] = 'failed'
+
+    def report(self):
+        """One line per job with its status, number of items, wall time and summed time of the items."""
+        line = '{:<50} {:>8} {:>6} {:>10} {:>10}'
+        lines = [line.format('Job', 'Status', 'Items', 'Wall [s]', 'Sum [s]')]
+        for job in self.jobs:
+            st = self.state[job]
+            lines.append(line.format(job, self.status.get(job, 'pending'), len(self.subs[job]['items']),
+                                     '{:.1f}'.format(st['wall']),
+                                     '{:.1f}'.format(sum(st['items'].values()))))
+        return '\n'.join(lines)
+
+    def print_report(self):
+        print(self.report(), flush=True)
+
+    def write_report(self, fname):
+        with open(fname, 'w') as f:
+            f.write(self.report() + '\n')
+
+# -- Parse options
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a DAG of HTCondor jobs locally.')
+    parser.add_argument('--dag', required=True, help='DAG file written by WriteDAGManager')
+    parser.add_argument('--workers', default=os.cpu_count() or 1, type=int,
+                        help='Maximum number of cpus used at the same time, following the cpus requested by each job.')
+    parser.add_argument('--no_resume', action='store_true',
+                        help='Run all jobs again, ignoring the ones completed by previous executions.')
+    parser.add_argument('--report', default=None, help='File where the timing report is written.')
+    args = parser.parse_args()
+
+    executor = LocalDAGExecutor(args.dag, workers=args.workers, resume=not args.no_resume)
+    success = executor.run()
+    if args.report is not None:
+        executor.write_report(args.report)
+    sys.exit(0 if success else 1)
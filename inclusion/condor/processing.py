@@ -1,6 +1,6 @@
 # coding: utf-8
 
-_all_ = [ 'processing', 'processing_outputs' ]
+_all_ = [ 'processing', 'processing_outputs', 'job_plan', 'planned_outputs' ]
 
 import os
 import sys
@@ -8,12 +8,16 @@ parent_dir = os.path.abspath(__file__ + 3 * '/..')
 sys.path.insert(0, parent_dir)
 
 import inclusion
+from inclusion import selection
 from inclusion.config import main
-from inclusion.utils import utils
+from inclusion.utils import utils, catalog, throughput, histos
+from inclusion.utils import counts as trigcounts
 from inclusion.condor.job_writer import JobWriter
 
 import re
+import json
 import argparse
+import importlib
 
 def produce_trigger_outputs_sample(args, sample, ext):
     """
@@ -26,7 +30,7 @@ def produce_trigger_outputs_sample(args, sample, ext):
     t = []
     exp = re.compile('.+output(_[0-9]{1,5}).root')
 
-    inputs, _ = utils.get_root_inputs(sample, args.indir)
+    inputs, _ = catalog.get_root_inputs(sample, args.indir, catalog=args.catalog)
 
     folder = os.path.join( args.outdir, proc )
     for inp in inputs:
@@ -51,12 +55,195 @@ def produce_trigger_outputs(args, ext='root'):
         tmc.extend( produce_trigger_outputs_sample(args, proc, ext) )
     return tdata, tmc
 
+def group_input_files(filelist, files_per_job):
+    """
+    Splits the input files of a sample into jobs of at most `files_per_job` files.
+    Files from different folders are never grouped, since each folder
+    has its own sum of weights.
+    """
+    folders = {}
+    for f in filelist:
+        f = f.replace('\n', '')
+        folders.setdefault(os.path.dirname(f), []).append(f)
+
+    groups = []
+    for files in folders.values():
+        groups.extend(files[i:i+files_per_job] for i in range(0, len(files), files_per_job))
+    return groups
+
+def pack_input_files(filelist, events, budget):
+    """
+    Splits the input files of a sample into jobs processing at most `budget` events,
+    filling one job at a time. Files larger than the budget get their own job.
+    Files from different folders are never grouped.
+    """
+    folders = {}
+    for f,nev in zip(filelist, events):
+        folders.setdefault(os.path.dirname(f), []).append((f, nev))
+
+    groups = []
+    for items in folders.values():
+        current, total = [], 0
+        for f,nev in items:
+            if current and total + nev > budget:
+                groups.append(current)
+                current, total = [], 0
+            current.append(f)
+            total += nev
+        groups.append(current)
+    return groups
+
+def plan_jobs(args, filelist):
+    """
+    Input files, number of events and expected duration in seconds of each job.
+    With a catalog, files are packed to stay within the `job_events` budget or, if not
+    provided, within `job_hours`, using the event rate measured by earlier jobs.
+    Otherwise, or without any budget, files are grouped by `files_per_job`, and the
+    number of events and the duration are unknown (`None`).
+    """
+    filelist = [x.replace('\n', '') for x in filelist]
+    if args.catalog is None:
+        return [(x, None, None) for x in group_input_files(filelist, args.files_per_job)]
+
+    backend = 'root' if args.mode == 'counts' else args.backend
+    # per cpu
+    rate = throughput.event_rate([args.outdir] + list(args.calibration), args.mode, backend)
+    events = {}
+    for f in filelist:
+        nev = catalog.file_info(f, args.catalog)['entries']
+        events[f] = 0 if nev is None else nev # corrupted files
+
+    if args.job_events is not None:
+        groups = pack_input_files(filelist, [events[x] for x in filelist], args.job_events)
+    elif args.job_hours is not None:
+        budget = max(args.job_hours * 3600. - throughput.job_overhead, 0.) * rate * args.cpus_per_job
+        groups = pack_input_files(filelist, [events[x] for x in filelist], budget)
+    else:
+        groups = group_input_files(filelist, args.files_per_job)
+
+    jobs = []
+    for files in groups:
+        nev = sum(events[x] for x in files)
+        jobs.append((files, nev, throughput.job_overhead + nev / (rate * args.cpus_per_job)))
+    return jobs
+
+@utils.set_pure_input_namespace
+def processing_report(args):
+    """
+    Dry run: prints the planned jobs of each sample, the expected CPU hours
+    and the largest job, without writing any file.
+    """
+    line = '{:<30} {:>7} {:>6} {:>14} {:>10} {:>16}'
+    print(line.format('Sample', 'Files', 'Jobs', 'Events', 'CPU [h]', 'Largest job [h]'))
+    total = {'files': 0, 'jobs': 0, 'events': 0, 'hours': 0., 'largest': 0.}
+    plan = job_plan(args, save=False)
+    for vproc in tuple(args.data_vals) + tuple(args.mc_vals):
+        jobs = plan[vproc]
+        nfiles = sum(len(x[0]) for x in jobs)
+        total['files'] += nfiles
+        total['jobs'] += len(jobs)
+        if args.catalog is None:
+            print(line.format(vproc, nfiles, len(jobs), '-', '-', '-'))
+            continue
+
+        nev = sum(x[1] for x in jobs)
+        hours = sum(x[2] for x in jobs) * args.cpus_per_job / 3600.
+        largest = max(x[2] for x in jobs) / 3600.
+        print(line.format(vproc, nfiles, len(jobs), nev, '{:.2f}'.format(hours), '{:.2f}'.format(largest)))
+        total['events'] += nev
+        total['hours'] += hours
+        total['largest'] = max(total['largest'], largest)
+
+    if args.catalog is None:
+        print(line.format('Total', total['files'], total['jobs'], '-', '-', '-'))
+    else:
+        print(line.format('Total', total['files'], total['jobs'], total['events'],
+                          '{:.2f}'.format(total['hours']), '{:.2f}'.format(total['largest'])))
+    return total
+
+def plan_path(args):
+    """Stored job plan of the tag, next to the catalog."""
+    return os.path.join(os.path.dirname(args.catalog), 'jobs_{}.json'.format(args.mode))
+
+def plan_settings(args):
+    """Options defining how the input files are grouped into jobs."""
+    return {'files_per_job' : args.files_per_job,
+            'job_hours'     : args.job_hours,
+            'job_events'    : args.job_events,
+            'cpus_per_job'  : args.cpus_per_job,
+            'backend'       : 'root' if args.mode == 'counts' else args.backend}
+
+def job_plan(args, save=True):
+    """
+    Planned jobs of each sample, see `plan_jobs`.
+    With a catalog, the plan is computed once per tag and stored next to the catalog:
+    the event rate changes as jobs record their timing, and a different grouping of the
+    files would rename the outputs and leave the previous ones to be merged as well.
+    """
+    samples = tuple(args.data_vals) + tuple(args.mc_vals)
+    if args.catalog is None:
+        return {vproc: plan_jobs(args, catalog.get_root_inputs(vproc, args.indir)[0])
+                for vproc in samples}
+
+    fname = plan_path(args)
+    settings = plan_settings(args)
+    stored = {}
+    if os.path.exists(fname):
+        with open(fname) as f:
+            content = json.load(f)
+        if content['settings'] != settings:
+            mes = ('The jobs of {} were planned with {}, but {} were requested. '
+                   'Use a new tag or remove the plan.').format(fname, content['settings'], settings)
+            raise ValueError(mes)
+        stored = content['samples']
+
+    plan, missing = {}, False
+    for vproc in samples:
+        filelist, _ = catalog.get_root_inputs(vproc, args.indir, catalog=args.catalog)
+        filelist = [x.replace('\n', '') for x in filelist]
+        if vproc in stored:
+            plan[vproc] = [tuple(x) for x in stored[vproc]]
+            if sorted(f for x in plan[vproc] for f in x[0]) != sorted(filelist):
+                mes = ('The input files of sample {} changed since its jobs were planned in {}. '
+                       'Use a new tag or remove the plan.').format(vproc, fname)
+                raise ValueError(mes)
+        else:
+            plan[vproc] = plan_jobs(args, filelist)
+            missing = True
+
+    if save and missing:
+        stored.update(plan)
+        with open(fname, 'w') as f:
+            json.dump({'settings': settings, 'samples': stored}, f)
+    return plan
+
+@utils.set_pure_input_namespace
+def planned_outputs(args):
+    """
+    Files written by the planned jobs of each sample, named after the first input file of each job.
+    `kind` selects the histograms, written with `tprefix`, or the counts, written with
+    `counts_tprefix` in the fused mode and with `tprefix` otherwise.
+    """
+    plan = job_plan(args)
+    outputs = {}
+    for vproc, jobs in plan.items():
+        outdir = os.path.join(args.outdir, vproc)
+        if args.kind == 'histos':
+            outputs[vproc] = [histos.output_name(outdir, args.tprefix, vproc, x[0][0], args.subtag, args.histos_format)
+                              for x in jobs]
+        else:
+            tprefix = args.counts_tprefix if args.mode == 'fused' else args.tprefix
+            outputs[vproc] = [trigcounts.output_name(outdir, tprefix, x[0][0], args.subtag) for x in jobs]
+    return outputs
+
 @utils.set_pure_input_namespace
 def processing_outputs(args):
     if args.mode == 'histos':
         name = 'Histos'
     elif args.mode == 'counts':
         name = 'Counts'
+    elif args.mode == 'fused':
+        name = 'Fused'
     else:
         raise ValueError('Mode {} is not supported.'.format(args.mode))
 
@@ -79,30 +266,42 @@ def processing(args):
     outs_check  = outs_data[2] + outs_mc[2]
     outs_log    = outs_data[3] + outs_mc[3]
     _all_processes = _data_procs + _mc_procs
+    if args.mode in ('histos', 'fused') and args.backend == 'columnar':
+        config_module = importlib.import_module(args.configuration)
+        selection.ColumnarEventSelection.check_category(config_module.category)
+    plan = job_plan(args)
 
     for i, (kproc, vproc) in enumerate(_all_processes):
-        filelist, _ = utils.get_root_inputs(vproc, args.indir)
+        jobs = plan[vproc]
         
         #### Write shell executable (python scripts must be wrapped in shell files to run on HTCondor)
         pars = {'outdir'        : args.outdir,
                 'dataset'       : kproc,
                 'sample'        : vproc,
                 'isdata'        : int(vproc in args.data_vals),
-                'file'          : '${1}',
+                'file'          : '${@}',
                 'subtag'        : args.subtag,
                 'channels'      : ' '.join(args.channels),
                 'tprefix'       : args.tprefix,
+                'ncpus'         : args.cpus_per_job,
                 'year'          : args.year,
                 'configuration' : args.configuration}
-        script = ('produce_trig_histos.py' if args.mode == 'histos'
-                  else 'produce_trig_counts.py')
+        if args.catalog is not None:
+            pars['catalog'] = args.catalog
+        # the fused mode produces histograms and counts in a single pass
+        script = ('produce_trig_counts.py' if args.mode == 'counts'
+                  else 'produce_trig_histos.py')
         comm = utils.build_script_command(name=script, sep=' ', **pars)
 
-        if args.mode == 'histos':
+        if args.mode in ('histos', 'fused'):
             pars1 = {'binedges_fname'   : args.binedges_filename,
                      'intersection_str' : args.intersection_str,
                      'variables'        : ' '.join(args.variables,),
-                     'nocut_dummy_str'  : args.nocut_dummy_str}
+                     'nocut_dummy_str'  : args.nocut_dummy_str,
+                     'backend'          : args.backend,
+                     'output_format'    : args.histos_format}
+            if args.mode == 'fused':
+                pars1['counts_tprefix'] = args.counts_tprefix
             comm += utils.build_script_command(name=None, sep=' ', **pars1)
 
         jw = JobWriter()
@@ -116,11 +315,12 @@ def processing(args):
                         outfile=outs_check[i],
                         logfile=outs_log[i],
                         queue=main.queue,
-                        machine=main.machine)
+                        machine=main.machine,
+                        cpus=args.cpus_per_job)
         
         qlines = []
-        for listname in filelist:
-            qlines.append(' {}'.format( listname.replace('\n','') ))
+        for files, _, _ in jobs:
+            qlines.append(' {}'.format(' '.join(files)))
         
         jw.write_queue( qvars=('filename',),
                         qlines=qlines )
@@ -136,6 +336,10 @@ if __name__ == '__main__':
     parser.add_argument('--tag', required=True, help='tag')
     parser.add_argument('--subtag', required=True, help='subtag')
     parser.add_argument('--tprefix', required=True, help='target prefix')
+    parser.add_argument('--mode', required=True, choices=('histos', 'counts', 'fused'),
+                        help='Which outputs to produce. The fused mode writes histograms and counts in one pass.')
+    parser.add_argument('--counts_tprefix', default=None,
+                        help='Counts target prefix, used by the fused mode.')
     parser.add_argument('--year', required=True, type=str,
                         choices=('2016', '2016APV', '2017', '2018'),
                         help='Data year: impact thresholds and selections.')
@@ -155,6 +359,27 @@ if __name__ == '__main__':
                         help='Dummy string associated to trigger histograms were no cuts are applied.')
     parser.add_argument('--configuration', required=True,
                         help='Name of the configuration module to use.')
+    parser.add_argument('--backend', default='root', choices=('root', 'columnar'),
+                        help='Event loop with PyROOT or columnar processing with uproot and numpy.')
+    parser.add_argument('--catalog', default=None,
+                        help='Catalog of input files. The input directories are inspected if not provided.')
+    parser.add_argument('--files_per_job', default=1, type=int,
+                        help='Maximum number of input files processed by each job.')
+    parser.add_argument('--job_hours', default=None, type=float,
+                        help='Expected duration of each job, when a catalog is provided.')
+    parser.add_argument('--job_events', default=None, type=int,
+                        help='Maximum number of events processed by each job, when a catalog is provided.')
+    parser.add_argument('--calibration', default=(), nargs='+', type=str,
+                        help='Output directories of earlier runs, to measure the processing rate.')
+    parser.add_argument('--cpus_per_job', default=1, type=int,
+                        help='Number of cpus requested by each job, processing entry ranges in parallel.')
+    parser.add_argument('--histos_format', default='root', choices=('root', 'hdf5'),
+                        help='Format of the histogram files.')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='Print the planned jobs instead of writing them.')
     args = parser.parse_args()
 
-    submitTriggerEff( args )
+    if args.dry_run:
+        processing_report(args)
+    else:
+        processing(args)
@@ -0,0 +1,55 @@
+# coding: utf-8
+
+_all_ = [ 'render_eff_and_sf', 'render_eff_and_sf_outputs' ]
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 3 * '/..')
+sys.path.insert(0, parent_dir)
+
+import inclusion
+from inclusion.config import main
+from inclusion.utils import utils
+from inclusion.condor.job_writer import JobWriter
+
+@utils.set_pure_input_namespace
+def render_eff_and_sf_outputs(args):
+    job_f, subm_f, check_f, log_f = JobWriter.define_output( localdir=args.localdir,
+                                                             data_folders='EffAndSFRender',
+                                                             tag=args.tag )
+    return job_f[0], subm_f[0], check_f[0], log_f[0]
+
+@utils.set_pure_input_namespace
+def render_eff_and_sf(args):
+    """
+    A single job drawing the plots of all trigger intersections from the results stores,
+    with `render_cpus` processes.
+    """
+    outs_job, outs_submit, outs_check, outs_log = render_eff_and_sf_outputs(args)
+
+    #### Write shell executable (python scripts must be wrapped in shell files to run on HTCondor)
+    pars = {'indir'  : args.indir,
+            'subtag' : args.subtag,
+            'ncpus'  : args.render_cpus}
+    if args.formats:
+        pars['formats'] = ' '.join(args.formats)
+
+    script = 'render_eff_and_sf.py'
+    comm = utils.build_script_command(name=script, sep=' ', **pars)
+    if args.debug:
+        comm += '--debug '
+
+    jw = JobWriter()
+    jw.write_shell(filename=outs_job, command=comm, localdir=args.localdir, machine=main.machine)
+    jw.add_string('echo "{} done."'.format(script))
+
+    #### Write submission file
+    jw.write_condor(filename=outs_submit,
+                    real_exec=utils.build_script_path(script),
+                    shell_exec=outs_job,
+                    outfile=outs_check,
+                    logfile=outs_log,
+                    queue=main.queue,
+                    machine=main.machine,
+                    cpus=args.render_cpus)
+    jw.write_queue()
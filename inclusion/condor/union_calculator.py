@@ -9,7 +9,7 @@ sys.path.insert(0, parent_dir)
 
 import inclusion
 from inclusion.config import main
-from inclusion.utils import utils
+from inclusion.utils import utils, catalog
 from inclusion.condor.job_writer import JobWriter
 
 @utils.set_pure_input_namespace
@@ -30,7 +30,7 @@ def union_calculator(args):
     jw = JobWriter()
 
     for i,proc in enumerate(args.mc_processes):
-        filelist, inputdir = utils.get_root_inputs(proc, args.indir_root)
+        filelist, inputdir = catalog.get_root_inputs(proc, args.indir_root, catalog=args.catalog)
 
         #### Write shell executable (python scripts must be wrapped in shell files to run on HTCondor)
         pars = {'indir_root'             : inputdir,
@@ -98,6 +98,9 @@ trig_map = {'2018':
             }
 trig_map['2016APV'] = trig_map['2016']
 
+# first run where the HPS versions of the `*Custom` tau triggers are available in data
+hps_run_boundary = 317509
+
 lep_triggers = {'2018':
                 {'Ele32', 'EleIsoTauCustom', 'IsoMu24', 'IsoMuIsoTauCustom', 'IsoDoubleTauCustom'},
                 '2017':
@@ -15,7 +15,7 @@ from argparse import RawTextHelpFormatter
 
 import config
 from config import main
-from utils import utils, luigi_utils as lutils
+from utils import utils, catalog, merging, luigi_utils as lutils
 from scripts import def_bins
 from condor import (
     closure,
@@ -26,7 +26,9 @@ from condor import (
     hadd_counts,
     hadd_histo,
     job_writer,
+    local_dag,
     processing,
+    render_eff_and_sf,
     union_calculator,
     )
 
@@ -51,6 +53,118 @@ parser.add_argument(
     default='local',
     help='Select the scheduler for luigi.'
     )
+parser.add_argument(
+    '--backend',
+    type=str,
+    choices=['root', 'columnar'],
+    default='root',
+    help='Event processing of the histogram production: PyROOT event loop or columnar (uproot+numpy).'
+    )
+parser.add_argument(
+    '--files_per_job',
+    type=int,
+    default=10,
+    help='Maximum number of input files processed by each histogram or counts job (used only without time or event budgets).'
+    )
+parser.add_argument(
+    '--job_hours',
+    type=float,
+    default=None,
+    help='Expected duration of each histogram or counts job. Input files are packed according to their number of events. By default, files are grouped by --files_per_job.'
+    )
+parser.add_argument(
+    '--job_events',
+    type=int,
+    default=None,
+    help='Maximum number of events processed by each histogram or counts job. Takes precedence over --job_hours.'
+    )
+parser.add_argument(
+    '--calibration',
+    type=str,
+    nargs='+',
+    default=(),
+    help='Data storage folders of earlier runs, to measure the processing rate. The folder of the current tag is always used.'
+    )
+parser.add_argument(
+    '--cpus_per_job',
+    type=int,
+    default=1,
+    help='Number of cpus requested by each histogram or counts job. Input files are split into entry ranges processed in parallel.'
+    )
+parser.add_argument(
+    '--jobs_report',
+    action='store_true',
+    help='Print the planned histogram and counts jobs (number, CPU hours, largest job) and exit.'
+    )
+parser.add_argument(
+    '--merge_fanin',
+    type=int,
+    default=20,
+    help='Maximum number of files added by each merging job. The histograms and counts of each sample\nare merged by a tree of jobs running in parallel layers. Zero merges each sample in a single job.'
+    )
+parser.add_argument(
+    '--eff_cpus',
+    type=int,
+    default=0,
+    help='Compute the efficiencies and scale factors of all trigger intersections in a single job using this number of cpus.\nZero submits one job per intersection.'
+    )
+parser.add_argument(
+    '--no_plots',
+    action='store_true',
+    help='Do not draw the efficiency and scale factor plots. The numeric outputs and results stores are always written.'
+    )
+parser.add_argument(
+    '--plot_formats',
+    type=str,
+    nargs='+',
+    default=None,
+    help='Formats of the efficiency and scale factor plots, drawn by a separate job from the results stores\n(default: png, pdf and C for 1D plots, png and pdf for 2D plots).'
+    )
+parser.add_argument(
+    '--render_cpus',
+    type=int,
+    default=4,
+    help='Number of cpus of the job drawing the efficiency and scale factor plots.'
+    )
+parser.add_argument(
+    '--histos_format',
+    type=str,
+    choices=['root', 'hdf5'],
+    default='hdf5',
+    help='Format of the intermediate histograms. HDF5 shards are merged as arrays and read partially\nby the efficiency step; the aggregated histograms are also exported to ROOT.'
+    )
+parser.add_argument(
+    '--executor',
+    type=str,
+    choices=['condor', 'local'],
+    default='condor',
+    help='Run the jobs of the DAG with HTCondor or with a local pool of processes.\nThe local executor resumes from the jobs completed by earlier local executions.'
+    )
+parser.add_argument(
+    '--local_workers',
+    type=int,
+    default=os.cpu_count() or 1,
+    help='Number of cpus used at the same time by the local executor, following the cpus requested by each job (default: number of cores).'
+    )
+parser.add_argument(
+    '--binning_workers',
+    type=int,
+    default=os.cpu_count() or 1,
+    help='Number of local workers reading files in parallel to define the binning (default: number of cores).'
+    )
+parser.add_argument(
+    '--binning_pool',
+    type=str,
+    choices=['process', 'thread'],
+    default='process',
+    help='Type of local workers defining the binning.'
+    )
+parser.add_argument(
+    '--binning_fraction',
+    type=float,
+    default=0.05,
+    help='Fraction of the data files used to estimate the quantiles of the binning. Files are randomly chosen within each folder.'
+    )
 parser.add_argument(
     '--data',
     type=str,
@@ -164,6 +278,7 @@ data_storage = os.path.join(main.storage[FLAGS.year], FLAGS.tag, 'Data' )
 out_storage = os.path.join(main.storage[FLAGS.year], FLAGS.tag, 'Outputs')
 targets_folder = os.path.join(data_storage, 'targets')    
 binedges_filename = os.path.join(data_storage, 'binedges.hdf5')
+catalog_filename = os.path.join(data_storage, 'catalog.json')
 
 subtag = ( FLAGS.subtag if FLAGS.subtag==''
            else ( '_' + FLAGS.subtag if FLAGS.subtag[0] != '_' else FLAGS.subtag ) )
@@ -173,6 +288,13 @@ variables_join = tuple(set(FLAGS.variables_for_efficiencies + FLAGS.variables_fo
 
 sel_config = 'inclusion.config.' + FLAGS.configuration
 
+#### utils/catalog
+catalog_params = {'catalog_filename' : catalog_filename,
+                  'indir'            : main.inputs[FLAGS.year],
+                  'data_vals'        : data_vals,
+                  'mc_vals'          : mc_vals,
+                  'debug'            : FLAGS.debug_workflow}
+
 #### scripts/def_bins
 bins_params = {'nbins'             : FLAGS.nbins,
                'binedges_filename' : binedges_filename,
@@ -185,6 +307,11 @@ bins_params = {'nbins'             : FLAGS.nbins,
                'tag'               : FLAGS.tag,
                'subtag'            : subtag,
                'configuration'     : sel_config,
+               'catalog'           : catalog_filename,
+               'sample_fraction'   : FLAGS.binning_fraction,
+               'compression'       : 200,
+               'workers'           : FLAGS.binning_workers,
+               'pool'              : FLAGS.binning_pool,
                'debug'             : FLAGS.debug_workflow}
 
 #### condor/dag
@@ -208,21 +335,43 @@ histos_params = {'binedges_filename' : binedges_filename,
                  'subtag'            : subtag,
                  'intersection_str'  : main.inters_str,
                  'nocut_dummy_str'   : main.nocut_dummy,
+                 'backend'           : FLAGS.backend,
+                 'files_per_job'     : FLAGS.files_per_job,
+                 'job_hours'         : FLAGS.job_hours,
+                 'job_events'        : FLAGS.job_events,
+                 'calibration'       : FLAGS.calibration,
+                 'cpus_per_job'      : FLAGS.cpus_per_job,
+                 'catalog'           : catalog_filename,
+                 'counts_tprefix'    : main.pref['counts'],
+                 'histos_format'     : FLAGS.histos_format,
                  'configuration'     : sel_config}
 
+#### merging trees of histograms and counts
+merge_depth = 1
+if FLAGS.merge_fanin > 0:
+    # bounded by the sample with most input files, since each job processes at least one;
+    # the files are only counted, their metadata is left to BuildCatalog
+    nfiles = max(catalog.sample_nfiles(catalog_params).values())
+    merge_depth = merging.tree_depth(nfiles, FLAGS.merge_fanin)
+
 #### scripts/hadd_histo
-haddhisto_params = {'indir'    : data_storage,
-                    'localdir' : main.base_folder[main.machine],
-                    'tag'      : FLAGS.tag,
-                    'subtag'   : subtag, }
+haddhisto_params = {'indir'       : data_storage,
+                    'localdir'    : main.base_folder[main.machine],
+                    'tag'         : FLAGS.tag,
+                    'subtag'      : subtag,
+                    'merge_fanin' : FLAGS.merge_fanin,
+                    'merge_depth' : merge_depth,
+                    'histos_format' : FLAGS.histos_format, }
 
 #### scripts/add_counts
-haddcounts_params = {'indir'    : data_storage,
-                     'outdir'   : out_storage,
-                     'localdir'  : main.base_folder[main.machine],
-                     'tag'      : FLAGS.tag,
-                     'subtag'   : subtag,
-                     'channels' : FLAGS.channels, }
+haddcounts_params = {'indir'       : data_storage,
+                     'outdir'      : out_storage,
+                     'localdir'    : main.base_folder[main.machine],
+                     'tag'         : FLAGS.tag,
+                     'subtag'      : subtag,
+                     'channels'    : FLAGS.channels,
+                     'merge_fanin' : FLAGS.merge_fanin,
+                     'merge_depth' : merge_depth, }
 
 #### scripts/run_eff_and_sf
 sf_params = {'data_name'            : data_name,
@@ -241,6 +390,7 @@ sf_params = {'data_name'            : data_name,
              'canvas_prefix'        : main.pref['canvas'],
              'intersection_str'     : main.inters_str,
              'nocut_dummy_str'      : main.nocut_dummy,
+             'eff_cpus'             : FLAGS.eff_cpus,
              'debug'                : FLAGS.debug_workflow,}
 
 sfagg_params = {'indir'       : out_storage,
@@ -253,6 +403,15 @@ sfagg_params = {'indir'       : out_storage,
                 'file_prefix' : main.pref['sf'],
                 'debug'       : FLAGS.debug_workflow,}
 
+#### scripts/render_eff_and_sf
+render_params = {'indir'       : out_storage,
+                 'localdir'    : main.base_folder[main.machine],
+                 'tag'         : FLAGS.tag,
+                 'subtag'      : subtag,
+                 'formats'     : FLAGS.plot_formats,
+                 'render_cpus' : FLAGS.render_cpus,
+                 'debug'       : FLAGS.debug_workflow,}
+
 #### scripts/discriminator
 discriminator_params = {'indir'            : data_storage,
                         'outdir'           : data_storage,
@@ -282,6 +441,7 @@ calculator_params = {'binedges_filename'       : binedges_filename,
                      'tag'                     : FLAGS.tag,
                      'subtag'                  : subtag,
                      'configuration'           : sel_config,
+                     'catalog'                 : catalog_filename,
                      'debug'                   : FLAGS.debug_workflow,}
 
 #### scripts/closure
@@ -313,8 +473,46 @@ def get_target_path(taskname, targets_dir):
                                re_txt.sub('_'+taskname+'.txt', main.targ_def)) 
     return target_path
 
+def fused_processing(branch):
+    """Whether histograms and counts are produced by the same (single-pass) jobs."""
+    return branch in ('all', 'extra')
+
+def processing_outputs(kind):
+    """Histograms or counts files written by the planned processing jobs of each sample."""
+    mode = 'fused' if fused_processing(FLAGS.branch) else kind
+    params = dict(histos_params, mode=mode, kind=kind,
+                  tprefix=main.pref['counts' if mode == 'counts' else 'histos'])
+    return processing.planned_outputs(params)
+
 
 #### Tasks
+
+class BuildCatalog(luigi.Task):
+    """
+    Catalog the input files: lists, entries, sizes and sums of weights.
+    Rebuilt whenever an input file list changes; unmodified files are not opened again.
+    """
+    args = utils.dot_dict(catalog_params)
+
+    def complete(self):
+        return catalog.is_up_to_date(self.args)
+
+    @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
+    def output(self):
+        target = catalog.build_catalog_outputs(self.args)
+
+        #write the target files for debugging
+        target_path = get_target_path(self.__class__.__name__, targets_folder)
+        utils.remove(target_path)
+        with open(target_path, 'w') as f:
+            f.write( target + '\n' )
+
+        return luigi.LocalTarget(target)
+
+    @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
+    def run(self):
+        catalog.build_catalog(self.args)
+
  
 class DefineBinning(luigi.Task):
     """Calculate the most adequate binning based on data."""
@@ -335,19 +533,26 @@ class DefineBinning(luigi.Task):
     @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
     def run(self):
         def_bins.define_binning(self.args)
+
+    @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
+    def requires(self):
+        return BuildCatalog()
  
  
 class Processing(lutils.ForceRun):
     """Write htcondor files for total and passed trigger histograms."""
     params = utils.dot_dict(histos_params)
  
-    mode = luigi.ChoiceParameter(choices=('histos', 'counts'),
+    mode = luigi.ChoiceParameter(choices=('histos', 'counts', 'fused'),
                                  var_type=str)
+
+    def set_mode(self):
+        self.params['mode'] = self.mode
+        self.params['tprefix'] = main.pref['counts' if self.mode == 'counts' else 'histos']
     
     @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
     def output(self):
-        self.params['mode'] = self.mode
-        self.params['tprefix'] = main.pref[self.mode]
+        self.set_mode()
         obj_data, obj_mc, _, _ = processing.processing_outputs(self.params)
         o1_1, o1_2, _, _ = obj_data
         o2_1, o2_2, _, _ = obj_mc
@@ -366,8 +571,7 @@ class Processing(lutils.ForceRun):
     
     @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
     def run(self):
-        self.params['mode'] = self.mode
-        self.params['tprefix'] = main.pref[self.mode]
+        self.set_mode()
         processing.processing(self.params)
  
     @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
@@ -402,7 +606,13 @@ class HaddHisto(lutils.ForceRun):
     def run(self):
         self.args['samples'] = lutils.luigi_to_raw( self.samples )
         self.args['dataset_name'] = self.dataset_name
+        self.args['merge_inputs'] = processing_outputs('histos')
         hadd_histo.hadd_histo( self.args )
+
+    @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
+    def requires(self):
+        # the merged files follow the planned processing jobs
+        return BuildCatalog()
  
  
 class HaddCounts(lutils.ForceRun):
@@ -433,7 +643,13 @@ class HaddCounts(lutils.ForceRun):
     def run(self):
         self.args['samples'] = lutils.luigi_to_raw(self.samples)
         self.args['dataset_name'] = self.dataset_name
+        self.args['merge_inputs'] = processing_outputs('counts')
         hadd_counts.hadd_counts( self.args )
+
+    @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
+    def requires(self):
+        # the merged files follow the planned processing jobs
+        return BuildCatalog()
  
  
 class EffAndSF(lutils.ForceRun):
@@ -488,6 +704,33 @@ class EffAndSFAggr(lutils.ForceRun):
         eff_and_sf_aggr.eff_and_sf_aggr(self.params)
  
  
+class EffAndSFRender(lutils.ForceRun):
+    """
+    Write htcondor files for drawing the efficiency and scale factor plots from the results stores.
+    Not needed for the following steps.
+    """
+    params = utils.dot_dict(render_params)
+
+    @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
+    def output(self):
+        o1, o2, _, _ = render_eff_and_sf.render_eff_and_sf_outputs(self.params)
+
+        target_path = get_target_path(self.__class__.__name__,
+                                             targets_folder)
+        utils.remove( target_path )
+        with open( target_path, 'w' ) as f:
+            f.write( o1 + '\n' )
+            f.write( o2 + '\n' )
+
+        _c1 = lutils.convert_to_luigi_local_targets(o1)
+        _c2 = lutils.convert_to_luigi_local_targets(o2)
+        return _c1 + _c2
+
+    @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
+    def run(self):
+        render_eff_and_sf.render_eff_and_sf(self.params)
+
+
 class Discriminator(lutils.ForceRun):
     """Write htcondor files for the variable discriminator."""
     params = utils.dot_dict(discriminator_params)
@@ -569,6 +812,7 @@ class Dag(lutils.ForceRun):
     p_hadd_counts = utils.dot_dict(haddhisto_params)
     p_eff_sf      = utils.dot_dict(sf_params)
     p_eff_sf_agg  = utils.dot_dict(sfagg_params)
+    p_render      = utils.dot_dict(render_params)
     p_disc        = utils.dot_dict(discriminator_params)
     p_calc        = utils.dot_dict(calculator_params)
     p_closure     = utils.dot_dict(closure_params)
@@ -612,23 +856,33 @@ class Dag(lutils.ForceRun):
         
         subm_eff_sf = eff_and_sf.eff_and_sf_outputs(self.p_eff_sf)[1]
         subm_eff_sf_agg = eff_and_sf_aggr.eff_and_sf_aggr_outputs(self.p_eff_sf_agg)[1]
+        subm_render = render_eff_and_sf.render_eff_and_sf_outputs(self.p_render)[1]
         subm_disc = discriminator.discriminator_outputs(self.p_disc)[1]
         # subm_union = union_calculator.union_calculator_outputs(self.p_calc)[1]
         # subm_closure = closure.closure_outputs(self.p_closure)
 
         jobs = {}
+        if fused_processing(self.branch):
+            self.p_histos['mode'] = 'fused'
+            obj_fdata, obj_fmc, _, _ = processing.processing_outputs(self.p_histos)
+            jobs.update({'FusedData' : obj_fdata[1],
+                         'FusedMC'   : obj_fmc[1]})
         if self.branch != 'nocounts':
-            jobs.update({'CountsData'    : subm_cdata,
-                         'CountsMC'      : subm_cmc,                
-                         'HaddCountsData': subm_hadd_cdata,
+            if not fused_processing(self.branch):
+                jobs.update({'CountsData' : subm_cdata,
+                             'CountsMC'   : subm_cmc})
+            jobs.update({'HaddCountsData': subm_hadd_cdata,
                          'HaddCountsMC'  : subm_hadd_cmc})
         if self.branch != 'counts':
-            jobs.update({'HistosData'   : subm_hdata,
-                         'HistosMC'     : subm_hmc,
-                         'HaddHistoData': subm_hadd_hdata,
+            if not fused_processing(self.branch):
+                jobs.update({'HistosData' : subm_hdata,
+                             'HistosMC'   : subm_hmc})
+            jobs.update({'HaddHistoData': subm_hadd_hdata,
                          'HaddHistoMC'  : subm_hadd_hmc,
                          'EffSF'        : [subm_eff_sf],
                          'EffSFAgg'     : [subm_eff_sf_agg]})
+            if not FLAGS.no_plots:
+                jobs.update({'EffSFRender' : [subm_render]})
         if self.branch == 'extra':
             jobs.update({'Discr'  : subm_disc,
                          'Union'  : subm_union,
@@ -659,6 +913,14 @@ class SubmitDAG(lutils.ForceRun):
     @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
     def run(self):
         outfile = self.input()[-1][0].path
+        if FLAGS.executor == 'local':
+            executor = local_dag.LocalDAGExecutor(outfile, workers=FLAGS.local_workers)
+            if not executor.run():
+                mes = 'Some jobs of {} failed. See {}.'.format(outfile, executor.state_file)
+                raise RuntimeError(mes)
+            executor.write_report(self.output().path)
+            return
+
         com = 'condor_submit_dag -no_submit -f'
         com += ' -notification Always'
         com += ' -append "notify_user={}"'.format(main.email)
@@ -676,28 +938,43 @@ class SubmitDAG(lutils.ForceRun):
     @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
     def output(self):
         # WriteDag dependency is the last one
-        target = self.input()[-1][0].path + '.condor.sub'
+        if FLAGS.executor == 'local':
+            target = self.input()[-1][0].path + '.local_report.txt'
+        else:
+            target = self.input()[-1][0].path + '.condor.sub'
         return luigi.LocalTarget(target)
  
     @lutils.WorkflowDebugger(flag=FLAGS.debug_workflow)
     def requires(self):
-        return [ Processing(mode='histos'),
-                 Processing(mode='counts'),
-                 HaddHisto(dataset_name=data_name, samples=data_vals),
-                 HaddHisto(dataset_name=mc_name, samples=mc_vals),
-                 HaddCounts(dataset_name=data_name, samples=data_vals),
-                 HaddCounts(dataset_name=mc_name, samples=mc_vals ),
-                 EffAndSF(),
-                 EffAndSFAggr(),
-                 Discriminator(),
-                 UnionCalculator(),
-                 Closure(),
-                 Dag(branch=self.branch),
-                ]
+        if fused_processing(self.branch):
+            procs = [ Processing(mode='fused') ]
+        else:
+            procs = [ Processing(mode='histos'), Processing(mode='counts') ]
+        return procs + [ HaddHisto(dataset_name=data_name, samples=data_vals),
+                         HaddHisto(dataset_name=mc_name, samples=mc_vals),
+                         HaddCounts(dataset_name=data_name, samples=data_vals),
+                         HaddCounts(dataset_name=mc_name, samples=mc_vals ),
+                         EffAndSF(),
+                         EffAndSFAggr(),
+                         EffAndSFRender(),
+                         Discriminator(),
+                         UnionCalculator(),
+                         Closure(),
+                         Dag(branch=self.branch),
+                        ]
 
 utils.create_single_dir( data_storage )
 utils.create_single_dir( targets_folder )
 
+if FLAGS.jobs_report:
+    if not catalog.is_up_to_date(catalog_params):
+        catalog.build_catalog(catalog_params)
+    modes = {'counts': ('counts',), 'nocounts': ('histos',)}.get(FLAGS.branch, ('fused',))
+    for mode in modes:
+        print('Processing jobs in mode {}:'.format(mode))
+        processing.processing_report(dict(histos_params, mode=mode))
+    sys.exit(0)
+
 last_tasks = [ SubmitDAG(branch=FLAGS.branch) ]
  
 if FLAGS.scheduler == 'central':
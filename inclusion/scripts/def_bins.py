@@ -9,13 +9,14 @@ sys.path.insert(0, parent_dir)
 
 import glob
 import h5py
+import concurrent.futures as cf
 import uproot as up
 import numpy as np
 import argparse
 import importlib
 
 import inclusion
-from inclusion.utils import utils
+from inclusion.utils import utils, catalog, sketch
 from inclusion.config import main
 
 def skip_data_loop(args, cfg):
@@ -29,33 +30,103 @@ def define_binning_outputs(args):
     assert os.path.splitext(args.binedges_filename)[1] == '.hdf5'
     return os.path.join(args.outdir, args.binedges_filename)
 
-def set_min_max(acc, obj):
-    for k in acc:
-        if obj[k][0] < acc[k][0]:
-            acc[k][0] = obj[k][0]
-        if obj[k][1] > acc[k][1]:
-            acc[k][1] = obj[k][1]
-            
-def set_quantiles(acc, quant, ntotal, nbatch):
+def select_files(filelist, fraction, min_files=30, seed=0):
     """
-    Accumulates the weighted average of quantiles.
-    - 'acc': accumulator
-    - 'quant': new quantile being averaged
+    Random subsample of the input files, stratified by folder: the same fraction
+    of files is taken from each folder, and at least one file per folder.
+    All files are used for samples with up to `min_files` files.
     """
-    for k in acc:
-        if acc[k] is None: # first iteration
-            acc[k] = quant[k]
-        else:
-            frac_old = (ntotal-nbatch) / ntotal
-            frac_new = nbatch / ntotal
-            acc[k] = acc[k]*frac_old + quant[k]*frac_new
-            
+    if fraction >= 1. or len(filelist) <= min_files:
+        return list(filelist)
+
+    folders = {}
+    for f in filelist:
+        folders.setdefault(os.path.dirname(f), []).append(f)
+
+    rng = np.random.default_rng(seed)
+    res = []
+    for flist in folders.values():
+        nsel = max(1, int(round(fraction * len(flist))))
+        res.extend(flist[i] for i in sorted(rng.choice(len(flist), size=nsel, replace=False)))
+    return res
+
+def sketch_file(fname, channels, variables, binedges, compression, executor=None):
+    """
+    Partial quantile sketches of all variables in a single file, for all channels
+    sharing the same dataset. Each batch is read once and split by channel in memory.
+    Sketches of different files can be filled in parallel and merged afterwards.
+    `executor`: optional uproot executor for decompression and interpretation.
+    """
+    sketches = {chn: {v: sketch.TDigest(compression) for v in variables} for chn in channels}
+    branches = tuple(variables) + ('pairType',)
+    for batch in up.iterate(fname, expressions=branches, step_size='500 MB', library='np',
+                            decompression_executor=executor, interpretation_executor=executor):
+        for chn in channels:
+            if chn == 'all':
+                sel_chn = batch['pairType'] < main.sel[chn]['pairType'][1]
+            else:
+                sel_chn = batch['pairType'] == main.sel[chn]['pairType'][1]
+
+            for v in variables:
+                vals = batch[v][sel_chn]
+                if utils.key_exists(binedges, v, chn) and binedges[v][chn][0] == "quantiles":
+                    vals = vals[(vals > binedges[v][chn][1]) & (vals < binedges[v][chn][2])]
+                sketches[chn][v].update(vals)
+    return sketches
+
+def merge_sketches(acc, other):
+    """Merges the sketches of `other` into `acc`. Both can be `None`."""
+    if acc is None:
+        return other
+    if other is not None:
+        for chn in acc:
+            for v in acc[chn]:
+                acc[chn][v].merge(other[chn][v])
+    return acc
+
+def sketch_files(filelist, channels, variables, binedges, compression, executor=None):
+    """Merged quantile sketches of several files, processed sequentially."""
+    res = None
+    for fname in filelist:
+        partial = sketch_file(fname, channels, variables, binedges, compression, executor)
+        res = merge_sketches(res, partial)
+    return res
+
+def sketch_files_parallel(filelist, channels, variables, binedges, compression, workers, pool):
+    """
+    Merged quantile sketches of several files, split over `workers` workers.
+    Each worker processes a share of the files into its own sketches, which are merged at the end.
+    - 'process': one process per worker, each reading and decompressing its files.
+    - 'thread': one thread per worker, with baskets decompressed and interpreted
+      by a shared uproot thread pool (compression libraries release the GIL).
+    """
+    chunks = [filelist[i::workers] for i in range(workers)]
+    chunks = [c for c in chunks if len(c) > 0]
+    opts = dict(channels=channels, variables=variables, binedges=binedges, compression=compression)
+
+    res = None
+    if pool == 'thread':
+        executor = up.ThreadPoolExecutor(max_workers=workers)
+        with cf.ThreadPoolExecutor(max_workers=len(chunks)) as ex:
+            futures = [ex.submit(sketch_files, c, executor=executor, **opts) for c in chunks]
+            for fut in cf.as_completed(futures):
+                res = merge_sketches(res, fut.result())
+        executor.shutdown()
+    elif pool == 'process':
+        with cf.ProcessPoolExecutor(max_workers=len(chunks)) as ex:
+            futures = [ex.submit(sketch_files, c, **opts) for c in chunks]
+            for fut in cf.as_completed(futures):
+                res = merge_sketches(res, fut.result())
+    else:
+        mes = 'Pool {} is not supported.'.format(pool)
+        raise ValueError(mes)
+    return res
+
 @utils.set_pure_input_namespace
 def define_binning(args):
     """
     Determine histogram quantiles
     """
-    quant_down, quant_up = 0., 1.
     cfg = importlib.import_module(args.configuration)
     
     channel_to_dataset = {'etau'   : main.data[args.year]['EG'][0],
@@ -64,6 +135,9 @@ def define_binning(args):
                           'mumu'   : main.data[args.year]['Mu'][0],
                           'ee'     : main.data[args.year]['EG'][0],}
     
+    quantiles = np.linspace(0., 1., num=args.nbins+1)
+    quantiles[-1] = 0.99
+
     min_max, quants = {}, {}
     for k in args.channels:
         min_max[k], quants[k] = {}, {}
@@ -76,53 +150,42 @@ def define_binning(args):
     ###############################################
     if not skip_data_loop(args, cfg):
 
+        # channels sharing a dataset are filled from the same read pass
+        dataset_to_channels = {}
         for chn in args.channels:
-            sample = channel_to_dataset[chn]
+            dataset_to_channels.setdefault(channel_to_dataset[chn], []).append(chn)
+
+        for sample, channels in dataset_to_channels.items():
             
             #### Parse input list
-            filelist, _ = utils.get_root_inputs(sample, args.indir, include_tree=True)
-
-            treesize = 0
-            percentage = 0.05
+            filelist, _ = catalog.get_root_inputs(sample, args.indir, include_tree=True,
+                                                  catalog=args.catalog)
+            filelist = select_files(filelist, args.sample_fraction)
 
-            quantiles = np.linspace(0., 1., num=args.nbins+1)
-            quantiles[-1] = 0.99
-                
-            branches = args.variables + ('pairType',)
+            # one sketch per file, merged into the first one
             nfiles = len(filelist)
-            for ib,batch in enumerate(up.iterate(files=filelist, expressions=branches,
-                                                 step_size='500 MB', library='ak')):
-                treesize += len(batch)
-
-                # assume X% of the files are enough to estimate quantiles
-                if ib+1 > int(percentage*nfiles) and nfiles > 30:
-                    break
-
-                print('{}/{} {} files for channel {} (only {} will be processed)\r'
-                      .format(ib+1, nfiles, sample, chn, int(percentage*nfiles)),
-                      end='' if ib+1!=nfiles else '\n', flush=True)
-                
-                if chn == 'all':
-                    sel_chn = batch.pairType < main.sel[chn]['pairType'][1]
-                else:
-                    sel_chn = batch.pairType == main.sel[chn]['pairType'][1]
-                batch_chn, batch_sel = batch[sel_chn], {}
+            opts = dict(channels=channels, variables=args.variables, binedges=cfg.binedges,
+                        compression=args.compression)
+            if args.workers > 1:
+                print('{} {} files for channels {} with {} {} workers'
+                      .format(nfiles, sample, ', '.join(channels), args.workers, args.pool), flush=True)
+                sketches = sketch_files_parallel(filelist, workers=args.workers, pool=args.pool, **opts)
+            else:
+                sketches = None
+                for ib,fname in enumerate(filelist):
+                    print('{}/{} {} files for channels {}\r'.format(ib+1, nfiles, sample, ', '.join(channels)),
+                          end='' if ib+1!=nfiles else '\n', flush=True)
+                    sketches = merge_sketches(sketches, sketch_file(fname, **opts))
+
+            for chn in channels:
                 for v in args.variables:
-                    if utils.key_exists(cfg.binedges, v, chn) and cfg.binedges[v][chn][0] == "quantiles":
-                        batch_sel[v] = batch_chn[v][(batch_chn[v] > cfg.binedges[v][chn][1]) & (batch_chn[v] < cfg.binedges[v][chn][2])]
-                    else:
-                        batch_sel[v] = batch_chn[v]
-
-                if len(batch_sel) != 0:
-                    # trim outliers
-                    quant1 = {v:np.quantile(batch_sel[v], q=np.array(quantiles)) for v in args.variables}
-                    set_quantiles(quants[chn], quant1, ntotal=treesize, nbatch=len(batch))
-                    quant2 = {v:np.quantile(batch_sel[v], q=np.array([0., 0.99])) for v in args.variables}
-                    set_min_max(min_max[chn], quant2)
-                else:
-                    mes = ("Channel {} is not present in batch {} of sample {} in folders {}."
-                           .format(chn, ib, sample, args.indir))
-                    raise RuntimeError(mes)
+                    if sketches is None or sketches[chn][v].total_weight() == 0:
+                        mes = ("Channel {} is not present in sample {} in folders {}."
+                               .format(chn, sample, args.indir))
+                        raise RuntimeError(mes)
+
+                    quants[chn][v] = sketches[chn][v].quantile(quantiles)
+                    min_max[chn][v] = list(sketches[chn][v].quantile([0., 0.99]))
 
     ###############################################
     ############## Data Loop: End #################
@@ -192,6 +255,16 @@ if __name__ == '__main__':
                         help='Select the channels over which the workflow will be run.' )
     parser.add_argument('--configuration', dest='configuration', required=True,
                         help='Name of the configuration module to use.')
+    parser.add_argument('--catalog', default=None,
+                        help='Catalog of input files. The input directories are inspected if not provided.')
+    parser.add_argument('--sample_fraction', default=0.05, type=float,
+                        help='Fraction of randomly chosen files per folder used to estimate the quantiles.')
+    parser.add_argument('--compression', default=200, type=int,
+                        help='Accuracy of the quantile sketches.')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='Number of parallel workers processing the input files.')
+    parser.add_argument('--pool', default='process', choices=('process', 'thread'),
+                        help='Type of parallel workers.')
     parser.add_argument('--debug', action='store_true', help='debug verbosity')
     args = utils.parse_args(parser)
 
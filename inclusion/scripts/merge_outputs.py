@@ -0,0 +1,79 @@
+# coding: utf-8
+
+_all_ = [ 'merge_outputs' ]
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 3 * '/..')
+sys.path.insert(0, parent_dir)
+
+import inclusion
+from inclusion.utils import utils, merging
+
+import glob
+import argparse
+
+@utils.set_pure_input_namespace
+def merge_outputs(args):
+    """
+    Runs one job of a merging tree. Each job of the first layer merges its own chunk of
+    the `ninputs` input files, each following layer merges chunks of the outputs of the
+    previous one, and the single job of the last layer writes the target.
+    Without `ninputs`, all input files are merged by a single job.
+    """
+    if args.ninputs is None:
+        shape = [1]
+    else:
+        shape = merging.tree_shape(args.ninputs, args.fanin, args.nlayers)
+
+    if args.layer == 0:
+        # missing or stale outputs of the processing jobs would bias the sums
+        missing = [x for x in args.inputs if len(glob.glob(x)) == 0]
+        if len(missing) > 0:
+            mes = 'Job {} of {}: {} input files are missing, such as {}.'.format(args.index, args.target,
+                                                                                len(missing), missing[0])
+            raise ValueError(mes)
+        files = sorted(set(x for inp in args.inputs for x in glob.glob(inp)))
+        if args.ninputs is not None:
+            nexpected = len(merging.chunk(range(args.ninputs), shape[0], args.index))
+            if len(files) != nexpected:
+                mes = 'Job {} of {}: {} files found, {} expected.'.format(args.index, args.target,
+                                                                         len(files), nexpected)
+                raise ValueError(mes)
+    else:
+        infiles = [merging.partial_name(args.target, args.layer-1, i) for i in range(shape[args.layer-1])]
+        files = merging.chunk(infiles, shape[args.layer], args.index)
+
+    if len(files) == 0:
+        mes = 'Job {} of layer {} of {} has no input files.'.format(args.index, args.layer, args.target)
+        raise ValueError(mes)
+
+    if args.layer == args.nlayers - 1:
+        outname = args.target
+    else:
+        outname = merging.partial_name(args.target, args.layer, args.index)
+    utils.create_single_dir(os.path.dirname(outname))
+    merging.merge_files(outname, files)
+    print('Merged {} files into {}.'.format(len(files), outname))
+
+    if args.export_root and outname == args.target:
+        rootname = os.path.splitext(outname)[0] + '.root'
+        utils.export_shard(outname, rootname)
+        print('Exported {} to {}.'.format(outname, rootname))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge histogram or counts files in a tree of jobs.')
+    parser.add_argument('--target', required=True, help='Final output of the merging tree.')
+    parser.add_argument('--inputs', nargs='+', default=(),
+                        help='Files or glob patterns merged by the current job of the first layer.')
+    parser.add_argument('--ninputs', default=None, type=int,
+                        help='Expected number of input files, defining the shape of the tree. All files are merged at once if not provided.')
+    parser.add_argument('--fanin', default=None, type=int, help='Maximum number of files merged by each job.')
+    parser.add_argument('--nlayers', default=1, type=int, help='Number of layers of the tree.')
+    parser.add_argument('--layer', default=0, type=int, help='Layer of the current job.')
+    parser.add_argument('--index', default=0, type=int, help='Index of the current job within its layer.')
+    parser.add_argument('--export_root', action='store_true',
+                        help='Also write the merged histogram shard as ROOT histograms, next to the target.')
+    args = utils.parse_args(parser)
+
+    merge_outputs(args)
@@ -1,6 +1,7 @@
 # coding: utf-8
 
-_all_ = [ 'build_histograms' ]
+_all_ = [ 'build_histograms', 'build_histograms_columnar', 'fill_histograms',
+          'fill_pattern_histograms', 'write_counts' ]
 
 import os
 import sys
@@ -10,382 +11,542 @@ sys.path.insert(0, parent_dir)
 import inclusion
 from inclusion import selection
 from inclusion.config import main
-from inclusion.utils import utils
+from inclusion.utils import utils, patterns, histos, catalog, multicore
+from inclusion.utils import counts as trigcounts
+from inclusion.utils import throughput
 from inclusion.utils.utils import join_name_trigger_intersection as joinNTC
 
 import re
+import time
 import functools
 import argparse
 import itertools as it
 import importlib
+from collections import defaultdict
 
+import numpy as np
+import uproot as up
 import ROOT
 
-def build_histograms(args):
+def prepare_outdir(args):
     # -- Check if outdir exists, if not create it
     if not os.path.exists(args.outdir):
         os.makedirs(args.outdir)
     if not os.path.exists( os.path.join(args.outdir, args.sample) ):
         os.makedirs( os.path.join(args.outdir, args.sample) )
-    outdir = os.path.join(args.outdir, args.sample)
-
-    if not os.path.exists(args.infile):
-        mes = '[' + os.path.basename(__file__) + '] {} does not exist.'.format(args.infile)
-        raise ValueError(mes)
-
-    config_module = importlib.import_module(args.configuration)
 
-    f_in = ROOT.TFile.Open(args.infile)
-    t_in = f_in.Get('HTauTauTree')
+    for infile in args.infile:
+        if not os.path.exists(infile):
+            mes = '[' + os.path.basename(__file__) + '] {} does not exist.'.format(infile)
+            raise ValueError(mes)
 
-    binedges, nbins = utils.load_binning(afile=args.binedges_fname, key=args.subtag,
-                                         variables=args.variables, channels=args.channels)
-    triggercomb = {}
-    for chn in args.channels:
-        triggercomb[chn] = utils.generate_trigger_combinations(chn, config_module.triggers,
-                                                               config_module.exclusive)
+    # a single normalization is applied to the output
+    if not args.isdata and len(set(os.path.dirname(x) for x in args.infile)) > 1:
+        mes = 'All MC files processed by the same job must belong to the same folder.'
+        raise ValueError(mes)
 
-    # Define 1D histograms
-    #  hRef: pass the reference trigger
-    #  hTrg: pass the reference trigger + trigger under study
-    hRef, hTrg = ({} for _ in range(2))
+    return os.path.join(args.outdir, args.sample)
 
+def define_accumulators(args, config_module, plan, binedges):
+    """
+    One accumulator per channel and variable (or pair of variables), holding
+    the reference and cut combination histograms of all trigger intersections.
+    """
+    acc1D, acc2D = ({} for _ in range(2))
     for chn in args.channels:
-        hRef[chn], hTrg[chn] = ({} for _ in range(2))
+        acc1D[chn], acc2D[chn] = ({} for _ in range(2))
         for j in args.variables:
-            binning1D = (nbins[j][chn], binedges[j][chn])
-            hTrg[chn][j], hRef[chn][j] = ({} for _ in range(2))
-            for tcomb in triggercomb[chn]:
-                hname = utils.get_hnames('Ref1D')(chn, j, joinNTC(tcomb))
-
-                hRef[chn][j][joinNTC(tcomb)] = ROOT.TH1D(hname, '', *binning1D)
-                hTrg[chn][j][joinNTC(tcomb)] = {}
+            acc1D[chn][j] = histos.HistAccumulator(plan.cut_keys[chn][j], binedges[j][chn])
 
-    # Define 2D histograms
-    #  h2Ref: pass the reference trigger
-    #  h2Trig: pass the reference trigger + trigger under study
-    h2Ref, h2Trig = ({} for _ in range(2))
-    
-    for chn in args.channels:
-        h2Ref[chn], h2Trig[chn] = ({} for _ in range(2))
+        keys2D, edges2D = ({} for _ in range(2))
         for onetrig in config_module.triggers:
             if onetrig in config_module.pairs2D.keys():
-                combtrigs = {x for x in triggercomb[chn] if onetrig in x}
-                for combtrig in combtrigs:
-                    cstr = joinNTC(combtrig)
-                    
-                    for j in config_module.pairs2D[onetrig]:
-                        bin2D = ( nbins[j[0]][chn], binedges[j[0]][chn],
-                                  nbins[j[1]][chn], binedges[j[1]][chn] )
-                        vname = utils.add_vnames(j[0], j[1])
-                        if vname not in h2Ref[chn]:
-                            h2Ref[chn][vname] = {}
-                        hname = utils.get_hnames('Ref2D')(chn, vname, cstr)
-                        h2Ref[chn][vname][cstr] = ROOT.TH2D(hname, '', *bin2D)
-                        if vname not in h2Trig[chn]:
-                            h2Trig[chn][vname] = {}
-                        h2Trig[chn][vname][cstr] = {}
-
-    t_in.SetBranchStatus('*', 0)
+                combtrigs = tuple(x for x in plan.triggercomb[chn] if onetrig in x)
+                for j in config_module.pairs2D[onetrig]:
+                    vname = utils.add_vnames(j[0], j[1])
+                    edges2D[vname] = binedges[j[0]][chn], binedges[j[1]][chn]
+                    keys2D.setdefault(vname, {})
+                    for combtrig in combtrigs:
+                        keys2D[vname][combtrig] = plan.cut_keys[chn][vname][combtrig]
+        for vname in keys2D:
+            acc2D[chn][vname] = histos.HistAccumulator(keys2D[vname], *edges2D[vname])
+    return acc1D, acc2D
+
+def define_counts(args, plan):
+    """Trigger counts filled in the same pass, when requested."""
+    if args.counts_tprefix is None:
+        return None
+    return trigcounts.TriggerCounts(plan, args.channels)
+
+def setup(args):
+    """Configuration, selection plan and bin edges, built once per process."""
+    config_module = importlib.import_module(args.configuration)
+    if args.backend == 'columnar':
+        selection.ColumnarEventSelection.check_category(config_module.category)
+
+    binedges, _ = utils.load_binning(afile=args.binedges_fname, key=args.subtag,
+                                     variables=args.variables, channels=args.channels)
+    plan = selection.SelectionPlan(config_module, args.isdata, args.year, args.dataset,
+                                   args.channels, args.variables, args.nocut_dummy_str,
+                                   args.intersection_str)
+    return config_module, plan, binedges
+
+def build_histograms(args):
+    outdir = prepare_outdir(args)
+    state = setup(args)
+    acc1D, acc2D, counts, nevents = multicore.process_ranges(fill_histograms, args, state, args.infile,
+                                                             args.ncpus, setup)
+
+    write_histograms(args, outdir, state[1], acc1D, acc2D)
+    if counts is not None:
+        write_counts(args, outdir, counts)
+    return nevents
+
+def fill_histograms(args, config_module, plan, binedges, ranges):
+    """
+    PyROOT event loop over entry ranges (file, start, stop).
+    Returns the filled accumulators, the counts and the number of processed events.
+    """
+    triggercomb = plan.triggercomb
+
+    # Histograms passing the reference trigger (slot 0) and
+    # the reference trigger + trigger under study (one slot per cut combination)
+    acc1D, acc2D = define_accumulators(args, config_module, plan, binedges)
+    counts = define_counts(args, plan)
+
     _entries = utils.define_used_tree_variables(config_module.custom_cut)
     _entries += tuple(args.variables)
-    for ientry in _entries:
-        t_in.SetBranchStatus(ientry, 1)
     cmet = 0
-
-    nentries = t_in.GetEntriesFast()
-    for ientry,entry in enumerate(t_in):
-        if ientry%10000==0:
-             print('{} / {}'.format(ientry, nentries))
-
-        # this is slow: do it once only
-        entries = utils.dot_dict({x: getattr(entry, x) for x in _entries})
-
-        w_mc     = entries.MC_weight
-        w_pure   = entries.PUReweight
-        w_l1pref = entries.L1pref_weight
-        w_trig   = entries.trigSF
-        w_idiso  = entries.IdSF_deep_2d
-        w_jetpu  = entries.PUjetID_SF
-        w_btag   = entries.bTagweightReshape
+    nevents = 0
+
+    # selection state and accumulators are shared by all files
+    for infile, start, stop in multicore.prefetch_ranges(ranges, _entries):
+        f_in = ROOT.TFile.Open(infile)
+        t_in = f_in.Get('HTauTauTree')
+        t_in.SetBranchStatus('*', 0)
+        for ientry in _entries:
+            t_in.SetBranchStatus(ientry, 1)
+
+        nentries = t_in.GetEntriesFast() if stop is None else stop
+        nevents += nentries - start
+        for ientry in range(start, nentries):
+            t_in.GetEntry(ientry)
+            if ientry%10000==0:
+                 print('{} / {}'.format(ientry, nentries))
+
+            # this is slow: do it once only
+            entries = utils.dot_dict({x: getattr(t_in, x) for x in _entries})
+
+            w_mc     = entries.MC_weight
+            w_pure   = entries.PUReweight
+            w_l1pref = entries.L1pref_weight
+            w_trig   = entries.trigSF
+            w_idiso  = entries.IdSF_deep_2d
+            w_jetpu  = entries.PUjetID_SF
+            w_btag   = entries.bTagweightReshape
         
-        if utils.is_nan(w_mc)     : w_mc=1
-        if utils.is_nan(w_pure)   : w_pure=1
-        if utils.is_nan(w_l1pref) : w_l1pref=1
-        if utils.is_nan(w_trig)   : w_trig=1
-        if utils.is_nan(w_idiso)  : w_idiso=1
-        if utils.is_nan(w_jetpu)  : w_jetpu=1
-        if utils.is_nan(w_btag)   : w_btag=1
-
-        evt_weight = 1.#w_mc * w_pure * w_l1pref * w_trig * w_idiso * w_jetpu
-        if args.isdata:
-            if evt_weight != 1.:
-                raise RuntimeError('The weight for data is {}!'.format(evt_weight))
-
-        # if config_module.category != "baseline" and config_module.category != "boosted":
-        #     # can be '-1' when no bjets are present
-        #     evt_weight *= w_btag 
-
-        if args.isdata:
-            if abs(evt_weight) != 1.:
-                raise RuntimeError('The weight for data is {}!'.format(evt_weight))
-
-        sel = selection.EventSelection(entries, isdata=args.isdata, year=args.year,
-                                       configuration=config_module)
-
-        if not sel.sel_category(config_module.category):
-            continue
+            if utils.is_nan(w_mc)     : w_mc=1
+            if utils.is_nan(w_pure)   : w_pure=1
+            if utils.is_nan(w_l1pref) : w_l1pref=1
+            if utils.is_nan(w_trig)   : w_trig=1
+            if utils.is_nan(w_idiso)  : w_idiso=1
+            if utils.is_nan(w_jetpu)  : w_jetpu=1
+            if utils.is_nan(w_btag)   : w_btag=1
+
+            evt_weight = 1.#w_mc * w_pure * w_l1pref * w_trig * w_idiso * w_jetpu
+            if args.isdata:
+                if evt_weight != 1.:
+                    raise RuntimeError('The weight for data is {}!'.format(evt_weight))
+
+            # if config_module.category != "baseline" and config_module.category != "boosted":
+            #     # can be '-1' when no bjets are present
+            #     evt_weight *= w_btag 
+
+            if args.isdata:
+                if abs(evt_weight) != 1.:
+                    raise RuntimeError('The weight for data is {}!'.format(evt_weight))
+
+            if counts is not None:
+                counts_weight = trigcounts.event_weight(entries, args.isdata, config_module.category)
+
+            sel = selection.EventSelection(entries, isdata=args.isdata, year=args.year,
+                                           configuration=config_module, plan=plan)
+
+            if not sel.sel_category(config_module.category):
+                continue
         
-        fill_var = {}
-        for v in args.variables:
-            fill_var[v] = {}
+            fill_var = {}
+            for v in args.variables:
+                fill_var[v] = {}
+                for chn in args.channels:
+                    fill_var[v].update({chn: entries[v]})
+                    if fill_var[v][chn]>binedges[v][chn][-1]:
+                        fill_var[v][chn]=binedges[v][chn][-1] # include overflow
+
+            # whether the event passes cuts (1 and 2-dimensional) and single triggers
+            pass_trigger, pcuts1D, pcuts2D = ({} for _ in range(3))
+            for trig in config_module.triggers:
+                pcuts2D[trig] = {}
+            for trig in config_module.triggers:
+                pass_trigger[trig] = sel.trigger_bits(trig)
+                pcuts1D[trig] = {}
+                for var in args.variables:
+                    pcuts1D[trig][var] = sel.var_cuts(trig, [var], args.nocut_dummy_str)
+
+                if trig in config_module.pairs2D.keys():
+                    # combtrigs = tuple(x for x in triggercomb if trig in x)
+                    # for combtrig in combtrigs:
+                    # pcuts2D[joinNTC(combtrig)] = {}
+                    for j in config_module.pairs2D[trig]:
+                        vname = utils.add_vnames(j[0],j[1])
+                        for t in config_module.triggers:
+                            pcuts2D[t][vname] = sel.var_cuts(t, [j[0], j[1]], args.nocut_dummy_str)
+
+            #logic AND to intersect all triggers in this combination
+            pass_trigger_intersection = {}
             for chn in args.channels:
-                fill_var[v].update({chn: entries[v]})
-                if fill_var[v][chn]>binedges[v][chn][-1]:
-                    fill_var[v][chn]=binedges[v][chn][-1] # include overflow
+                for tcomb in triggercomb[chn]:
+                    pass_trigger_intersection[plan.cstr[tcomb]] = functools.reduce(
+                        lambda x,y: x and y,
+                        [ pass_trigger[x] for x in tcomb ] )
 
-        # whether the event passes cuts (1 and 2-dimensional) and single triggers
-        pass_trigger, pcuts1D, pcuts2D = ({} for _ in range(3))
-        for trig in config_module.triggers:
-            pcuts2D[trig] = {}
-        for trig in config_module.triggers:
-            pass_trigger[trig] = sel.trigger_bits(trig)
-            pcuts1D[trig] = {}
-            for var in args.variables:
-                pcuts1D[trig][var] = sel.var_cuts(trig, [var], args.nocut_dummy_str)
-
-            if trig in config_module.pairs2D.keys():
-                # combtrigs = tuple(x for x in triggercomb if trig in x)
-                # for combtrig in combtrigs:
-                # pcuts2D[joinNTC(combtrig)] = {}
-                for j in config_module.pairs2D[trig]:
-                    vname = utils.add_vnames(j[0],j[1])
-                    for t in config_module.triggers:
-                        pcuts2D[t][vname] = sel.var_cuts(t, [j[0], j[1]], args.nocut_dummy_str)
-
-        #logic AND to intersect all triggers in this combination
-        pass_trigger_intersection = {}
-        for chn in args.channels:
-            for tcomb in triggercomb[chn]:
-                pass_trigger_intersection[joinNTC(tcomb)] = functools.reduce(
-                    lambda x,y: x and y,
-                    [ pass_trigger[x] for x in tcomb ] )
+            for chn in args.channels:
+                if utils.is_channel_consistent(chn, entries.pairType):
 
-        for chn in args.channels:
-            if utils.is_channel_consistent(chn, entries.pairType):
+                    # reference selection, shared by all variables and intersections
+                    pass_ref = sel.pass_references(chn, config_module.triggers, args.dataset)
 
-                # fill histograms for 1D efficiencies
-                for j in args.variables:
-                    binning1D = (nbins[j][chn], binedges[j][chn])
-
-                    # The following is tricky, as we are considering, simultaneously:
-                    # - all trigger intersection combinations
-                    # - all cut combinations for each trigger combination (see 'main.cuts')
-                        
-                    # Logic AND to intersect all cuts for this trigger combination
-                    # Each element will contain one possible cut combination
-                    # for the trigger combination 'tcomb' being considered
-                    for tcomb in triggercomb[chn]:
-                        cstr = joinNTC(tcomb)
-
-                        if not sel.check_inters_with_dataset(tcomb, chn, args.dataset):
-                            continue
-                        if not sel.dataset_cuts(tcomb, chn):
-                            continue
-                        if not sel.dataset_triggers(tcomb, chn, config_module.triggers,
-                                                    args.dataset)[0]:
-                            continue
+                    if counts is not None:
+                        counts.fill_event(chn, pass_ref, pass_trigger, counts_weight)
 
+                    # fill histograms for 1D efficiencies
+                    for j in args.variables:
+                        acc = acc1D[chn][j]
+                        ibin = acc.find_bin(fill_var[j][chn])
                         # avoid underflow bin with negative weights crashing efficiency calculation
                         underflow = fill_var[j][chn] < binedges[j][chn][0]
-                        fill_info = fill_var[j][chn], 1. if underflow else evt_weight
-                        hRef[chn][j][cstr].Fill(*fill_info)
-                        
-                        cuts_combinations = list(it.product( *(pcuts1D[atrig][j].items()
-                                                             for atrig in tcomb) ))
-
-                        # One dict item per cut combination
-                        # - key: all cut strings joined
-                        # - value: logical and of all cuts
-                        pcuts_inters = { (args.intersection_str).join(e[0] for e in elem): 
-                                         functools.reduce(                 
-                                             lambda x,y: x and y,
-                                             [ e[1] for e in elem ]
-                                         )
-                                         for elem in cuts_combinations }
-                    
-                        for key,val in pcuts_inters.items():
-                            if key not in hTrg[chn][j][cstr]:
-                                base_str = utils.get_hnames('Trig1D')(chn,j,cstr)
-                                htrig_name = utils.rewrite_cut_string(base_str, key)
-                                hTrg[chn][j][cstr][key] = ROOT.TH1D(htrig_name, '', *binning1D)
-
-                            if val and pass_trigger_intersection[cstr]:
-                                hTrg[chn][j][cstr][key].Fill(*fill_info)
-
-                # fill 2D efficiencies
-                for onetrig in config_module.triggers:
-                    if onetrig in config_module.pairs2D.keys():
-                        combtrigs = tuple(x for x in triggercomb[chn] if onetrig in x)
-
-                        for combtrig in combtrigs:
-                            cstr = joinNTC(combtrig)
-                            
-                            if not sel.check_inters_with_dataset(combtrig, chn, args.dataset):
-                                continue
-                            if not sel.dataset_cuts(combtrig, chn):
+                        weight = 1. if underflow else evt_weight
+
+                        # The following is tricky, as we are considering, simultaneously:
+                        # - all trigger intersection combinations
+                        # - all cut combinations for each trigger combination (see 'main.cuts')
+                        # Slot 0 is the reference, and each cut combination has its own slot,
+                        # ordered as in the plan.
+                        itcombs, slots = [], []
+                        for tcomb in triggercomb[chn]:
+                            group = plan.group_of.get((tcomb, chn))
+                            if group is None or not pass_ref[group]:
                                 continue
-                            if not sel.dataset_triggers(combtrig, chn, config_module.triggers, args.dataset)[0]:
+
+                            itcomb = acc.tcomb_ids[tcomb]
+                            itcombs.append(itcomb)
+                            slots.append(0)
+                            if not pass_trigger_intersection[plan.cstr[tcomb]]:
                                 continue
+
+                            # Logic AND to intersect all cuts for this trigger combination
+                            # Each element will contain one possible cut combination
+                            cuts_combinations = it.product( *(pcuts1D[atrig][j].values()
+                                                              for atrig in tcomb) )
+                            for islot,elem in enumerate(cuts_combinations, start=1):
+                                if all(elem):
+                                    itcombs.append(itcomb)
+                                    slots.append(islot)
+
+                        if itcombs:
+                            acc.fill(ibin, weight, itcombs, slots)
+
+                    # fill 2D efficiencies
+                    for onetrig in config_module.triggers:
+                        if onetrig in config_module.pairs2D.keys():
+                            combtrigs = tuple(x for x in triggercomb[chn] if onetrig in x)
+
+                            for combtrig in combtrigs:
+                                group = plan.group_of.get((combtrig, chn))
+                                if group is None or not pass_ref[group]:
+                                    continue
                             
-                            for j in config_module.pairs2D[onetrig]:
-                                vname = utils.add_vnames(j[0],j[1])
-                                # avoid underflow bin with negative weights crashing efficiency calculation
-                                underflow = (fill_var[j[0]][chn] < binedges[j[0]][chn][0] or
-                                             fill_var[j[1]][chn] < binedges[j[1]][chn][0])
-                                fill_info = (fill_var[j[0]][chn], fill_var[j[1]][chn], 1. if underflow else evt_weight)
-
-                                try:
-                                    cuts_combinations = list(it.product(
-                                        *(pcuts2D[atrig][vname].items() for atrig in combtrig) ))
-                                except KeyError:
-                                    print('CHECK: ', combtrig)
-                                    raise
-
-                                # One dict item per cut combination
-                                # - key: all cut strings joined
-                                # - value: logical and of all cuts
-                                pcuts_inters = { (args.intersection_str).join(e[0] for e in elem):
-                                                 functools.reduce(
-                                                     lambda x,y: x and y,
-                                                     [ e[1] for e in elem ]
-                                                     )
-                                                 for elem in cuts_combinations }
-
-                                h2Ref[chn][vname][cstr].Fill(*fill_info)
-    
-                                for key,val in pcuts_inters.items():
-                                    if key not in h2Trig[chn][vname][cstr]:
-                                        base_str = utils.get_hnames('Trig2D')(chn, vname, cstr)
-                                        h2name = utils.rewrite_cut_string(base_str, key)
-                                        bin2D = ( nbins[j[0]][chn], binedges[j[0]][chn],  
-                                                  nbins[j[1]][chn], binedges[j[1]][chn] ) 
-                                        h2Trig[chn][vname][cstr][key] = ROOT.TH2D(h2name, '', *bin2D)
-                                        
-                                    if val and pass_trigger_intersection[cstr]:
-                                        h2Trig[chn][vname][cstr][key].Fill(*fill_info)
-    
-    file_id = ''.join(c for c in args.infile[-10:] if c.isdigit())
-    outname = os.path.join(outdir, args.tprefix + args.sample + '_' + file_id + args.subtag + '.root')
+                                for j in config_module.pairs2D[onetrig]:
+                                    vname = utils.add_vnames(j[0],j[1])
+                                    acc = acc2D[chn][vname]
+                                    itcomb = acc.tcomb_ids[combtrig]
+                                    # avoid underflow bin with negative weights crashing efficiency calculation
+                                    underflow = (fill_var[j[0]][chn] < binedges[j[0]][chn][0] or
+                                                 fill_var[j[1]][chn] < binedges[j[1]][chn][0])
+                                    weight = 1. if underflow else evt_weight
+
+                                    slots = [0]
+                                    if pass_trigger_intersection[plan.cstr[combtrig]]:
+                                        cuts_combinations = it.product(
+                                            *(pcuts2D[atrig][vname].values() for atrig in combtrig) )
+                                        slots.extend(islot for islot,elem in enumerate(cuts_combinations, start=1)
+                                                     if all(elem))
+                                    acc.fill(acc.find_bin(fill_var[j[0]][chn], fill_var[j[1]][chn]),
+                                             weight, [itcomb]*len(slots), slots)
+
+        f_in.Close()
+
+    return acc1D, acc2D, counts, nevents
+
+def write_histograms(args, outdir, plan, acc1D, acc2D):
+    """
+    Normalizes, sanitizes and stores the histograms filled by any of the backends.
+    """
+    file_id = ''.join(c for c in args.infile[0][-10:] if c.isdigit())
+    ext = 'hdf5' if args.output_format == 'hdf5' else 'root'
+    outname = histos.output_name(outdir, args.tprefix, args.sample, args.infile[0], args.subtag, ext)
     empty_files = True
 
     # normalize all histograms with luminosity and sum of weights
     if not args.isdata:
-        norm = utils.get_lumi(args.year) / utils.total_sum_weights(args.infile, isdata=False)
+        norm = utils.get_lumi(args.year) / catalog.total_sum_weights(args.infile[0], isdata=False,
+                                                                     catalog=args.catalog)
         for chn in args.channels:
-            for vname in hRef[chn].keys():
-                for cstr in hRef[chn][vname].keys():
-                    hRef[chn][vname][cstr].Scale(norm)
-                    for key in hTrg[chn][vname][cstr].keys():
-                        hTrg[chn][vname][cstr][key].Scale(norm)
-            for vname in h2Ref[chn].keys():
-                for cstr in h2Ref[chn][vname].keys():
-                    h2Ref[chn][vname][cstr].Scale(norm)
-                    for key in h2Trig[chn][vname][cstr].keys():
-                        h2Trig[chn][vname][cstr][key].Scale(norm)
+            for acc in it.chain(acc1D[chn].values(), acc2D[chn].values()):
+                acc.scale(norm)
 
     # sanity check: reference counts must be always equal or larger than after applying some cut
     # remove negative weights under special conditions
     for chn in args.channels:
-        for vname in hRef[chn].keys():
-            for cstr in hRef[chn][vname].keys():
-                old_ref = hRef[chn][vname][cstr].Integral()
-                for key in hTrg[chn][vname][cstr].keys():
-                    old_trg = hTrg[chn][vname][cstr][key].Integral()
-                    neg_ref, neg_trg = False, False
-                    for ibin in range(hRef[chn][vname][cstr].GetNbinsX()+1):
-                        val_ref = hRef[chn][vname][cstr].GetBinContent(ibin)
-                        val_trg = hTrg[chn][vname][cstr][key].GetBinContent(ibin)
-                        if val_ref < 0.:
-                            neg_ref = True
-                            hRef[chn][vname][cstr].SetBinContent(ibin, 0.)
-                        if val_trg < 0.:
-                            neg_trg = True
-                            hTrg[chn][vname][cstr][key].SetBinContent(ibin, 0.)
-
-                        val_ref = hRef[chn][vname][cstr].GetBinContent(ibin)
-                        val_trg = hTrg[chn][vname][cstr][key].GetBinContent(ibin)
-                        if val_ref < val_trg:
-                            print("Denominator: {} | Numerator: {}".format(val_ref, val_trg))
-                            print("NegRef? {} | NegTrg? {}".format(neg_ref, neg_trg))
-                            raise AssertionError()
-                    if neg_ref:
-                        new = hRef[chn][vname][cstr].Integral()
-                        hRef[chn][vname][cstr].Scale(old_ref/new)
-                    if neg_trg:
-                        new = hTrg[chn][vname][cstr][key].Integral()
-                        hTrg[chn][vname][cstr][key].Scale(old_trg/new)
-
+        for acc in acc1D[chn].values():
+            acc.remove_negative_bins()
+
+    if args.output_format == 'hdf5':
+        if not any(acc.counts.any() for chn in args.channels for acc in acc1D[chn].values()):
+            print('WARNING: All 1D histograms are empty.')
+        accs = {chn: dict(acc1D[chn], **acc2D[chn]) for chn in args.channels}
+        histos.write_shard(outname, accs, plan.cstr)
+        print('Saving file {} at {} '.format(file_id, outname) )
+        return
+
+    # cut combination histograms only exist when the reference was filled
     f_out = ROOT.TFile(outname, 'RECREATE')
     f_out.cd()
     for chn in args.channels:
         for j in args.variables:
-            for tcomb in triggercomb[chn]:
-                cstr = joinNTC(tcomb)
-                if hRef[chn][j][cstr].GetEntries() > 0:
+            acc = acc1D[chn][j]
+            for tcomb in plan.triggercomb[chn]:
+                names = plan.hnames[chn][j][tcomb]
+                acc.to_root(names['ref'], tcomb).Write(names['ref'])
+                if acc.entries(tcomb) > 0:
                     empty_files = False
-                
-                hRef[chn][j][cstr].Write( utils.get_hnames('Ref1D')(chn,j,cstr) )
-
-                for khist,vhist in hTrg[chn][j][cstr].items():
-                    base_str = utils.get_hnames('Trig1D')(chn, j, cstr)
-                    writename = utils.rewrite_cut_string(base_str, khist)
-                    vhist.Write(writename)
+                    for key in acc.keys[tcomb]:
+                        acc.to_root(names['trig'][key], tcomb, key).Write(names['trig'][key])
 
-        for vname in h2Ref[chn].keys():
-
-            for tc in h2Trig[chn][vname].keys():
-                h2Ref[chn][vname][tc].Write()
-                
-                for key in h2Trig[chn][vname][tc].keys():
-                    base_str = h2Trig[chn][vname][tc][key].GetName()
-                    writename = utils.rewrite_cut_string(base_str, key)
-                    h2Trig[chn][vname][tc][key].Write(writename)
+        for vname,acc in acc2D[chn].items():
+            for tcomb in acc.tcombs:
+                names = plan.hnames[chn][vname][tcomb]
+                acc.to_root(names['ref'], tcomb).Write(names['ref'])
+                if acc.entries(tcomb) > 0:
+                    for key in acc.keys[tcomb]:
+                        acc.to_root(names['trig'][key], tcomb, key).Write(names['trig'][key])
 
     if empty_files:
         mes = 'All 1D histograms are empty.'
         print('WARNING: ' + mes)
 
-    f_in.Close()
     f_out.Close()
     print('Saving file {} at {} '.format(file_id, outname) )
 
-# Parse input arguments
-parser = argparse.ArgumentParser(description='Producer trigger histograms.')
-
-parser.add_argument('--binedges_fname', required=True, help='where the bin edges are stored')
-parser.add_argument('--outdir', required=True, help='output directory')
-parser.add_argument('--dataset', required=True,
-                    help='Dataset name as provided by the user: MET, EG, ...')
-parser.add_argument('--sample', required=True,
-                    help='Process name as in SKIM directory')
-parser.add_argument('--isdata', required=True, type=int, help='Whether it is data or MC')
-parser.add_argument('--file', dest='infile', required=True, help='Full path of ROOT input file')
-parser.add_argument('--year', required=True, type=str, choices=('2016', '2016APV', '2017', '2018'),
-                    help='Data year: impact thresholds and selections.')
-parser.add_argument('--subtag', required=True,
-                    help='Additional (sub)tag to differentiate similar runs within the same tag.')
-parser.add_argument('--tprefix', required=True, help='Targets name prefix.')
-parser.add_argument('--channels', required=True, nargs='+', type=str,  
-                    help='Select the channels over which the workflow will be run.' )
-parser.add_argument('--variables', required=True, nargs='+', type=str,
-                    help='Select the variables over which the workflow will be run.' )
-parser.add_argument('--intersection_str', required=False, default=main.inters_str,
-                    help='String used to represent set intersection between triggers.')
-parser.add_argument('--nocut_dummy_str', required=True,
-                    help='Dummy string associated to trigger histograms were no cuts are applied.')
-parser.add_argument('--configuration', required=True,
-                    help='Name of the configuration module to use.')
-args = utils.parse_args(parser)
-
-build_histograms(args)
+def write_counts(args, outdir, counts):
+    """Stores the trigger counts, as done by `produce_trig_counts.py`."""
+    outname = trigcounts.output_name(outdir, args.counts_tprefix, args.infile[0], args.subtag)
+    norm_factor = None
+    if not args.isdata:
+        norm_factor = utils.get_lumi(args.year) / catalog.total_sum_weights(args.infile[0], isdata=False,
+                                                                            catalog=args.catalog)
+    counts.write(outname, norm_factor)
+    print('Saving file {}'.format(outname))
+
+def build_histograms_columnar(args):
+    """
+    Columnar alternative to `build_histograms`.
+    Branches are read in chunks with uproot and the selection is evaluated on arrays.
+    Events are filled once per reference selection according to the pattern of fired
+    triggers; trigger intersections are only resolved when writing.
+    """
+    outdir = prepare_outdir(args)
+    state = setup(args)
+    config_module, plan, binedges = state
+    triggercomb = plan.triggercomb
+    h1D, h2D, counts, nevents = multicore.process_ranges(fill_pattern_histograms, args, state, args.infile,
+                                                         args.ncpus, setup)
+
+    # number of times each 2D histogram is filled per event, as in `build_histograms`
+    mult2D = {chn: defaultdict(int) for chn in args.channels}
+    for chn in args.channels:
+        for onetrig in config_module.triggers:
+            if onetrig in config_module.pairs2D.keys():
+                for combtrig in {x for x in triggercomb[chn] if onetrig in x}:
+                    for j in config_module.pairs2D[onetrig]:
+                        mult2D[chn][(utils.add_vnames(j[0], j[1]), combtrig)] += 1
+
+    # resolve all trigger intersections
+    acc1D, acc2D = define_accumulators(args, config_module, plan, binedges)
+    for chn in args.channels:
+        for j in args.variables:
+            for tcomb in triggercomb[chn]:
+                if (tcomb, chn) in plan.group_of:
+                    hpat = h1D[chn][plan.group_of[(tcomb, chn)]][j]
+                    hpat.resolve(acc1D[chn][j], tcomb, args.intersection_str)
+
+        for (vname, combtrig), mult in mult2D[chn].items():
+            if (combtrig, chn) in plan.group_of:
+                hpat = h2D[chn][plan.group_of[(combtrig, chn)]][vname]
+                hpat.resolve(acc2D[chn][vname], combtrig, args.intersection_str, mult=mult)
+
+    write_histograms(args, outdir, plan, acc1D, acc2D)
+    if counts is not None:
+        write_counts(args, outdir, counts)
+    return nevents
+
+def fill_pattern_histograms(args, config_module, plan, binedges, ranges):
+    """
+    Columnar processing of entry ranges (file, start, stop).
+    Returns the pattern histograms, the counts and the number of processed events.
+    """
+    triggercomb = plan.triggercomb
+    vars2D = {vname: (j[0], j[1]) for j in it.chain(*config_module.pairs2D.values())
+              for vname in (utils.add_vnames(j[0], j[1]),)}
+
+    # one pattern histogram per channel, reference selection and variable
+    h1D, h2D, chntrigs = ({} for _ in range(3))
+    layout1D, layout2D = ({} for _ in range(2))
+    for chn in args.channels:
+        chntrigs[chn] = sorted(set(it.chain(*triggercomb[chn])))
+
+        opts = lambda v: {t: plan.cut_options[v][t] for t in chntrigs[chn]}
+        layout1D[chn] = {j: patterns.PatternLayout(opts(j)) for j in args.variables}
+        layout2D[chn] = {v: patterns.PatternLayout(opts(v)) for v in vars2D}
+        h1D[chn], h2D[chn] = {}, {}
+        for group in plan.groups[chn]:
+            h1D[chn][group] = {j: histos.PatternHist(layout1D[chn][j], binedges[j][chn])
+                               for j in args.variables}
+            h2D[chn][group] = {v: histos.PatternHist(layout2D[chn][v], binedges[vars2D[v][0]][chn],
+                                                     binedges[vars2D[v][1]][chn])
+                               for v in vars2D}
+    counts = define_counts(args, plan)
+
+    _entries = utils.define_used_tree_variables(config_module.custom_cut)
+    _entries = tuple(set(_entries + tuple(args.variables)))
+
+    step_size = int(args.step_size) if args.step_size.isdigit() else args.step_size
+    nentries = 0
+    # selection state and pattern histograms are shared by all files
+    for batch in _iterate_ranges(ranges, _entries, step_size):
+        nentries += len(batch['triggerbit'])
+        print('{} events processed'.format(nentries), flush=True)
+
+        sel = selection.ColumnarEventSelection(batch, isdata=args.isdata, year=args.year,
+                                               configuration=config_module, plan=plan)
+        evt_weight = np.ones(len(batch['triggerbit']))
+        if counts is not None:
+            counts_weight = trigcounts.event_weight(batch, args.isdata, config_module.category)
+
+        pass_category = sel.sel_category(config_module.category)
+
+        fill_var = {}
+        for v in args.variables:
+            fill_var[v] = {}
+            for chn in args.channels:
+                fill_var[v][chn] = np.minimum(batch[v], binedges[v][chn][-1]) # include overflow
+
+        pass_trigger, pcuts1D, pcuts2D = ({} for _ in range(3))
+        for trig in config_module.triggers:
+            pass_trigger[trig] = sel.trigger_bits(trig)
+            pcuts1D[trig] = {var: sel.var_cuts(trig, [var], args.nocut_dummy_str)
+                             for var in args.variables}
+            pcuts2D[trig] = {vname: sel.var_cuts(trig, list(vars2D[vname]), args.nocut_dummy_str)
+                             for vname in vars2D}
+
+        for chn in args.channels:
+            pass_chn = pass_category & utils.is_channel_consistent(chn, batch['pairType'])
+            pass_ref = sel.pass_references(chn, config_module.triggers, args.dataset)
+            for group in plan.groups[chn]:
+                mask = pass_chn & pass_ref[group]
+                if not np.any(mask):
+                    continue
+
+                fired = {t: pass_trigger[t][mask] for t in chntrigs[chn]}
+                if counts is not None:
+                    counts.fill(chn, group, fired, counts_weight[mask])
+
+                for j in args.variables:
+                    values = fill_var[j][chn][mask]
+                    # avoid underflow bin with negative weights crashing efficiency calculation
+                    weights = np.where(values < binedges[j][chn][0], 1., evt_weight[mask])
+                    cuts = {t: {k: np.broadcast_to(v, mask.shape)[mask] for k,v in pcuts1D[t][j].items()}
+                            for t in chntrigs[chn]}
+                    pats = layout1D[chn][j].patterns(fired, cuts)
+                    h1D[chn][group][j].fill(pats, weights, values)
+
+                for vname, (vx, vy) in vars2D.items():
+                    xvals, yvals = fill_var[vx][chn][mask], fill_var[vy][chn][mask]
+                    underflow = (xvals < binedges[vx][chn][0]) | (yvals < binedges[vy][chn][0])
+                    weights = np.where(underflow, 1., evt_weight[mask])
+                    cuts = {t: {k: np.broadcast_to(v, mask.shape)[mask] for k,v in pcuts2D[t][vname].items()}
+                            for t in chntrigs[chn]}
+                    pats = layout2D[chn][vname].patterns(fired, cuts)
+                    h2D[chn][group][vname].fill(pats, weights, xvals, yvals)
+
+    return h1D, h2D, counts, nentries
+
+def _iterate_ranges(ranges, expressions, step_size):
+    """Arrays of all entry ranges (file, start, stop), in chunks of `step_size`."""
+    for infile, start, stop in multicore.prefetch_ranges(ranges, expressions):
+        with up.open(infile) as f:
+            yield from f['HTauTauTree'].iterate(expressions=expressions, entry_start=start, entry_stop=stop,
+                                                step_size=step_size, library='np')
+
+if __name__ == '__main__':
+    # Parse input arguments
+    parser = argparse.ArgumentParser(description='Producer trigger histograms.')
+
+    parser.add_argument('--binedges_fname', required=True, help='where the bin edges are stored')
+    parser.add_argument('--outdir', required=True, help='output directory')
+    parser.add_argument('--dataset', required=True,
+                        help='Dataset name as provided by the user: MET, EG, ...')
+    parser.add_argument('--sample', required=True,
+                        help='Process name as in SKIM directory')
+    parser.add_argument('--isdata', required=True, type=int, help='Whether it is data or MC')
+    parser.add_argument('--file', dest='infile', required=True, nargs='+',
+                        help='Full paths of the ROOT input files, processed by the same job into a single output.')
+    parser.add_argument('--year', required=True, type=str, choices=('2016', '2016APV', '2017', '2018'),
+                        help='Data year: impact thresholds and selections.')
+    parser.add_argument('--subtag', required=True,
+                        help='Additional (sub)tag to differentiate similar runs within the same tag.')
+    parser.add_argument('--tprefix', required=True, help='Targets name prefix.')
+    parser.add_argument('--channels', required=True, nargs='+', type=str,  
+                        help='Select the channels over which the workflow will be run.' )
+    parser.add_argument('--variables', required=True, nargs='+', type=str,
+                        help='Select the variables over which the workflow will be run.' )
+    parser.add_argument('--intersection_str', required=False, default=main.inters_str,
+                        help='String used to represent set intersection between triggers.')
+    parser.add_argument('--nocut_dummy_str', required=True,
+                        help='Dummy string associated to trigger histograms were no cuts are applied.')
+    parser.add_argument('--configuration', required=True,
+                        help='Name of the configuration module to use.')
+    parser.add_argument('--backend', default='root', choices=('root', 'columnar'),
+                        help='Event loop with PyROOT or columnar processing with uproot and numpy.')
+    parser.add_argument('--step_size', default='100 MB',
+                        help='Chunk size for the columnar backend (number of entries or memory size).')
+    parser.add_argument('--catalog', default=None,
+                        help='Catalog of input files. The sum of weights is computed from the inputs if not provided.')
+    parser.add_argument('--counts_tprefix', default=None,
+                        help='Also produce the trigger counts in the same pass, with this targets name prefix.')
+    parser.add_argument('--ncpus', default=1, type=int,
+                        help='Number of processes, each filling cluster-aligned entry ranges of the input files.')
+    parser.add_argument('--output_format', default='root', choices=('root', 'hdf5'),
+                        help='ROOT histograms or a histogram shard with the dense accumulator arrays.')
+    args = utils.parse_args(parser)
+
+    start = time.time()
+    if args.backend == 'columnar':
+        nevents = build_histograms_columnar(args)
+    else:
+        nevents = build_histograms(args)
+
+    # calibrates the packing of input files into jobs
+    mode = 'histos' if args.counts_tprefix is None else 'fused'
+    throughput.write_record(throughput.record_path(args.outdir, args.sample, mode, args.infile[0]),
+                            mode, args.backend, nevents, time.time() - start, args.ncpus)
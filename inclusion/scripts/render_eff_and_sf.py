@@ -0,0 +1,397 @@
+# coding: utf-8
+
+_all_ = [ 'render_eff_and_sf', 'render_1d', 'render_2d' ]
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 3 * '/..')
+sys.path.insert(0, parent_dir)
+
+import inclusion
+from inclusion.utils import utils, results, fitting
+
+import glob
+import argparse
+import numpy as np
+import multiprocessing as mp
+import concurrent.futures as cf
+from copy import copy
+
+import ROOT
+ROOT.gROOT.SetBatch(True)
+
+default_formats = {'1D': ('png', 'pdf', 'C'),
+                   '2D': ('png', 'pdf')} # 2D canvases without macros to reduce noise
+
+def paint2d(channel, trig):
+    lX1, lX2, lY, lYstep = 0.04, 0.7, 0.96, 0.03
+    l = ROOT.TLatex()
+    l.SetNDC()
+    l.SetTextFont(72)
+    l.SetTextSize(0.03)
+    l.SetTextColor(1)
+
+    l.DrawLatex(lX1, lY, trig)
+
+    latexChannel = copy(channel)
+    latexChannel.replace('mu','#mu')
+    latexChannel.replace('tau','#tau_{h}')
+    latexChannel.replace('Tau','#tau_{h}')
+    l.DrawLatex(lX2, lY, 'Channel: '+latexChannel)
+
+def _sigmoid(name, pars, frange):
+    f = ROOT.TF1(name, fitting.sigmoid_formula, frange[0], frange[1])
+    f.SetParameters(*pars)
+    return f
+
+def render_1d(attrs, arrays, formats):
+    """Draws the efficiency and normalized distribution canvases of a 1D record of the results store."""
+    CMS_text_font = 62
+    extra_text_font = 52
+    standard_text_font = 42
+    lumi_text_size = 0.6
+    lumi_text_offset = 0.2
+    cms_text_size = 0.75
+    cms_text_offset	= 0.2
+    extra_over_CMS_text_size = 0.76
+
+    channel, variable, proc = attrs['channel'], attrs['variable'], attrs['proc']
+    x, ex = arrays['x'], arrays['ex']
+    darr = lambda v : np.ascontiguousarray(v, dtype=np.double)
+    def graph(atype, dtype):
+        v, vd, vu = (arrays['_'.join((atype, dtype, n))] for n in ('y', 'eyd', 'eyu'))
+        return ROOT.TGraphAsymmErrors(len(x), darr(x), darr(v), darr(ex), darr(ex), darr(vd), darr(vu))
+
+    data1D, mc1D, sf1D = ({} for _ in range(3))
+    for atype in ('eff', 'norm'):
+        data1D[atype], mc1D[atype], sf1D[atype] = graph(atype, 'dt'), graph(atype, 'mc'), graph(atype, 'sf')
+        data1D[atype].SetTitle(attrs['title_dt'])
+        mc1D[atype].SetTitle(attrs['title_mc'])
+
+    canvas_name = os.path.basename(attrs['outbase'])
+
+    # smoothing fits, drawn with the efficiencies they were fitted to
+    fit_ratio = None
+    if 'fit_dt' in arrays:
+        fit_data = _sigmoid('fit_sigmoid_data_' + canvas_name, arrays['fit_dt'], attrs['frange'])
+        fit_data.SetLineColor(ROOT.kBlack)
+        fit_data.SetLineStyle(2)
+        data1D['eff'].GetListOfFunctions().Add(fit_data)
+
+        fit_mc = _sigmoid('fit_sigmoid_mc_' + canvas_name, arrays['fit_mc'], attrs['frange'])
+        fit_mc.SetLineColor(ROOT.kRed)
+        fit_mc.SetLineStyle(2)
+        mc1D['eff'].GetListOfFunctions().Add(fit_mc)
+
+        # ratio of the fits, evaluated when computing the results
+        fx, fy = arrays['fit_sf_x'], arrays['fit_sf_y']
+        fit_ratio = ROOT.TGraph(len(fx), darr(fx), darr(fy))
+        fit_ratio.SetLineColor(ROOT.kBlue)
+        fit_ratio.SetLineStyle(2)
+
+    canvas = {}
+    canvas['eff'] = ROOT.TCanvas(canvas_name, 'canvas', 600, 600)
+    canvas['norm'] = ROOT.TCanvas(canvas_name + '_norm', 'canvas_norm', 600, 600)
+
+    outs = []
+    for atype in ('eff', 'norm'):
+        canvas[atype].cd()
+        pad1 = ROOT.TPad('pad1', 'pad1', 0, 0.3, 1, 1)
+        pad1.SetBottomMargin(0.005)
+        pad1.SetLeftMargin(0.15)
+        pad1.Draw()
+        pad1.cd()
+
+        max1, min1 = utils.get_obj_max_min(data1D[atype], is_histo=False)
+        max2, min2 = utils.get_obj_max_min(mc1D[atype], is_histo=False)
+        amax = max([max1, max2])
+        amin = min([min1, min2])
+        intervals = 0.1, 0.4
+        if amax == amin:
+            amax = 1.
+            amin = 0.
+
+        data1D[atype].GetYaxis().SetTitleSize(0.2)
+        data1D[atype].GetYaxis().SetTitleOffset(1.0)
+        data1D[atype].GetYaxis().SetTitle('Efficiency' if atype=='eff' else 'Normalized counts')
+
+        data1D[atype].SetLineColor(1)
+        data1D[atype].SetLineWidth(2)
+        data1D[atype].SetMarkerColor(1)
+        data1D[atype].SetMarkerSize(1.3)
+        data1D[atype].SetMarkerStyle(20)
+        data1D[atype].GetYaxis().SetLabelSize(0.05)
+        data1D[atype].GetXaxis().SetLabelSize(0.05)
+        data1D[atype].GetXaxis().SetTitleSize(0.05)
+        data1D[atype].GetYaxis().SetTitleSize(0.05)
+        data1D[atype].GetXaxis().SetTitleOffset(1.)
+        data1D[atype].Draw("AP")
+
+        mc1D[atype].SetLineColor(ROOT.kRed)
+        mc1D[atype].SetLineWidth(2)
+        mc1D[atype].SetMarkerColor(ROOT.kRed)
+        mc1D[atype].SetMarkerSize(1.3)
+        mc1D[atype].SetMarkerStyle(22)
+        mc1D[atype].Draw("same P")
+
+        pad1.RedrawAxis()
+        pad1.Draw("same P")
+
+        x1_pad = pad1.GetUxmin()
+        x2_pad = pad1.GetUxmax()
+        if atype == 'eff':
+            data1D[atype].GetYaxis().SetRangeUser(-0.05,1.22)
+            data1D[atype].GetXaxis().SetRangeUser(x1_pad,x2_pad)
+            mc1D[atype].GetYaxis().SetRangeUser(-0.05,1.22)
+            mc1D[atype].GetXaxis().SetRangeUser(x1_pad,x2_pad)
+        else:
+            norm_min = amin-intervals[0]*(amax-amin)
+            norm_max = amax+intervals[1]*(amax-amin)
+            data1D[atype].GetYaxis().SetRangeUser(norm_min,norm_max)
+            mc1D[atype].GetYaxis().SetRangeUser(norm_min,norm_max)
+
+        l = ROOT.TLine()
+        l.SetLineWidth(2)
+        l.SetLineStyle(7)
+        l.DrawLine(x1_pad,1.,x2_pad,1.)
+
+        leg = ROOT.TLegend(0.61, 0.77, 0.89, 0.89)
+        leg.SetFillColor(0)
+        leg.SetShadowColor(0)
+        leg.SetBorderSize(0)
+        leg.SetTextSize(0.04)
+        leg.SetFillStyle(0)
+        leg.SetTextFont(standard_text_font)
+
+        leg.AddEntry(data1D[atype], 'Data', 'p')
+        leg.AddEntry(mc1D[atype],
+                     proc.replace('MC_', '').replace('TT', 'TTbar').replace('_', '+'), 'p')
+        leg.Draw('same')
+
+        utils.redraw_border()
+        pad1.RedrawAxis()
+        pad1.Draw("same P")
+
+        lX, lY, lXstep, lYstep = 0.18, 0.85, 0.02, 0.06
+        l = ROOT.TLatex()
+        l.SetNDC()
+        l.SetTextFont(standard_text_font) #72 bold italic
+        l.SetTextColor(1)
+        l.SetTextSize(0.04)
+
+        latexChannel = copy(channel)
+        latexChannel = latexChannel.replace('mu','#mu')
+        latexChannel = latexChannel.replace('tau','#tau_{h}')
+        latexChannel = latexChannel.replace('Tau','#tau_{h}')
+
+        l.DrawLatex(lX, lY, 'Channel: '+latexChannel)
+        textrigs = utils.write_trigger_string(attrs['trig'], attrs['intersection_str'], items_per_line=2)
+        l.DrawLatex(lX, lY-lYstep, textrigs)
+
+        pad_left = pad1.GetLeftMargin()
+        pad_top  = pad1.GetTopMargin()
+
+        latex_CMS = ROOT.TLatex()
+        latex_CMS.SetTextSize(cms_text_size*pad_top)
+        latex_CMS.SetNDC()
+        latex_CMS.SetTextAngle(0)
+        latex_CMS.SetTextColor(ROOT.kBlack)
+        latex_CMS.SetTextFont(CMS_text_font);
+        latex_CMS.SetBit(ROOT.kCanDelete)
+        latex_CMS.DrawLatex(lX-1.5*lXstep, lY+1.3*lYstep, "CMS")
+
+        latex_Prelim = ROOT.TLatex()
+        latex_Prelim.SetTextSize(lumi_text_size*pad_top)
+        latex_Prelim.SetNDC()
+        latex_Prelim.SetTextAngle(0)
+        latex_Prelim.SetTextColor(ROOT.kBlack)
+        latex_Prelim.SetTextFont(extra_text_font)
+        latex_Prelim.SetBit(ROOT.kCanDelete)
+        latex_Prelim.DrawLatex(lX+4*lXstep, lY+1.3*lYstep, "Preliminary")
+
+        lumi_d = {"2016APV": "19.5", "2016": "16.8", "2017": "41.5", "2018": "59.7"}
+        latex_lumi = ROOT.TLatex()
+        latex_lumi.SetTextSize(lumi_text_size*pad_top)
+        latex_lumi.SetNDC()
+        latex_lumi.SetTextAngle(0)
+        latex_lumi.SetTextColor(ROOT.kBlack)
+        latex_lumi.SetTextFont(standard_text_font)
+        latex_lumi.SetBit(ROOT.kCanDelete)
+        latex_lumi.DrawLatex(lX+22*lXstep, lY+1.3*lYstep, lumi_d[attrs['year']] + " fb^{-1} (13 TeV)")
+
+        canvas[atype].cd()
+        pad2 = ROOT.TPad('pad2','pad2',0.,0.,1.,0.3)
+        pad2.SetTopMargin(0.01)
+        pad2.SetBottomMargin(0.3)
+        pad2.SetLeftMargin(0.15)
+        pad2.Draw()
+        pad2.cd()
+        pad2.SetGridy()
+
+        canvas[atype].Update()
+        sf1D[atype].GetYaxis().SetRangeUser(-0.15,1.15)
+        sf1D[atype].SetLineColor(ROOT.kBlue)
+        sf1D[atype].SetLineWidth(2)
+        sf1D[atype].SetMarkerColor(ROOT.kBlue)
+        sf1D[atype].SetMarkerSize(1.3)
+        sf1D[atype].SetMarkerStyle(22)
+        sf1D[atype].GetYaxis().SetLabelSize(0.1)
+        sf1D[atype].GetXaxis().SetLabelSize(0.1)
+        sf1D[atype].GetXaxis().SetTitleSize(0.1)
+        sf1D[atype].GetYaxis().SetTitleSize(0.1)
+        sf1D[atype].GetXaxis().SetTitleOffset(1.)
+        sf1D[atype].GetYaxis().SetTitleOffset(0.45)
+        sf1D[atype].GetYaxis().SetTitle('Data/MC')
+        xlabel = utils.get_display_variable_name(channel, variable)
+        if "met" in variable:
+            xlabel += " [GeV]"
+        sf1D[atype].GetXaxis().SetTitle(xlabel)
+        sf1D[atype].GetXaxis().SetTickLength(0.07)
+        sf1D[atype].Draw("AP")
+        if atype == 'eff' and fit_ratio is not None:
+            fit_ratio.Draw("L same")
+
+        pad2.Update()
+        utils.redraw_border()
+        pad2.RedrawAxis()
+        pad2.Draw("same P")
+
+        base = attrs['outbase'].replace(attrs['canvas_prefix'], atype + '_' + attrs['canvas_prefix'])
+        for ext in formats:
+            outs.append(base + '.' + ext)
+            canvas[atype].SaveAs(outs[-1])
+    return outs
+
+def render_2d(attrs, arrays, formats):
+    """Draws the data, MC and scale factor canvases of a 2D record of the results store."""
+    n2 = ['Data2D', 'MC2D', 'SF2D']
+    cnames = [x + '_c' for x in n2]
+    channel, joinvars, trig = attrs['channel'], attrs['joinvars'], attrs['trig']
+    edges = arrays['edges_x'], arrays['edges_y']
+    suffix = '_' + os.path.basename(attrs['outbase_SF2D'])
+    hist = lambda name, values : utils.array_hist2d(name + suffix, values, *edges)
+
+    outs = []
+    for itype, n in enumerate(n2):
+        canvas = ROOT.TCanvas(cnames[itype] + suffix, cnames[itype] + suffix, 600, 600)
+        canvas.SetLeftMargin(0.10)
+        canvas.SetRightMargin(0.15);
+        canvas.cd()
+
+        vnames_2D = utils.split_vnames(joinvars)
+        vname_x = utils.get_display_variable_name(channel, vnames_2D[0])
+        vname_y = utils.get_display_variable_name(channel, vnames_2D[1])
+        rx = 2 if 'pt' not in vname_x else 0
+        ry = 2 if 'pt' not in vname_y else 0
+        veff_new = utils.apply_equal_bin_width(hist(n, arrays[n]), roundx=rx, roundy=ry)
+        veff_new.GetXaxis().SetTitleOffset(1.0)
+        veff_new.GetYaxis().SetTitleOffset(1.3)
+        veff_new.GetXaxis().SetTitleSize(0.03)
+        veff_new.GetYaxis().SetTitleSize(0.03)
+        veff_new.GetXaxis().SetLabelSize(0.03)
+        veff_new.GetYaxis().SetLabelSize(0.03)
+        veff_new.GetXaxis().SetTitle(vname_x)
+        veff_new.GetYaxis().SetTitle(vname_y)
+        # useful when adding errors
+        # check scripts/draw2DTriggerSF.py
+        veff_new.SetBarOffset(0.22)
+        veff_new.SetMarkerSize(.75)
+        veff_new.SetMarkerColor(ROOT.kOrange+10)
+        veff_new.SetMarkerSize(.8)
+        ROOT.gStyle.SetPaintTextFormat("4.3f");
+        veff_new.Draw('colz text')
+
+        # numerator and denominator
+        if itype < 2:
+            htot = utils.apply_equal_bin_width(hist('tot_' + str(itype), arrays['tot_' + str(itype)]))
+            hpass = utils.apply_equal_bin_width(hist('pass_' + str(itype), arrays['pass_' + str(itype)]))
+            htot.SetMarkerSize(.65)
+            hpass.SetMarkerSize(.65)
+            htot.SetMarkerColor(ROOT.kOrange+6)
+            hpass.SetMarkerColor(ROOT.kOrange+6)
+            hpass.SetBarOffset(-0.10)
+            htot.SetBarOffset(-0.22)
+            ROOT.gStyle.SetPaintTextFormat("4.3f");
+            hpass.Draw("same text")
+            htot.Draw("same text")
+
+        # up and down errors for the 2D histogram
+        eff_eu = utils.apply_equal_bin_width(hist(n + '_eu', arrays[n + '_eu']))
+        eff_ed = utils.apply_equal_bin_width(hist(n + '_ed', arrays[n + '_ed']))
+        eff_eu.SetMarkerSize(.6)
+        eff_ed.SetMarkerSize(.6)
+        eff_eu.SetBarOffset(0.323);
+        eff_ed.SetBarOffset(0.10);
+        eff_eu.SetMarkerColor(ROOT.kBlack)
+        eff_ed.SetMarkerColor(ROOT.kBlack)
+        ROOT.gStyle.SetPaintTextFormat("+ 4.3f xxx");
+        eff_eu.Draw("same text")
+        ROOT.gStyle.SetPaintTextFormat("- 4.3f");
+        eff_ed.Draw("same text")
+
+        lX, lY, lYstep = 0.8, 0.92, 0.045
+        l = ROOT.TLatex()
+        l.SetNDC()
+        l.SetTextFont(72)
+        l.SetTextColor(2)
+        textrig = utils.write_trigger_string(trig, attrs['intersection_str'],
+                                             items_per_line=2)
+        l.DrawLatex(lX, lY, n.replace('2D',''))
+
+        paint2d(channel, textrig)
+        utils.redraw_border()
+
+        for ext in formats:
+            outs.append(attrs['outbase_' + n] + '.' + ext)
+            canvas.SaveAs(outs[-1])
+    return outs
+
+def render_record(store, name, formats=None):
+    """Reads a single record of a results store and draws its canvases."""
+    rec = results.read_results(store, [name])[name]
+    kind = rec['attrs']['kind']
+    func = {'1D': render_1d, '2D': render_2d}[kind]
+    return func(rec['attrs'], rec['arrays'], default_formats[kind] if formats is None else formats)
+
+def _render_task(task):
+    return render_record(*task)
+
+@utils.set_pure_input_namespace
+def render_eff_and_sf(args):
+    """
+    Draws the efficiency and scale factor plots from the results stores written by `run_eff_and_sf.py`,
+    without reading the histograms again. Each record is drawn independently, by `args.ncpus` processes.
+    """
+    stores = sorted(glob.glob(results.results_name(args.indir, '*', args.subtag)))
+    if len(stores) == 0:
+        mes = 'No results store was found in {}.'.format(os.path.dirname(results.results_name(args.indir, '', '')))
+        raise ValueError(mes)
+
+    tasks = [(store, name, args.formats) for store in stores for name in results.list_results(store)]
+    if args.ncpus > 1:
+        with cf.ProcessPoolExecutor(max_workers=args.ncpus, mp_context=mp.get_context('fork')) as pool:
+            outs = list(pool.map(_render_task, tasks, chunksize=max(1, len(tasks) // (4*args.ncpus))))
+    else:
+        outs = [_render_task(t) for t in tasks]
+
+    if args.debug:
+        for out in outs:
+            for o in out:
+                print('[=debug=] {}'.format(o))
+    print('Rendered {} records of {} results stores.'.format(len(tasks), len(stores)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Draw trigger efficiencies and scale factors from their results stores')
+    parser.add_argument('--indir', required=True,
+                        help='Output directory of the efficiency and scale factor step, where the results stores are saved.')
+    parser.add_argument('--subtag', required=True, help='subtag')
+    parser.add_argument('--formats', default=None, nargs='+', type=str,
+                        help='Formats of the plots, any extension supported by TCanvas::SaveAs. Defaults to {} for 1D and {} for 2D plots.'
+                        .format(' '.join(default_formats['1D']), ' '.join(default_formats['2D'])))
+    parser.add_argument('--ncpus', default=1, type=int, help='Number of processes drawing the plots.')
+    parser.add_argument('--debug', action='store_true', help='debug verbosity')
+    args = utils.parse_args(parser)
+
+    ROOT.gStyle.SetOptStat(0)
+    ROOT.gStyle.SetOptTitle(0)
+    render_eff_and_sf(args)
@@ -1,6 +1,7 @@
 # coding: utf-8
 
-_all_ = [ 'run_eff_sf_1d', 'run_eff_sf_1d_outputs', 'run_eff_sf_2d_outputs' ]
+_all_ = [ 'run_eff_sf_1d', 'run_eff_sf_1d_outputs', 'run_eff_sf_2d_outputs',
+          'eff_and_sf_1d', 'fit_eff_1d', 'write_eff_1d', 'eff_and_sf_2d' ]
 
 import os
 import sys
@@ -8,13 +9,14 @@ parent_dir = os.path.abspath(__file__ + 3 * '/..')
 sys.path.insert(0, parent_dir)
 
 import inclusion
-from inclusion.utils import utils
+from inclusion.utils import utils, efficiency, results, fitting
 from inclusion.config import main
 
 import argparse
-import ctypes
+import functools
 import numpy as np
-from copy import copy
+import multiprocessing as mp
+import concurrent.futures as cf
 import importlib
 
 import warnings
@@ -23,40 +25,22 @@ warnings.filterwarnings('error', '.*Number of graph points is different than his
 import ROOT
 ROOT.gROOT.SetBatch(True)
 
-def paint2d(channel, trig):
-    lX1, lX2, lY, lYstep = 0.04, 0.7, 0.96, 0.03
-    l = ROOT.TLatex()
-    l.SetNDC()
-    l.SetTextFont(72)
-    l.SetTextSize(0.03)
-    l.SetTextColor(1)
-
-    l.DrawLatex(lX1, lY, trig)
-    
-    latexChannel = copy(channel)
-    latexChannel.replace('mu','#mu')
-    latexChannel.replace('tau','#tau_{h}')
-    latexChannel.replace('Tau','#tau_{h}')
-    l.DrawLatex(lX2, lY, 'Channel: '+latexChannel)
-
-def draw_eff_and_sf_1d(proc, channel, variable, trig, year,
-                       save_names_1D, cfg,
-                       tprefix, indir, subtag, mc_name, data_name,
-                       intersection_str, debug):
-    CMS_text_font = 62
-    extra_text_font = 52
-    standard_text_font = 42
-    lumi_text_size = 0.6
-    lumi_text_offset = 0.2
-    cms_text_size = 0.75
-    cms_text_offset	= 0.2
-    extra_over_CMS_text_size = 0.76
-
-    name_data = os.path.join(indir, tprefix + data_name + '_Sum' + subtag + ".root")
-    file_data = ROOT.TFile.Open(name_data, 'READ')
-
-    name_mc = os.path.join(indir, tprefix + mc_name + '_Sum' + subtag + ".root")
-    file_mc   = ROOT.TFile.Open(name_mc, 'READ')
+def eff_and_sf_1d(proc, channel, variable, trig, year,
+                  save_names_1D, cfg,
+                  tprefix, indir, subtag, mc_name, data_name,
+                  intersection_str, canvas_prefix, debug, preload=False):
+    """
+    Computes the 1D efficiencies and scale factors of all cut combinations of a channel, variable
+    and trigger intersection, and returns the records of the results store.
+    Their numeric ROOT files are written by `write_eff_1d`, after the fits.
+    With `preload`, all histograms of the inputs are read at once and reused by later calls.
+    """
+    name_data, keylist_data, get_data = utils.get_histograms(
+        os.path.join(indir, tprefix + data_name + '_Sum' + subtag), channel, variable, trig,
+        preload=preload)
+    name_mc, keylist_mc, get_mc = utils.get_histograms(
+        os.path.join(indir, tprefix + mc_name + '_Sum' + subtag), channel, variable, trig,
+        preload=preload)
 
     if debug:
         print('[=debug=] Open files:')
@@ -68,8 +52,6 @@ def draw_eff_and_sf_1d(proc, channel, variable, trig, year,
     hnames1D = {'ref':  utils.get_hnames('Ref1D')(channel, variable, trig),
                 'trig': utils.get_hnames('Trig1D')(channel, variable, trig)}
    
-    keylist_data = utils.get_key_list(file_data, inherits=['TH1'])
-    keylist_mc = utils.get_key_list(file_mc, inherits=['TH1'])
     
     for k in keylist_data:
         if k not in keylist_mc:
@@ -83,7 +65,7 @@ def draw_eff_and_sf_1d(proc, channel, variable, trig, year,
     keys_to_remove = []
     for k in keylist_mc:
         if k not in keylist_data:
-            histo = utils.get_root_object(k, file_mc)
+            histo = get_mc(k)
             stats_cut = 10
             if histo.GetEntries() < stats_cut:
                 keys_to_remove.append(k)
@@ -99,74 +81,50 @@ def draw_eff_and_sf_1d(proc, channel, variable, trig, year,
     assert(set(keylist_data)==set(keylist_mc))
       
     hdata1D, hmc1D = ({} for _ in range(2))
-    hdata1D['ref'] = utils.get_root_object(hnames1D['ref'], file_data)
-    hmc1D['ref'] = utils.get_root_object(hnames1D['ref'], file_mc)   
+    hdata1D['ref'] = get_data(hnames1D['ref'])
+    hmc1D['ref'] = get_mc(hnames1D['ref'])   
     hdata1D['trig'], hmc1D['trig'] = ({} for _ in range(2))
 
     for key in keylist_mc:
         restr1 = utils.rewrite_cut_string(hnames1D['trig'], '')
         if key.startswith(restr1):
-            hdata1D['trig'][key] = utils.get_root_object(key, file_data)
-            hmc1D['trig'][key] = utils.get_root_object(key, file_mc)
-
-            # "solve" TGraphAsymmErrors bin skipping when denominator=0
-            # see TGraphAsymmErrors::Divide() (the default behaviour is very error prone!)
-            # https://root.cern.ch/doc/master/classTGraphAsymmErrors.html#a37a202762b286cf4c7f5d34046be8c0b
-            for h1D in (hdata1D,hmc1D):
-                for ibin in range(1,h1D['trig'][key].GetNbinsX()+1):
-                    if h1D['trig'][key].GetBinContent(ibin)==0. and h1D['ref'].GetBinContent(ibin)==0.:
-                        h1D['ref'].SetBinContent(ibin, 1.)
+            hdata1D['trig'][key] = get_data(key)
+            hmc1D['trig'][key] = get_mc(key)
 
     # some triggers or their intersection naturally never fire for some channels
     # example: 'IsoMu24' for the etau channel
     if len(hmc1D['trig']) == 0:
-        m = ('WARNING [draw_eff_and_sf_1d]: Trigger {} never '.format(trig) +
+        m = ('WARNING [eff_and_sf_1d]: Trigger {} never '.format(trig) +
              'fired for channel={}, variable={} in MC.'.format(variable, channel))
         print(m)
-        return
-    
-    data1D, mc1D, sf1D = ({} for _ in range(3)) 
-    data1D_new, mc1D_new, sf1D_new = ({} for _ in range(3))
-    fit_sigmoid_data, fit_sigmoid_mc, fit_sigmoid_ratio = ({} for _ in range(3))
+        return {}
+
+    # efficiencies and scale factors of all cut combinations are computed at once, as arrays
+    # with one row per cut combination; ROOT graphs are only built for the outputs
+    keys = list(hmc1D['trig'].keys())
+    w, w2 = ({'ref': {}, 'trig': {}} for _ in range(2))
+    for dtype, h1D in (('dt', hdata1D), ('mc', hmc1D)):
+        w['ref'][dtype], w2['ref'][dtype], edges = utils.hist_arrays(h1D['ref'])
+        trig_arrays = [utils.hist_arrays(h1D['trig'][k]) for k in keys]
+        if any(not np.array_equal(x[2], edges) for x in trig_arrays):
+            m = 'There is likely a mismatch in the number of bins.'
+            raise RuntimeError(m)
+        w['trig'][dtype] = np.stack([x[0] for x in trig_arrays])
+        w2['trig'][dtype] = np.stack([x[1] for x in trig_arrays])
+
+    y, eyd, eyu = ({'eff': {}, 'norm': {}} for _ in range(3))
+    for dtype in ('dt', 'mc'):
+        y['eff'][dtype], eyd['eff'][dtype], eyu['eff'][dtype] = efficiency.efficiencies(
+            w['trig'][dtype], w['ref'][dtype], w2['trig'][dtype], w2['ref'][dtype])
+        y['norm'][dtype], eyd['norm'][dtype] = efficiency.normalized(w['trig'][dtype], w2['trig'][dtype])
+        eyu['norm'][dtype] = eyd['norm'][dtype]
     for atype in ('eff', 'norm'):
-        data1D[atype], data1D_new[atype] = ({} for _ in range(2))
-        mc1D[atype], mc1D_new[atype] = ({} for _ in range(2))
-        sf1D[atype], sf1D_new[atype] = ({} for _ in range(2))
+        y[atype]['sf'], eyd[atype]['sf'], eyu[atype]['sf'] = efficiency.scale_factors(
+            y[atype]['dt'], y[atype]['mc'],
+            (eyd[atype]['dt'], eyu[atype]['dt']), (eyd[atype]['mc'], eyu[atype]['mc']))
 
-    try:
-        for kh, vh in hdata1D['trig'].items():
-            data1D['eff'][kh] = ROOT.TGraphAsymmErrors(vh, hdata1D['ref'], "cp")
-            data1D['norm'][kh] = vh.Clone('norm_' + vh.GetName() + '_' + kh)
-            try:
-                data1D['norm'][kh].Scale(1./data1D['norm'][kh].Integral())
-            except ZeroDivisionError:
-                data1D['norm'][kh].Scale(1.)
-            data1D['norm'][kh] = ROOT.TGraphAsymmErrors(data1D['norm'][kh])
-        nb = hmc1D['ref'].GetNbinsX()
-        for kh, vh in hmc1D['trig'].items():
-            # avoid underflow and overflow efficiency division issues
-            hmc1D['ref'].SetBinContent(0, 0.)
-            hmc1D['ref'].SetBinContent(nb+1, 0.)
-            vh.SetBinContent(0, 0.)
-            vh.SetBinContent(nb+1, 0.)
-
-            mc1D['eff'][kh] = ROOT.TGraphAsymmErrors(vh, hmc1D['ref'], "cp")
-            mc1D['norm'][kh] = vh.Clone('norm_' + vh.GetName() + '_' + kh)
-            try:
-                mc1D['norm'][kh].Scale(1/mc1D['norm'][kh].Integral())
-            except ZeroDivisionError:
-                mc1D['norm'][kh].Scale(1)
-            mc1D['norm'][kh] = ROOT.TGraphAsymmErrors(mc1D['norm'][kh])            
-            
-    except SystemError:
-        m = 'There is likely a mismatch in the number of bins.'
-        raise RuntimeError(m)
-
-    tmpkey = list(hmc1D['trig'].keys())[0] #they all have the same binning
-    nb1D = mc1D['eff'][tmpkey].GetN() 
-        
-    darr = lambda x : np.array(x).astype(dtype=np.double)
-    assert len(data1D['eff']) == len(mc1D['eff'])
+    x, ex = efficiency.bin_centers(edges)
+    nb1D = len(x)
 
     # 1-dimensional
     if utils.key_exists(cfg.binedges, variable, channel) and cfg.binedges[variable][channel][0] != "quantiles":
@@ -177,380 +135,156 @@ def draw_eff_and_sf_1d(proc, channel, variable, trig, year,
     else:
         frange = 50, 500
 
-    for atype in ('eff', 'norm'):
-        for (kmc,vmc),(kdata,vdata) in zip(mc1D[atype].items(),data1D[atype].items()):
-            assert(kmc == kdata)
-
-            x, y, exu, exd, eyu, eyd = (
-                utils.dot_dict({'dt': [[] for _ in range(nb1D)],    # data 
-                                'mc': [[] for _ in range(nb1D)],    # MC
-                                'sf': [[] for _ in range(nb1D)] })  # scale factor
-                for _ in range(6))
-
-            for i in range(nb1D):
-                x.mc[i] = ctypes.c_double(0.)
-                y.mc[i] = ctypes.c_double(0.)
-                vmc.GetPoint(i, x.mc[i], y.mc[i])
-                x.mc[i] = x.mc[i].value
-                y.mc[i] = y.mc[i].value
-                
-                exu.mc[i] = vmc.GetErrorXhigh(i)
-                exd.mc[i] = vmc.GetErrorXlow(i)
-                eyu.mc[i] = vmc.GetErrorYhigh(i)
-                eyd.mc[i] = vmc.GetErrorYlow(i)
-                
-                x.dt[i] = ctypes.c_double(0.)
-                y.dt[i] = ctypes.c_double(0.)
-                vdata.GetPoint(i, x.dt[i], y.dt[i])
-                x.dt[i] = x.dt[i].value
-                y.dt[i] = y.dt[i].value
-
-                exu.dt[i] = vdata.GetErrorXhigh(i)
-                exd.dt[i] = vdata.GetErrorXlow(i)
-                eyu.dt[i] = vdata.GetErrorYhigh(i)
-                eyd.dt[i] = vdata.GetErrorYlow(i)
-                
-                if debug:
-                    print('X MC: xp[{}] = {} +{}/-{} '
-                          .format(i,x.mc[i],exu.mc[i],exd.mc[i]), flush=True)
-                    print('Y MC: yp[{}] = {} +{}/-{} '
-                          .format(i,y.mc[i],eyu.mc[i],eyd.mc[i]), flush=True)
-                    print('X Data: xp[{}] = {} +{}/-{} '
-                          .format(i,x.dt[i],exu.dt[i],exd.dt[i]), flush=True)
-                    print('Y Data: yp[{}] = {} +{}/-{}'
-                          .format(i,y.dt[i],eyu.dt[i],eyd.dt[i]), flush=True)
-   
-                x.sf[i] = x.mc[i]
-                exu.sf[i] = exu.mc[i]
-                exd.sf[i] = exd.mc[i]
-                assert x.dt[i] == x.mc[i]
-                assert exu.dt[i] == exu.mc[i]
-                assert exd.dt[i] == exd.mc[i]
-   
-                try:
-                    y.sf[i] = y.dt[i] / y.mc[i]
-                except ZeroDivisionError:
-                    print('There was a division by zero!', flush=True)
-                    y.sf[i] = 0
-   
-                if y.sf[i] == 0:
-                    eyu.sf[i] = 0
-                    eyd.sf[i] = 0
-                else:
-                    eyu.sf[i] = np.sqrt( eyu.mc[i]**2 + eyu.dt[i]**2 )
-                    eyd.sf[i] = np.sqrt( eyd.mc[i]**2 + eyd.dt[i]**2 )
-   
-                if debug:
-                    print('X Scale Factors: xp[{}] = {} +{}/-{}'
-                          .format(i,x.sf[i],exu.sf[i],exd.sf[i]), flush=True)
-                    print('Y Scale Factors: yp[{}] = {} +{}/-{}'
-                          .format(i,y.sf[i],eyu.sf[i],eyd.sf[i]), flush=True)
+    if debug:
+        for atype in ('eff', 'norm'):
+            for ik in range(len(keys)):
+                for i in range(nb1D):
+                    for dname, dtype in (('MC', 'mc'), ('Data', 'dt'), ('Scale Factors', 'sf')):
+                        print('{}: xp[{}] = {} +{}/-{}, yp[{}] = {} +{}/-{}'
+                              .format(dname, i, x[i], ex[i], ex[i], i, y[atype][dtype][ik][i],
+                                      eyu[atype][dtype][ik][i], eyd[atype][dtype][ik][i]), flush=True)
                     print('', flush=True)
 
-            # smoothing fits
-            sf1D[atype][kdata] = ROOT.TGraphAsymmErrors(
-                nb1D, darr(x.sf), darr(y.sf),
-                darr(exd.sf), darr(exu.sf), darr(eyd.sf), darr(eyu.sf))
-            if atype == 'eff' and variable in cfg.fit_vars:
-                fit_data_name = _fit_pp("fit_sigmoid_data_"+kdata)
-                fit_sigmoid_data[kdata] = ROOT.TF1(fit_data_name, "[2]/(1+exp(-[0]*(x-[1])))",
-                                                   frange[0], frange[1])
-                fit_sigmoid_data[kdata].SetLineColor(ROOT.kBlack)
-                fit_sigmoid_data[kdata].SetLineStyle(2)
-                fit_sigmoid_data[kdata].SetParameters(0.05,175.,0.95)
-                data1D[atype][kdata].Fit(fit_data_name, "EM", "", frange[0], frange[1])
-
-                fit_mc_name = _fit_pp("fit_sigmoid_mc_"+kdata)
-                fit_sigmoid_mc[kdata] = ROOT.TF1(fit_mc_name, "[2]/(1+exp(-[0]*(x-[1])))",
-                                                 frange[0], frange[1])
-                fit_sigmoid_mc[kdata].SetLineColor(ROOT.kRed)
-                fit_sigmoid_mc[kdata].SetLineStyle(2)
-                fit_sigmoid_mc[kdata].SetParameters(0.05,175.,0.95)
-                mc1D[atype][kdata].Fit(fit_mc_name, "EM", "", frange[0], frange[1])
-
-                def _ratio_func(x, par):
-                    xx = x[0]
-                    if fit_sigmoid_mc[kdata].Eval(xx) == 0.:
-                        return 0.;
-                    return fit_sigmoid_data[kdata].Eval(xx) / fit_sigmoid_mc[kdata].Eval(xx);
-
-                fit_sigmoid_ratio[kdata] = ROOT.TF1("fit_ratio_"+kdata, _ratio_func,
-                                                    frange[0], frange[1])
-                fit_sigmoid_ratio[kdata].SetLineColor(ROOT.kBlue)
-                fit_sigmoid_ratio[kdata].SetLineStyle(2)
-        
-    if debug:
-        print('[=debug=] 1D Plotting...', flush=True)
+    # the smoothing fits of the efficiencies are run later, for all records at once
+    records = {}
+    for ik, akey in enumerate(keys):
+        outbase = os.path.splitext(save_names_1D[0])[0]
+        rootname = utils.rewrite_cut_string(save_names_1D[-1], akey, regex=True)
+        attrs = {'kind': '1D', 'proc': proc, 'channel': channel, 'variable': variable,
+                 'trig': trig, 'year': year, 'intersection_str': intersection_str,
+                 'canvas_prefix': canvas_prefix,
+                 'outbase': utils.rewrite_cut_string(outbase, akey, regex=True),
+                 'rootname': rootname.replace(canvas_prefix, 'eff_'),
+                 'title_dt': hdata1D['trig'][akey].GetTitle(),
+                 'title_mc': hmc1D['trig'][akey].GetTitle()}
+        if variable in cfg.fit_vars:
+            attrs['frange'] = frange
+        arrays = {'x': x, 'ex': ex}
+        for atype in ('eff', 'norm'):
+            for dtype in ('dt', 'mc', 'sf'):
+                for vname, v in (('y', y), ('eyd', eyd), ('eyu', eyu)):
+                    arrays['_'.join((atype, dtype, vname))] = v[atype][dtype][ik]
+        records['/'.join(('1D', channel, variable, akey))] = {'attrs': attrs, 'arrays': arrays}
 
-    n1dt, n1mc, n1sf, n1sigmfunc = 'Data1D', 'MC1D', 'SF1D', 'SigmoidFunc'
-    for akey in sf1D['eff']:
-        canvas_name = os.path.basename(save_names_1D[0]).split('.')[0]
-        canvas_name = utils.rewrite_cut_string(canvas_name, akey, regex=True)
-        canvas = {}
-        canvas['eff'] = ROOT.TCanvas(canvas_name, 'canvas', 600, 600)
-        canvas['norm'] = ROOT.TCanvas(canvas_name + '_norm', 'canvas_norm', 600, 600)
+    return records
 
-        for atype in ('eff', 'norm'):
-            canvas[atype].cd()
-            pad1 = ROOT.TPad('pad1', 'pad1', 0, 0.3, 1, 1)
-            pad1.SetBottomMargin(0.005)
-            pad1.SetLeftMargin(0.15)
-            pad1.Draw()
-            pad1.cd()
-                
-            max1, min1 = utils.get_obj_max_min(data1D[atype][akey], is_histo=False)
-            max2, min2 = utils.get_obj_max_min(mc1D[atype][akey], is_histo=False)
-            amax = max([max1, max2])
-            amin = min([min1, min2])
-            intervals = 0.1, 0.4
-            if amax == amin:
-                amax = 1.
-                amin = 0.
-
-            nbins = data1D[atype][akey].GetN()
-            # axor_info = nbins+1, -1, nbins
-            # axor_info = nbins+1, data1D[atype][akey].GetPointX(0), data1D[atype][akey].GetPointX(nbins-1)
-            # axor_ndiv = 605, 705
-            # axor = ROOT.TH2D('axor'+akey+atype,'axor'+akey+atype,
-            #                  axor_info[0], axor_info[1], axor_info[2],
-            #                  100, amin-intervals[0]*(amax-amin), amax+intervals[1]*(amax-amin) )
-            # axor.GetYaxis().SetTitle('Efficiency' if atype=='eff' else 'Normalized counts')
-            # axor.GetYaxis().SetNdivisions(axor_ndiv[1])
-            # axor.GetXaxis().SetLabelOffset(1)
-            # axor.GetXaxis().SetNdivisions(axor_ndiv[0])
-            # axor.GetYaxis().SetTitleSize(0.08)
-            # axor.GetYaxis().SetTitleOffset(.85)
-            # axor.GetXaxis().SetLabelSize(0.07)
-            # axor.GetYaxis().SetLabelSize(0.07)
-            # axor.GetXaxis().SetTickLength(0)
-            # axor.Draw()
-
-            # display histograms with equal width binning
-            # data1D_new[atype][akey] = utils.apply_equal_bin_width(data1D[atype][akey])
-            # mc1D_new[atype][akey] = utils.apply_equal_bin_width(mc1D[atype][akey])
-            data1D[atype][akey].GetYaxis().SetTitleSize(0.2)
-            data1D[atype][akey].GetYaxis().SetTitleOffset(1.0)
-            data1D[atype][akey].GetYaxis().SetTitle('Efficiency' if atype=='eff' else 'Normalized counts')
-
-            data1D[atype][akey].SetLineColor(1)
-            data1D[atype][akey].SetLineWidth(2)
-            data1D[atype][akey].SetMarkerColor(1)
-            data1D[atype][akey].SetMarkerSize(1.3)
-            data1D[atype][akey].SetMarkerStyle(20)
-            data1D[atype][akey].GetYaxis().SetLabelSize(0.05)
-            data1D[atype][akey].GetXaxis().SetLabelSize(0.05)
-            data1D[atype][akey].GetXaxis().SetTitleSize(0.05)
-            data1D[atype][akey].GetYaxis().SetTitleSize(0.05)
-            data1D[atype][akey].GetXaxis().SetTitleOffset(1.)
-            data1D[atype][akey].Draw("AP")
-
-            mc1D[atype][akey].SetLineColor(ROOT.kRed)
-            mc1D[atype][akey].SetLineWidth(2)
-            mc1D[atype][akey].SetMarkerColor(ROOT.kRed)
-            mc1D[atype][akey].SetMarkerSize(1.3)
-            mc1D[atype][akey].SetMarkerStyle(22)
-            mc1D[atype][akey].Draw("same P")
-
-            pad1.RedrawAxis()
-            pad1.Draw("same P")
-            
-            x1_pad = pad1.GetUxmin()
-            x2_pad = pad1.GetUxmax()
-            y1_pad = pad1.GetUymin()
-            y2_pad = pad1.GetUymax()
-            if atype == 'eff':
-                data1D[atype][akey].GetYaxis().SetRangeUser(-0.05,1.22)
-                data1D[atype][akey].GetXaxis().SetRangeUser(x1_pad,x2_pad)
-                mc1D[atype][akey].GetYaxis().SetRangeUser(-0.05,1.22)
-                mc1D[atype][akey].GetXaxis().SetRangeUser(x1_pad,x2_pad)
-            else:
-                norm_min = amin-intervals[0]*(amax-amin)
-                norm_max = amax+intervals[1]*(amax-amin)
-                data1D[atype][akey].GetYaxis().SetRangeUser(norm_min,norm_max)
-                mc1D[atype][akey].GetYaxis().SetRangeUser(norm_min,norm_max)
-
-            l = ROOT.TLine()
-            l.SetLineWidth(2)
-            l.SetLineStyle(7)
-            l.DrawLine(x1_pad,1.,x2_pad,1.)
-
-            # l = ROOT.TLine()
-            # l.SetLineWidth(2)
-            # l.SetLineStyle(7)
-            # l.DrawLine(180.,y1_pad,180.,y2_pad)
-
-            leg = ROOT.TLegend(0.61, 0.77, 0.89, 0.89)
-            leg.SetFillColor(0)
-            leg.SetShadowColor(0)
-            leg.SetBorderSize(0)
-            leg.SetTextSize(0.04)
-            leg.SetFillStyle(0)
-            leg.SetTextFont(standard_text_font)
-
-            leg.AddEntry(data1D[atype][akey], 'Data', 'p')
-            leg.AddEntry(mc1D[atype][akey],
-                         proc.replace('MC_', '').replace('TT', 'TTbar').replace('_', '+'), 'p')
-            leg.Draw('same')
-
-            utils.redraw_border()
-            pad1.RedrawAxis()
-            pad1.Draw("same P")
-            
-            lX, lY, lXstep, lYstep = 0.18, 0.85, 0.02, 0.06
-            l = ROOT.TLatex()
-            l.SetNDC()
-            l.SetTextFont(standard_text_font) #72 bold italic
-            l.SetTextColor(1)
-            l.SetTextSize(0.04)
-
-            latexChannel = copy(channel)
-            latexChannel = latexChannel.replace('mu','#mu')
-            latexChannel = latexChannel.replace('tau','#tau_{h}')
-            latexChannel = latexChannel.replace('Tau','#tau_{h}')
-
-            l.DrawLatex(lX, lY, 'Channel: '+latexChannel)
-            textrigs = utils.write_trigger_string(trig, intersection_str, items_per_line=2)
-            l.DrawLatex(lX, lY-lYstep, textrigs)
-
-            pad_left = pad1.GetLeftMargin()
-            pad_top  = pad1.GetTopMargin()
-
-            latex_CMS = ROOT.TLatex()
-            latex_CMS.SetTextSize(cms_text_size*pad_top)
-            latex_CMS.SetNDC()
-            latex_CMS.SetTextAngle(0)
-            latex_CMS.SetTextColor(ROOT.kBlack)
-            latex_CMS.SetTextFont(CMS_text_font);
-            latex_CMS.SetBit(ROOT.kCanDelete)
-            latex_CMS.DrawLatex(lX-1.5*lXstep, lY+1.3*lYstep, "CMS")
-
-            latex_Prelim = ROOT.TLatex()
-            latex_Prelim.SetTextSize(lumi_text_size*pad_top)
-            latex_Prelim.SetNDC()
-            latex_Prelim.SetTextAngle(0)
-            latex_Prelim.SetTextColor(ROOT.kBlack)
-            latex_Prelim.SetTextFont(extra_text_font)
-            latex_Prelim.SetBit(ROOT.kCanDelete)
-            latex_Prelim.DrawLatex(lX+4*lXstep, lY+1.3*lYstep, "Preliminary")
-
-            lumi_d = {"2016APV": "19.5", "2016": "16.8", "2017": "41.5", "2018": "59.7"}
-            latex_lumi = ROOT.TLatex()
-            latex_lumi.SetTextSize(lumi_text_size*pad_top)
-            latex_lumi.SetNDC()
-            latex_lumi.SetTextAngle(0)
-            latex_lumi.SetTextColor(ROOT.kBlack)
-            latex_lumi.SetTextFont(standard_text_font)
-            latex_lumi.SetBit(ROOT.kCanDelete)
-            latex_lumi.DrawLatex(lX+22*lXstep, lY+1.3*lYstep, lumi_d[args.year] + " fb^{-1} (13 TeV)")
-
-            canvas[atype].cd()
-            pad2 = ROOT.TPad('pad2','pad2',0.,0.,1.,0.3)
-            pad2.SetTopMargin(0.01)
-            pad2.SetBottomMargin(0.3)
-            pad2.SetLeftMargin(0.15)
-            pad2.Draw()
-            pad2.cd()
-            pad2.SetGridy()
-
-            if max(y.sf) == min(y.sf):
-                max1, min1 = 1.1, -0.1
+def fit_eff_1d(records, previous, debug):
+    """
+    Sigmoid fits of the Data and MC efficiencies of all 1D records requiring them, as a single batch.
+    `previous` holds the records of an earlier run: fits with the same inputs (same hash) are reused,
+    and the other ones start from their earlier result when available. Fits which do not converge are
+    started again from neighbouring cut combinations of the same channel and variable.
+    Adds the parameters, their uncertainties and the scale factor curve to the records.
+    """
+    curves, tofit, starts = [], [], []
+    for name, rec in records.items():
+        attrs, arrays = rec['attrs'], rec['arrays']
+        if 'frange' not in attrs:
+            continue
+        for dtype in ('dt', 'mc'):
+            inputs = [arrays['x'], arrays['eff_'+dtype+'_y'], arrays['eff_'+dtype+'_eyd'],
+                      arrays['eff_'+dtype+'_eyu'], arrays['ex'], attrs['frange']]
+            h = fitting.fit_hash(*inputs)
+            prev = previous.get(name)
+            if prev is not None and prev['attrs'].get('fit_hash_'+dtype) == h:
+                for k in ('fit_', 'fit_err_'):
+                    arrays[k+dtype] = prev['arrays'][k+dtype]
+                for k in ('fit_hash_', 'fit_chi2_', 'fit_ndf_'):
+                    attrs[k+dtype] = prev['attrs'][k+dtype]
+                continue
+            curves.append((name, dtype, inputs, h))
+            if prev is not None and 'fit_'+dtype in prev['arrays']:
+                starts.append(prev['arrays']['fit_'+dtype])
             else:
-                max1, min1 = max(y.sf)+max(eyu.sf),min(y.sf)-max(eyd.sf)
-
-            # axor2 = ROOT.TH2D('axor2'+akey+atype, 'axor2'+akey+atype,
-            #                   axor_info[0], axor_info[1], axor_info[2],
-            #                   100, min1-0.1*(max1-min1), max1+0.1*(max1-min1))
-            # axor2.GetXaxis().SetNdivisions(axor_ndiv[0])
-            # axor2.GetYaxis().SetNdivisions(axor_ndiv[1])
-
-            # # Change bin labels
-            # rounding = lambda x: int(x) if 'pt' in variable else round(x, 2)
-            # for i,elem in enumerate(sf1D[atype][akey].GetX()):
-            #     axor2.GetXaxis().SetBinLabel(i+1, str(rounding(elem-sf1D[atype][akey].GetErrorXlow(i))))
-            # axor2.GetXaxis().SetBinLabel(i+2, str(rounding(elem+sf1D[atype][akey].GetErrorXlow(i))))
-
-            # axor2.GetYaxis().SetLabelSize(0.12)
-            # axor2.GetXaxis().SetLabelSize(0.18)
-            # axor2.GetXaxis().SetLabelOffset(0.015)
-            # axor2.SetTitleSize(0.13,'X')
-            # axor2.SetTitleSize(0.12,'Y')
-            # axor2.GetXaxis().SetTitleOffset(1.)
-            # axor2.GetYaxis().SetTitleOffset(0.5)
-            # axor2.GetYaxis().SetTitle('Data/MC')
-            
-            # axor2.GetXaxis().SetTitle( utils.get_display_variable_name(channel, variable) )
-            # axor2.GetXaxis().SetTickLength(0)
-            # axor2.Draw()
-
-            # sf1D_new[atype] = utils.apply_equal_bin_width(sf1D[atype][akey])
-            canvas[atype].Update()
-            #sf1D[atype][akey].GetYaxis().SetNdivisions(-10)
-            sf1D[atype][akey].GetYaxis().SetRangeUser(-0.15,1.15)
-            sf1D[atype][akey].SetLineColor(ROOT.kBlue)
-            sf1D[atype][akey].SetLineWidth(2)
-            sf1D[atype][akey].SetMarkerColor(ROOT.kBlue)
-            sf1D[atype][akey].SetMarkerSize(1.3)
-            sf1D[atype][akey].SetMarkerStyle(22)
-            sf1D[atype][akey].GetYaxis().SetLabelSize(0.1)
-            sf1D[atype][akey].GetXaxis().SetLabelSize(0.1)
-            sf1D[atype][akey].GetXaxis().SetTitleSize(0.1)
-            sf1D[atype][akey].GetYaxis().SetTitleSize(0.1)
-            sf1D[atype][akey].GetXaxis().SetTitleOffset(1.)
-            sf1D[atype][akey].GetYaxis().SetTitleOffset(0.45)
-            sf1D[atype][akey].GetYaxis().SetTitle('Data/MC')
-            xlabel = utils.get_display_variable_name(channel, variable)
-            if "met" in variable:
-                xlabel += " [GeV]"
-            sf1D[atype][akey].GetXaxis().SetTitle(xlabel)
-            sf1D[atype][akey].GetXaxis().SetTickLength(0.07)
-            sf1D[atype][akey].Draw("AP")
-            if atype == 'eff' and akey in fit_sigmoid_ratio:
-                fit_sigmoid_ratio[akey].Draw("same")
-
-            pad2.Update()
-            utils.redraw_border()
-            pad2.RedrawAxis()
-            pad2.Draw("same P")
-        
-            for aname in save_names_1D[:-1]:
-                _name = utils.rewrite_cut_string(aname, akey, regex=True)
-                _name = _name.replace(args.canvas_prefix, atype + '_' + args.canvas_prefix)
-                canvas[atype].SaveAs( _name )
-
-        _name_base = utils.rewrite_cut_string(save_names_1D[-1], akey, regex=True)
-        for atype in ('eff',):
-            _name = _name_base.replace(args.canvas_prefix, atype + '_')
-            afile = ROOT.TFile.Open(_name, 'RECREATE')
-            afile.cd()
-
-            # save the original histograms, not the ones for visualization
-            data1D[atype][akey].SetName(n1dt)
-            data1D[atype][akey].Write(n1dt)
-            mc1D[atype][akey].SetName(n1mc)
-            mc1D[atype][akey].Write(n1mc)
-            sf1D[atype][akey].SetName(n1sf)
-            sf1D[atype][akey].Write(n1sf)
-
-            if variable in cfg.fit_vars:
-                fit_sigmoid_data[akey].Write(n1sigmfunc+"Data")
-                fit_sigmoid_mc[akey].Write(n1sigmfunc+"MC")
-                if akey in fit_sigmoid_ratio:
-                    fit_sigmoid_ratio[akey].Write(n1sigmfunc+"SF")
-
+                starts.append(fitting.default_start)
+
+    if len(curves) > 0:
+        inputs = list(zip(*(c[2] for c in curves)))
+        groups = ['/'.join((records[n]['attrs']['channel'], records[n]['attrs']['variable'], d))
+                  for n, d, _, _ in curves]
+        pars, errors, chi2, ndf, converged = fitting.fit_sigmoids(*inputs, starts=starts, groups=groups)
+        for ic, (name, dtype, _, h) in enumerate(curves):
+            attrs, arrays = records[name]['attrs'], records[name]['arrays']
+            arrays['fit_'+dtype], arrays['fit_err_'+dtype] = pars[ic], errors[ic]
+            attrs['fit_hash_'+dtype], attrs['fit_chi2_'+dtype], attrs['fit_ndf_'+dtype] = h, chi2[ic], ndf[ic]
+            if not converged[ic]:
+                print('WARNING [fit_eff_1d]: The {} fit of {} did not converge.'.format(dtype, name))
     if debug:
-        print('[=debug=] 2D Plotting...', flush=True)
-
-
-def draw_eff_and_sf_2d(proc, channel, joinvars, trig, year, save_names_2D,
-                       tprefix, indir, subtag, mc_name, data_name,
-                       intersection_str, debug):
+        print('[=debug=] {} fits run, {} reused.'.format(len(curves), sum(
+            1 for r in records.values() if 'frange' in r['attrs'])*2 - len(curves)))
 
-    name_data = os.path.join(indir, tprefix + data_name + '_Sum' + subtag + ".root")
+    for rec in records.values():
+        attrs, arrays = rec['attrs'], rec['arrays']
+        if 'frange' in attrs:
+            arrays['fit_sf_x'] = np.linspace(attrs['frange'][0], attrs['frange'][1], 200)
+            arrays['fit_sf_y'] = fitting.sigmoid_ratio(arrays['fit_sf_x'], arrays['fit_dt'], arrays['fit_mc'])
 
-    file_data = ROOT.TFile.Open(name_data, 'READ')
+def write_eff_1d(name, attrs, arrays):
+    """Numeric ROOT file of a 1D record: Data, MC and scale factor graphs, and the sigmoid functions."""
+    n1dt, n1mc, n1sf, n1sigmfunc = 'Data1D', 'MC1D', 'SF1D', 'SigmoidFunc'
+    x, ex = arrays['x'], arrays['ex']
+    darr = lambda v : np.ascontiguousarray(v, dtype=np.double)
+    def graph(dtype):
+        v, vd, vu = (arrays['_'.join(('eff', dtype, n))] for n in ('y', 'eyd', 'eyu'))
+        return ROOT.TGraphAsymmErrors(len(x), darr(x), darr(v), darr(ex), darr(ex), darr(vd), darr(vu))
+
+    afile = ROOT.TFile.Open(attrs['rootname'], 'RECREATE')
+    afile.cd()
+    graphs = {}
+    for dtype, gname, title in (('dt', n1dt, attrs['title_dt']), ('mc', n1mc, attrs['title_mc']), ('sf', n1sf, '')):
+        graphs[dtype] = graph(dtype)
+        graphs[dtype].SetName(gname)
+        graphs[dtype].SetTitle(title)
+
+    if 'frange' in attrs:
+        frange = attrs['frange']
+        fits = {}
+        for dtype, fname, color in (('dt', 'Data', ROOT.kBlack), ('mc', 'MC', ROOT.kRed)):
+            fits[dtype] = ROOT.TF1(_fit_pp('fit_sigmoid_' + fname.lower() + '_' + name.split('/')[-1]),
+                                   fitting.sigmoid_formula, frange[0], frange[1])
+            fits[dtype].SetLineColor(color)
+            fits[dtype].SetLineStyle(2)
+            for ip in range(3):
+                fits[dtype].SetParameter(ip, arrays['fit_'+dtype][ip])
+                fits[dtype].SetParError(ip, arrays['fit_err_'+dtype][ip])
+            fits[dtype].SetChisquare(attrs['fit_chi2_'+dtype])
+            fits[dtype].SetNDF(int(attrs['fit_ndf_'+dtype]))
+            graphs[dtype].GetListOfFunctions().Add(fits[dtype])
+
+        # ratio of the data and MC sigmoids, with the six fitted parameters
+        ratio = ROOT.TF1(_fit_pp('fit_ratio_' + name.split('/')[-1]),
+                         '({})/({})'.format(fitting.sigmoid_formula,
+                                            fitting.sigmoid_formula.replace('[0]', '[3]')
+                                            .replace('[1]', '[4]').replace('[2]', '[5]')),
+                         frange[0], frange[1])
+        ratio.SetLineColor(ROOT.kBlue)
+        ratio.SetLineStyle(2)
+        for ip, par in enumerate(np.concatenate((arrays['fit_dt'], arrays['fit_mc']))):
+            ratio.SetParameter(ip, par)
+
+    for dtype, gname in (('dt', n1dt), ('mc', n1mc), ('sf', n1sf)):
+        graphs[dtype].Write(gname)
+    if 'frange' in attrs:
+        fits['dt'].Write(n1sigmfunc+"Data")
+        fits['mc'].Write(n1sigmfunc+"MC")
+        ratio.Write(n1sigmfunc+"SF")
+    afile.Close()
+
+def eff_and_sf_2d(proc, channel, joinvars, trig, year, save_names_2D,
+                  tprefix, indir, subtag, mc_name, data_name,
+                  intersection_str, debug, preload=False):
+    """
+    Computes the 2D efficiencies and scale factors of all cut combinations of a channel, pair of variables
+    and trigger intersection, writes their numeric ROOT file and returns the records of the results store.
+    With `preload`, all histograms of the inputs are read at once and reused by later calls.
+    """
 
-    name_mc = os.path.join(indir, tprefix + mc_name + '_Sum' + subtag + ".root")
-    file_mc = ROOT.TFile.Open(name_mc, 'READ')
+    name_data, keylist_data, get_data = utils.get_histograms(
+        os.path.join(indir, tprefix + data_name + '_Sum' + subtag), channel, joinvars, trig,
+        preload=preload)
+    name_mc, keylist_mc, get_mc = utils.get_histograms(
+        os.path.join(indir, tprefix + mc_name + '_Sum' + subtag), channel, joinvars, trig,
+        preload=preload)
 
     if debug:
         print('[=debug=] Open files:')
@@ -564,8 +298,6 @@ def draw_eff_and_sf_2d(proc, channel, joinvars, trig, year, save_names_2D,
     hnames2D = { 'ref':  utils.get_hnames('Ref2D')(channel, joinvars, trig),
                  'trig': utils.get_hnames('Trig2D')(channel, joinvars, trig) }
    
-    keylist_data = utils.get_key_list(file_data, inherits=['TH1'])
-    keylist_mc = utils.get_key_list(file_mc, inherits=['TH1'])
 
     for k in keylist_data:
         if k not in keylist_mc:
@@ -579,7 +311,7 @@ def draw_eff_and_sf_2d(proc, channel, joinvars, trig, year, save_names_2D,
     keys_to_remove = []
     for k in keylist_mc:
         if k not in keylist_data:
-            histo = utils.get_root_object(k, file_mc)
+            histo = get_mc(k)
             stats_cut = 10
             if histo.GetEntries() < stats_cut:
                 keys_to_remove.append(k)
@@ -595,15 +327,15 @@ def draw_eff_and_sf_2d(proc, channel, joinvars, trig, year, save_names_2D,
     assert(set(keylist_data)==set(keylist_mc))
 
     hdata2D, hmc2D = ({} for _ in range(2))
-    hdata2D['ref'] = utils.get_root_object(hnames2D['ref'], file_data)
-    hmc2D['ref'] = utils.get_root_object(hnames2D['ref'], file_mc)   
+    hdata2D['ref'] = get_data(hnames2D['ref'])
+    hmc2D['ref'] = get_mc(hnames2D['ref'])   
     hdata2D['trig'], hmc2D['trig'] = ({} for _ in range(2))
 
     for key in keylist_mc:
         restr2 = utils.rewrite_cut_string(hnames2D['trig'], '')
         if key.startswith(restr2):
-            hdata2D['trig'][key] = utils.get_root_object(key, file_data)
-            hmc2D['trig'][key] = utils.get_root_object(key, file_mc)
+            hdata2D['trig'][key] = get_data(key)
+            hmc2D['trig'][key] = get_mc(key)
 
             for h2D in [hdata2D,hmc2D]:
                 for ix in range(1,h2D['trig'][key].GetNbinsX()+1):
@@ -617,7 +349,7 @@ def draw_eff_and_sf_2d(proc, channel, joinvars, trig, year, save_names_2D,
     if  len(hmc2D['trig']) == 0:
         print('WARNING: Trigger {} never fired for channel {} in MC.'
               .format(trig, channel))
-        return
+        return {}
     
     effdata2D, effmc2D = ({} for _ in range(2))
     try:
@@ -645,132 +377,50 @@ def draw_eff_and_sf_2d(proc, channel, joinvars, trig, year, save_names_2D,
         sf2D[kh].Sumw2()
         sf2D[kh].Divide(effmc2D[kh])
         
-    if debug:
-        print('[=debug=] 2D Plotting...', flush=True)
-
     n2 = ['Data2D', 'MC2D', 'SF2D']
-    cnames = [x + '_c' for x in n2]
-    ROOT.gStyle.SetPaintTextFormat("4.3f");
-
     base_name = ( save_names_2D[joinvars][n2[0]][0]
                   .split('.')[0]
                   .replace('EffData_', '')
                   .replace('Canvas2D_', '') )
 
+    records = {}
     hzip = zip(effdata2D.items(), effmc2D.items(), sf2D.items())
     for items in hzip:
+        akey = items[0][0]
         # save 2D histograms
-        _name = utils.rewrite_cut_string(base_name, items[0][0], regex=True)
+        _name = utils.rewrite_cut_string(base_name, akey, regex=True)
         _name += '.root'
 
         eff_file_2D = ROOT.TFile.Open(_name, 'RECREATE')
         eff_file_2D.cd()
 
+        attrs = {'kind': '2D', 'channel': channel, 'joinvars': joinvars,
+                 'trig': trig, 'intersection_str': intersection_str}
+        arrays = {}
         for itype, obj in enumerate(items):
             obj[1].SetName(n2[itype])
             obj[1].Write(n2[itype])
-  
-            # upper and lower 2D uncertainties
-            eff_eu = obj[1].Clone(n2[itype] + '_eu')
-            eff_ed = obj[1].Clone(n2[itype] + '_ed')
-            for i in range(1,obj[1].GetNbinsX()+1):
-                for j in range(1,obj[1].GetNbinsY()+1):
-                    abin = obj[1].GetBin(i, j)
-                    eu2d = obj[1].GetBinErrorLow(abin)
-                    ed2d = obj[1].GetBinErrorUp(abin)
-                    if obj[1].GetBinContent(abin)==0.:
-                        eff_eu.SetBinContent(abin, 0.)
-                        eff_ed.SetBinContent(abin, 0.)
-                    else:
-                        eff_eu.SetBinContent(abin, eu2d)
-                        eff_ed.SetBinContent(abin, ed2d)
-      
-                    if eff_eu.GetBinContent(abin)==0.:
-                        eff_eu.SetBinContent(abin, 1.e-10)
-                    if eff_ed.GetBinContent(abin)==0.:
-                        eff_ed.SetBinContent(abin, 1.e-10)
-
-            canvas = ROOT.TCanvas(cnames[itype]+obj[0], cnames[itype]+obj[0], 600, 600)
-            canvas.SetLeftMargin(0.10)
-            canvas.SetRightMargin(0.15);
-            canvas.cd()
-      
-            vnames_2D = utils.split_vnames(joinvars)
-            vname_x = utils.get_display_variable_name(channel, vnames_2D[0])
-            vname_y = utils.get_display_variable_name(channel, vnames_2D[1])
-            rx = 2 if 'pt' not in vname_x else 0
-            ry = 2 if 'pt' not in vname_y else 0
-            veff_new = utils.apply_equal_bin_width(obj[1], roundx=rx, roundy=ry)
-            veff_new.GetXaxis().SetTitleOffset(1.0)
-            veff_new.GetYaxis().SetTitleOffset(1.3)
-            veff_new.GetXaxis().SetTitleSize(0.03)
-            veff_new.GetYaxis().SetTitleSize(0.03)
-            veff_new.GetXaxis().SetLabelSize(0.03)
-            veff_new.GetYaxis().SetLabelSize(0.03)
-            veff_new.GetXaxis().SetTitle(vname_x)
-            veff_new.GetYaxis().SetTitle(vname_y)
-            # useful when adding errors
-            # check scripts/draw2DTriggerSF.py
-            veff_new.SetBarOffset(0.22)
-            veff_new.SetMarkerSize(.75)
-            veff_new.SetMarkerColor(ROOT.kOrange+10)
-            veff_new.SetMarkerSize(.8)
-            ROOT.gStyle.SetPaintTextFormat("4.3f");
-            veff_new.Draw('colz text')
-      
-            # numerator and denominator
-            if itype == 0: # data
-                htot = hdata2D['ref'].Clone('tot')
-                hpass = hdata2D['trig'][obj[0]].Clone('pass')
-            elif itype == 1: # MC
-                htot = hmc2D['ref'].Clone('tot')
-                hpass = hmc2D['trig'][obj[0]].Clone('pass')
-
-            if itype < 2:
-                htot.SetName('tot_' + str(itype))
-                hpass.SetName('pass_' + str(itype))
-                htot = utils.apply_equal_bin_width(htot)
-                hpass = utils.apply_equal_bin_width(hpass)
-                htot.SetMarkerSize(.65)
-                hpass.SetMarkerSize(.65)
-                htot.SetMarkerColor(ROOT.kOrange+6)
-                hpass.SetMarkerColor(ROOT.kOrange+6)
-                hpass.SetBarOffset(-0.10)
-                htot.SetBarOffset(-0.22)
-                ROOT.gStyle.SetPaintTextFormat("4.3f");
-                hpass.Draw("same text")
-                htot.Draw("same text")
-      
-            # up and down errors for the 2D histogram
-            eff_eu = utils.apply_equal_bin_width(eff_eu)
-            eff_ed = utils.apply_equal_bin_width(eff_ed)
-            eff_eu.SetMarkerSize(.6)
-            eff_ed.SetMarkerSize(.6)
-            eff_eu.SetBarOffset(0.323);
-            eff_ed.SetBarOffset(0.10);
-            eff_eu.SetMarkerColor(ROOT.kBlack)
-            eff_ed.SetMarkerColor(ROOT.kBlack)
-            ROOT.gStyle.SetPaintTextFormat("+ 4.3f xxx");
-            eff_eu.Draw("same text")
-            ROOT.gStyle.SetPaintTextFormat("- 4.3f");
-            eff_ed.Draw("same text")
-      
-            lX, lY, lYstep = 0.8, 0.92, 0.045
-            l = ROOT.TLatex()
-            l.SetNDC()
-            l.SetTextFont(72)
-            l.SetTextColor(2)
-            textrig = utils.write_trigger_string(trig, intersection_str,
-                                                 items_per_line=2)
-            l.DrawLatex(lX, lY, n2[itype].replace('2D',''))
-      
-            paint2d(channel, textrig)
-            utils.redraw_border()
 
-            for full in save_names_2D[joinvars][n2[itype]]:
-                full = utils.rewrite_cut_string(full, obj[0], regex=True)
-                full = full.replace('Canvas2D_', '')
-                canvas.SaveAs(full)
+            # upper and lower 2D uncertainties, with a tiny value instead of zero for display
+            vals, arrays['edges_x'], arrays['edges_y'] = utils.hist2d_arrays(obj[1])
+            eu = np.where(vals == 0., 0., utils.hist2d_arrays(obj[1], 'GetBinErrorLow')[0])
+            ed = np.where(vals == 0., 0., utils.hist2d_arrays(obj[1], 'GetBinErrorUp')[0])
+            arrays[n2[itype]] = vals
+            arrays[n2[itype] + '_eu'] = np.where(eu == 0., 1.e-10, eu)
+            arrays[n2[itype] + '_ed'] = np.where(ed == 0., 1.e-10, ed)
+
+            full = save_names_2D[joinvars][n2[itype]][0]
+            full = utils.rewrite_cut_string(full, akey, regex=True).replace('Canvas2D_', '')
+            attrs['outbase_' + n2[itype]] = os.path.splitext(full)[0]
+        eff_file_2D.Close()
+
+        # numerator and denominator
+        for itype, h2D in enumerate((hdata2D, hmc2D)):
+            arrays['tot_' + str(itype)] = utils.hist2d_arrays(h2D['ref'])[0]
+            arrays['pass_' + str(itype)] = utils.hist2d_arrays(h2D['trig'][akey])[0]
+        records['/'.join(('2D', channel, joinvars, akey))] = {'attrs': attrs, 'arrays': arrays}
+
+    return records
 
 def _fit_pp(s):
     return s.replace('>', 'G').replace('<', 'L').replace('=', 'EQ')
@@ -786,14 +436,14 @@ def _get_canvas_name(prefix, proc, chn, var, trig, data_name, subtag):
     return n
 
 def run_eff_sf_1d_outputs(outdir, data_name, mc_name,
-                          tcomb, channels, variables, subtag):
+                          tcomb, channels, variables, subtag, canvas_prefix):
     outputs = [[] for _ in range(len(main.extensions))]
     processes = [mc_name] #CHANGE !!!! IF STUDYING MCs SEPARATELY
     
     for proc in processes:
         for ch in channels:
             for var in variables:
-                canvas_name = _get_canvas_name(args.canvas_prefix,
+                canvas_name = _get_canvas_name(canvas_prefix,
                                                proc, ch, var,
                                                tcomb,
                                                data_name, subtag)
@@ -808,7 +458,7 @@ def run_eff_sf_1d_outputs(outdir, data_name, mc_name,
     return sum(outputs, []), main.extensions, processes
 
 def run_eff_sf_2d_outputs(outdir, proc, data_name, cfg, tcomb,
-                          channel, subtag, intersection_str, debug):
+                          channel, subtag, intersection_str, canvas_prefix, debug):
     """
     This output function is not ready to be used in the luigi framework.
     It returns the outputs corresponding to a single trigger combination.
@@ -826,7 +476,7 @@ def run_eff_sf_2d_outputs(outdir, proc, data_name, cfg, tcomb,
             if onetrig in cfg.pairs2D:
                 for j in cfg.pairs2D[onetrig]:
                     vname = utils.add_vnames(j[0],j[1])
-                    pref2d = args.canvas_prefix.replace('1', '2')
+                    pref2d = canvas_prefix.replace('1', '2')
                     cname = _get_canvas_name(pref2d,
                                              proc, channel, vname,
                                              tcomb,
@@ -860,10 +510,14 @@ def run_eff_sf_2d_outputs(outdir, proc, data_name, cfg, tcomb,
 
 def run_eff_sf_1d(indir, outdir, data_name, mc_name, configuration,
                   tcomb, year, channels, variables, subtag,
-                  tprefix, intersection_str, debug):
-    
+                  tprefix, intersection_str, canvas_prefix, debug, preload=False):
+    """
+    Numeric efficiencies and scale factors of a trigger intersection: ROOT files with
+    the graphs and histograms of each cut combination, and a results store for the plots.
+    `preload` is forwarded to `eff_and_sf_1d` and `eff_and_sf_2d`.
+    """
     outs1D, extensions, processes = run_eff_sf_1d_outputs(outdir, data_name, mc_name, tcomb,
-                                                          channels, variables, subtag)
+                                                          channels, variables, subtag, canvas_prefix)
 
     config_module = importlib.import_module(configuration)
     
@@ -872,10 +526,12 @@ def run_eff_sf_1d(indir, outdir, data_name, mc_name, configuration,
         triggercomb[chn] = utils.generate_trigger_combinations(chn, config_module.triggers,
                                                                config_module.exclusive)
 
-    dv = len(args.variables)
-    dc = len(args.channels) * dv
+    dv = len(variables)
+    dc = len(channels) * dv
     dp = len(processes) * dc
 
+    records = {}
+
     for ip,proc in enumerate(processes):
         for ic,chn in enumerate(channels):
             if not utils.is_trigger_comb_in_channel(chn, tcomb, config_module.triggers,
@@ -885,7 +541,7 @@ def run_eff_sf_1d(indir, outdir, data_name, mc_name, configuration,
                 index = ip*dc + ic*dv + iv
                 names1D = [ outs1D[index + dp*x] for x in range(len(extensions)) ]
 
-                if args.debug:
+                if debug:
                     for name in names1D:
                         print('[=debug=] {}'.format(name))
                         m = ( 'process={}, channel={}, variable={}'
@@ -893,13 +549,22 @@ def run_eff_sf_1d(indir, outdir, data_name, mc_name, configuration,
                         m += ', trigger_combination={}\n'.format(tcomb)
                         print(m)
 
-                draw_eff_and_sf_1d(proc, chn, var, tcomb, year, names1D, config_module,
-                                   tprefix, indir, subtag, mc_name, data_name,
-                                   intersection_str, debug)
+                records.update(eff_and_sf_1d(proc, chn, var, tcomb, year, names1D, config_module,
+                                             tprefix, indir, subtag, mc_name, data_name,
+                                             intersection_str, canvas_prefix, debug, preload))
+
+    # the results store of an earlier run caches the fits
+    store = results.results_name(outdir, tcomb, subtag)
+    previous = {}
+    if os.path.isfile(store):
+        previous = results.read_results(store, [x for x in results.list_results(store) if x.startswith('1D/')])
+    fit_eff_1d(records, previous, debug)
+    for name, rec in records.items():
+        write_eff_1d(name, rec['attrs'], rec['arrays'])
 
     splits = tcomb.split(intersection_str)
     for x in splits:
-        if x not in main.trig_map[args.year]:
+        if x not in main.trig_map[year]:
             mess = 'Trigger {} was not defined in the configuration.'.format(x)
             raise ValueError(mess)
         
@@ -912,7 +577,7 @@ def run_eff_sf_1d(indir, outdir, data_name, mc_name, configuration,
                     continue
                 
                 names2D = run_eff_sf_2d_outputs(outdir, proc, data_name, config_module, tcomb, 
-                                                chn, subtag, intersection_str, debug)
+                                                chn, subtag, intersection_str, canvas_prefix, debug)
 
                 for onetrig in splits:
                     if onetrig in config_module.pairs2D:
@@ -920,44 +585,80 @@ def run_eff_sf_1d(indir, outdir, data_name, mc_name, configuration,
                         for j in config_module.pairs2D[onetrig]:
                             vname = utils.add_vnames(j[0],j[1])
 
-                            draw_eff_and_sf_2d(proc, chn, vname, tcomb, year, names2D,
-                                               tprefix, indir, subtag, mc_name, data_name,
-                                               intersection_str, debug)
-
-parser = argparse.ArgumentParser(description='Draw trigger scale factors')
-parser.add_argument('--indir', help='Inputs directory', required=True)
-parser.add_argument('--outdir', help='Output directory', required=True, )
-parser.add_argument('--tprefix', help='prefix to the names of the produceyd outputs (targets in luigi lingo)', required=True)
-parser.add_argument('--canvas_prefix', help='canvas prefix', required=True)
-parser.add_argument('--subtag', required=True, help='subtag')
-parser.add_argument('--mc_name', required=True, type=str,
-                    help='Id for all MC samples')
-parser.add_argument('--data_name', required=True, type=str,
-                    help='Id for all data samples',)
-parser.add_argument('--triggercomb', required=True,
-                    help='Trigger intersection combination.')
-parser.add_argument('--channels', required=True, nargs='+', type=str,
-                    help='Select the channels over which the workflow will be run.' )
-parser.add_argument('--year', default="2018", type=str,
-                    choices=("2016", "2016APV", "2017", "2018"), help='Period/era.' )
-parser.add_argument('--variables',        dest='variables',        required=True, nargs='+', type=str,
-                    help='Select the variables over which the workflow will be run.' )
-parser.add_argument('--intersection_str', dest='intersection_str', required=False, default=main.inters_str,
-                    help='String useyd to represent set intersection between triggers.')
-parser.add_argument('--configuration', dest='configuration', required=True,
-                    help='Name of the configuration module to use.')
-parser.add_argument('--debug', action='store_true', help='debug verbosity')
-args = utils.parse_args(parser)
-
-ROOT.gStyle.SetOptStat(0)
-ROOT.gStyle.SetOptTitle(0)
-run_eff_sf_1d(args.indir, args.outdir,
-              args.data_name, args.mc_name,
-              args.configuration,
-              args.triggercomb,
-              args.year,
-              args.channels, args.variables,
-              args.subtag,
-              args.tprefix,
-              args.intersection_str,
-              args.debug)
+                            records.update(eff_and_sf_2d(proc, chn, vname, tcomb, year, names2D,
+                                                         tprefix, indir, subtag, mc_name, data_name,
+                                                         intersection_str, debug, preload))
+
+    # results store, used by `render_eff_and_sf.py` to draw the plots
+    utils.create_single_dir(os.path.dirname(store))
+    results.write_results(store, records)
+
+def triggercombs(channels, config_module):
+    """Trigger intersections of all channels, each appearing once, as strings."""
+    tcombs = []
+    for chn in channels:
+        tcombs += utils.generate_trigger_combinations(chn, config_module.triggers, config_module.exclusive)
+    return sorted(set(utils.join_name_trigger_intersection(x) for x in tcombs))
+
+run_params = ('indir', 'outdir', 'data_name', 'mc_name', 'configuration', 'year', 'channels',
+              'variables', 'subtag', 'tprefix', 'intersection_str', 'canvas_prefix', 'debug')
+
+def run_triggercomb(tcomb, params, preload=False):
+    """Runs a single intersection. `params` holds the other arguments of `run_eff_sf_1d` (see `run_params`)."""
+    run_eff_sf_1d(tcomb=tcomb, preload=preload, **params)
+    return tcomb
+
+def run_triggercombs(tcombs, params, preload=False):
+    """
+    Runs a batch of intersections, sharing the inputs opened or preloaded by `utils.get_histograms`,
+    which are closed at the end of the batch.
+    """
+    try:
+        for tcomb in tcombs:
+            run_triggercomb(tcomb, params, preload)
+            print('Intersection {} done.'.format(tcomb), flush=True)
+    finally:
+        utils.close_inputs()
+    return tcombs
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute trigger efficiencies and scale factors')
+    parser.add_argument('--indir', help='Inputs directory', required=True)
+    parser.add_argument('--outdir', help='Output directory', required=True, )
+    parser.add_argument('--tprefix', help='prefix to the names of the produceyd outputs (targets in luigi lingo)', required=True)
+    parser.add_argument('--canvas_prefix', help='canvas prefix', required=True)
+    parser.add_argument('--subtag', required=True, help='subtag')
+    parser.add_argument('--mc_name', required=True, type=str,
+                        help='Id for all MC samples')
+    parser.add_argument('--data_name', required=True, type=str,
+                        help='Id for all data samples',)
+    parser.add_argument('--triggercomb', required=False, default=None,
+                        help='Trigger intersection combination. When not provided, all intersections of the channels are processed in a single batched run.')
+    parser.add_argument('--ncpus', default=1, type=int,
+                        help='Number of processes of a batched run, each computing a subset of the intersections.')
+    parser.add_argument('--channels', required=True, nargs='+', type=str,
+                        help='Select the channels over which the workflow will be run.' )
+    parser.add_argument('--year', default="2018", type=str,
+                        choices=("2016", "2016APV", "2017", "2018"), help='Period/era.' )
+    parser.add_argument('--variables',        dest='variables',        required=True, nargs='+', type=str,
+                        help='Select the variables over which the workflow will be run.' )
+    parser.add_argument('--intersection_str', dest='intersection_str', required=False, default=main.inters_str,
+                        help='String useyd to represent set intersection between triggers.')
+    parser.add_argument('--configuration', dest='configuration', required=True,
+                        help='Name of the configuration module to use.')
+    parser.add_argument('--debug', action='store_true', help='debug verbosity')
+    args = utils.parse_args(parser)
+    params = {k: getattr(args, k) for k in run_params}
+
+    if args.triggercomb is not None:
+        run_triggercombs([args.triggercomb], params)
+    else:
+        # the Data and MC inputs are loaded once per process and reused by all intersections
+        tcombs = triggercombs(args.channels, importlib.import_module(args.configuration))
+        if args.ncpus > 1:
+            # each worker runs a single batch
+            batches = [tcombs[i::args.ncpus] for i in range(args.ncpus) if len(tcombs[i::args.ncpus]) > 0]
+            with cf.ProcessPoolExecutor(max_workers=len(batches), mp_context=mp.get_context('fork')) as pool:
+                list(pool.map(functools.partial(run_triggercombs, params=params, preload=True), batches))
+        else:
+            run_triggercombs(tcombs, params, preload=True)
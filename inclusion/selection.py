@@ -1,6 +1,7 @@
 # coding: utf-8
 
-_all_ = [ 'EventSelection' ]
+_all_ = [ 'EventSelection', 'ColumnarEventSelection', 'SelectionPlan', 'CustomCut',
+          'compile_custom_cut', 'trigger_masks' ]
 
 import os
 import sys
@@ -11,12 +12,135 @@ import inclusion
 from inclusion import config
 from inclusion.config import main
 
+import ast
+import copy
 import functools
 from collections import defaultdict
+from types import SimpleNamespace
 import itertools as it
+import numpy as np
+
+class _ColumnarTransformer(ast.NodeTransformer):
+    """Rewrites a single-event expression so that it operates on numpy arrays."""
+    def _call(self, func, *args):
+        return ast.Call(func=ast.Attribute(value=ast.Name(id='np', ctx=ast.Load()),
+                                           attr=func, ctx=ast.Load()),
+                        args=list(args), keywords=[])
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        func = 'logical_and' if isinstance(node.op, ast.And) else 'logical_or'
+        return functools.reduce(lambda x,y: self._call(func, x, y), node.values)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return self._call('logical_not', node.operand)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        lefts = [node.left] + node.comparators[:-1]
+        pairs = [ast.Compare(left=l, ops=[op], comparators=[r])
+                 for l,op,r in zip(lefts, node.ops, node.comparators)]
+        return functools.reduce(lambda x,y: self._call('logical_and', x, y), pairs)
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return self._call('where', node.test, node.body, node.orelse)
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        if _is_entries(node.value):
+            return ast.Subscript(value=node.value, slice=ast.Constant(value=node.attr), ctx=ast.Load())
+        return node
+
+class _EventEntries(dict):
+    """Single event with attribute access, as `utils.dot_dict`."""
+    __getattr__ = dict.get
+
+def _is_entries(node):
+    """Whether the node is `self.entries`."""
+    return (isinstance(node, ast.Attribute) and node.attr == 'entries' and
+            isinstance(node.value, ast.Name) and node.value.id == 'self')
+
+class CustomCut:
+    """
+    User-provided cut (`custom_cut` in the configuration), written for a single event
+    as an expression on `self.entries`, for instance
+    '(self.entries.dau1_pt < 40 and self.entries.dau2_pt < 190)'.
+    The expression is parsed once and compiled into a scalar and a columnar version.
+    """
+    def __init__(self, expr):
+        self.expr = expr
+        tree = ast.parse(expr.strip(), mode='eval')
+
+        branches = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Attribute) and _is_entries(node.value):
+                branches.add(node.attr)
+            elif (isinstance(node, ast.Subscript) and _is_entries(node.value) and
+                  isinstance(node.slice, ast.Constant)):
+                branches.add(node.slice.value)
+        self.branches = tuple(sorted(branches))
+
+        self._scalar = self._compile(tree)
+        self._columnar = self._compile(_ColumnarTransformer().visit(copy.deepcopy(tree)))
+
+    def _compile(self, tree):
+        args = ast.arguments(posonlyargs=[], args=[ast.arg(arg='self')], vararg=None,
+                             kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[])
+        func = ast.Expression(body=ast.Lambda(args=args, body=tree.body))
+        ast.fix_missing_locations(func)
+        return eval(compile(func, '<custom_cut>', 'eval'), globals())
+
+    def scalar(self, sel):
+        """Evaluates the cut on the single event of `sel`."""
+        return bool(self._scalar(sel))
+
+    def columnar(self, sel):
+        """Evaluates the cut on all events of `sel`, returning a mask."""
+        try:
+            res = self._columnar(sel)
+        except (TypeError, ValueError): # not expressible with arrays: one event at a time
+            keys = tuple(sel.entries.keys())
+            res = np.zeros(sel.nevents, dtype=bool)
+            for i in range(sel.nevents):
+                entries = _EventEntries({k: sel.entries[k][i] for k in keys})
+                res[i] = self.scalar(SimpleNamespace(entries=entries))
+        return np.broadcast_to(np.asarray(res, dtype=bool), (sel.nevents,))
+
+@functools.lru_cache(maxsize=None)
+def compile_custom_cut(expr):
+    """Parses each custom cut only once. Returns `None` if there is no cut."""
+    return None if expr is None else CustomCut(expr)
+
+@functools.lru_cache(maxsize=None)
+def trigger_masks(year, isdata, trig_custom=frozenset()):
+    """
+    Compiles 'main.trig_map' into bitmasks to be AND'ed with the 'triggerbit' leaf.
+    Returns a dict with one (pre-HPS, HPS) pair of masks per trigger. Both masks
+    are identical except for the custom triggers in data, where the first
+    one applies to runs before 'main.hps_run_boundary'.
+    """
+    s = 'data' if isdata else 'mc'
+    tomask = lambda bits: functools.reduce(lambda x,y: x | (1<<y),
+                                           bits if isinstance(bits, (tuple,list)) else (bits,), 0)
+    
+    masks = {}
+    for trig, bits in main.trig_map[year].items():
+        if trig in trig_custom:
+            post = tomask(bits[trig.replace('Custom', 'HPS')][s])
+            pre = tomask(bits[trig.replace('Custom', '')]['data']) if isdata else post
+        elif s in bits:
+            pre = post = tomask(bits[s])
+        else: # custom trigger not requested as such
+            continue
+        masks[trig] = (np.uint64(pre), np.uint64(post))
+    return masks
 
 class EventSelection:
-    def __init__(self, entries, isdata, year='2018', configuration=None, debug=False):
+    def __init__(self, entries, isdata, year='2018', configuration=None, debug=False, plan=None):
         self.entries = entries
         self.bit = self.entries['triggerbit']
         self.run = self.entries['RunNumber']
@@ -29,11 +153,19 @@ class EventSelection:
         # dependency injection
         self.cfg = configuration
 
-        self.datasets, self.dataset_ref_trigs = self._deduce_datasets(self.cfg.inters_general,
-                                                                      self.cfg.inters)
-        for d in self.datasets:
-            assert d in main.data[self.year]
+        # configuration lookups shared by all events of a job (see `SelectionPlan`)
+        self.plan = plan
+        if self.plan is not None:
+            self.datasets, self.dataset_ref_trigs = plan.datasets, plan.dataset_ref_trigs
+            self.trig_masks = plan.trig_masks
+        else:
+            self.datasets, self.dataset_ref_trigs = self._deduce_datasets(self.cfg.inters_general,
+                                                                          self.cfg.inters)
+            for d in self.datasets:
+                assert d in main.data[self.year]
 
+            self.trig_masks = trigger_masks(self.year, bool(self.isdata),
+                                            frozenset(self.cfg.trig_custom))
         
     def any_trigger(self, trigs):
         """
@@ -65,10 +197,30 @@ class EventSelection:
 
         lepton_veto = self.should_apply_lepton_veto(tcomb)
 
+        custom_cut = self.cfg.custom_cut if self.plan is None else self.plan.custom_cut
         return self.selection_cuts(lepton_veto=lepton_veto,
                                    bjets_cut=self.cfg.bjets_cut,
                                    mass_cut=self.cfg.mass_cut,
-                                   custom_cut=self.cfg.custom_cut)
+                                   custom_cut=custom_cut)
+
+    def pass_references(self, channel, trigs, dataset):
+        """
+        Reference selection (`dataset_cuts` and `dataset_triggers`) for each
+        (reference, lepton veto) group of the plan. The decision is the same
+        for all trigger intersections of a group, and is computed only once.
+        """
+        res, cuts = {}, {}
+        for group, tcombs in self.plan.groups[channel].items():
+            veto = group[1]
+            if veto not in cuts:
+                cuts[veto] = self.dataset_cuts(tcombs[0], channel)
+            res[group] = self._and(cuts[veto],
+                                   lambda: self.dataset_triggers(tcombs[0], channel, trigs, dataset)[0])
+        return res
+
+    def _and(self, flag, other):
+        """Short-circuit logical AND: `other` is only evaluated when needed."""
+        return flag and other()
 
     def dataset_name(self, dataset):
         if dataset not in main.data[self.year] and dataset not in main.mc_processes[self.year]:
@@ -83,12 +235,8 @@ class EventSelection:
         Checks at least one trigger was fired.
         Considers framework triggers for a specific dataset.
         """
-        this_processed_dataset = self.dataset_name(dataset)
-        for vals in self.dataset_ref_trigs.values():
-            for v in vals:
-                if v not in trigs:
-                    mes = 'Reference trigger {} is not part of triggers {}.'
-                    raise ValueError(mes.format(v,trigs))
+        if self.plan is None or trigs != self.plan.triggers: # otherwise checked by the plan
+            self._check_dataset_triggers(trigs, dataset)
 
         reference = self.find_inters_for_reference(tcomb, channel)
         if reference is None:
@@ -99,6 +247,15 @@ class EventSelection:
         pass_trg = lept and self.pass_triggers(self.dataset_ref_trigs[reference])       
         return pass_trg, self.dataset_ref_trigs[reference]
 
+    def _check_dataset_triggers(self, trigs, dataset):
+        """Checks the dataset exists and its reference triggers are part of `trigs`."""
+        this_processed_dataset = self.dataset_name(dataset)
+        for vals in self.dataset_ref_trigs.values():
+            for v in vals:
+                if v not in trigs:
+                    mes = 'Reference trigger {} is not part of triggers {}.'
+                    raise ValueError(mes.format(v,trigs))
+
     def _deduce_datasets(self, int_gen, int_chn):
         """
         Deduce the required datasets to be looped over based on the triggers
@@ -152,6 +309,9 @@ class EventSelection:
         return res
 
     def find_inters_for_reference(self, tcomb, channel):
+        if self.plan is not None and (tcomb, channel) in self.plan.reference:
+            return self.plan.reference[(tcomb, channel)]
+
         wrong_comb = 'Combination {} is not supported for channel {}.'
 
         # Ignore long intersections for simplicity
@@ -188,6 +348,10 @@ class EventSelection:
         if not self.isdata:
             return True
 
+        if (self.plan is not None and dataset == self.plan.dataset and
+            (tcomb, channel) in self.plan.in_dataset):
+            return self.plan.in_dataset[(tcomb, channel)]
+
         this_processed_dataset = self.dataset_name(dataset)
         reference = self.find_inters_for_reference(tcomb, channel)
         if reference is None:
@@ -199,21 +363,7 @@ class EventSelection:
         """
         Checks at least one trigger was fired.
         """
-        flag = False
-        for trig in trigs:
-            if trig in self.cfg.trig_custom:
-                flag = self.set_custom_trigger_bit(trig)
-            else:
-                bits = self.get_trigger_bit(trig)
-                if isinstance(bits, (tuple,list)):
-                    for bit in bits:
-                        flag = flag or self.check_bit(bit)
-                else:
-                    flag = self.check_bit(bits)
-                
-            if flag:
-                return True
-        return False    
+        return any(self.trigger_bits(trig) for trig in trigs)
 
     def sel_category(self, category):
         assert category in self.categories
@@ -259,8 +409,11 @@ class EventSelection:
         #     return False
 
         # custom user-provided cut
-        if custom_cut is not None and not eval(custom_cut):
-            return False
+        if custom_cut is not None:
+            if not isinstance(custom_cut, CustomCut):
+                custom_cut = compile_custom_cut(custom_cut)
+            if not custom_cut.scalar(self):
+                return False
         
         pairtype    = self.entries['pairType']
         isOS        = self.entries['isOS']
@@ -327,41 +480,28 @@ class EventSelection:
         https://twiki.cern.ch/twiki/bin/viewauth/CMS/TauTrigger
         """
         if trigger not in self.cfg.trig_custom:
-            import inspect
-            currentFunction = inspect.getframeinfo(frame).function
-            raise ValueError('[{}] option not supported.'.format(currentFunction))
-
-        if self.run < 317509 and self.isdata:
-            if trigger == 'VBFTauCustom':
-                bits = self.check_bit(main.trig_map[self.year][trigger]['VBFTau']['data'])
-            elif trigger == 'IsoDoubleTauCustom':
-                bits = ( self.check_bit(main.trig_map[self.year][trigger]['IsoDoubleTau']['data'][0]) or
-                         self.check_bit(main.trig_map[self.year][trigger]['IsoDoubleTau']['data'][1]) or
-                         self.check_bit(main.trig_map[self.year][trigger]['IsoDoubleTau']['data'][2]) )
-            elif trigger == 'IsoMuIsoTauCustom':
-                bits = self.check_bit(main.trig_map[self.year][trigger]['IsoMuIsoTau']['data'])
-            elif trigger == 'EleIsoTauCustom':
-                bits = self.check_bit(main.trig_map[self.year][trigger]['EleIsoTau']['data'])
-            elif trigger == 'IsoTau180':
-                bits = self.check_bit(main.trig_map[self.year][trigger]['IsoTau180']['data'])
+            mes = '[set_custom_trigger_bit] option {} not supported.'.format(trigger)
+            raise ValueError(mes)
 
-        else:
-            s = 'data' if self.isdata else 'mc'
-            if trigger == 'VBFTauCustom':
-                bits = self.check_bit(main.trig_map[self.year][trigger]['VBFTauHPS'][s])
-            elif trigger == 'IsoDoubleTauCustom':
-                bits = self.check_bit(main.trig_map[self.year][trigger]['IsoDoubleTauHPS'][s])
-            elif trigger == 'IsoMuIsoTauCustom':
-                bits = self.check_bit(main.trig_map[self.year][trigger]['IsoMuIsoTauHPS'][s])
-            elif trigger == 'EleIsoTauCustom':
-                bits = self.check_bit(main.trig_map[self.year][trigger]['EleIsoTauHPS'][s])
-
-        return bits
+        pre, post = self.trigger_mask(trigger)
+        mask = pre if self.isdata and self.run < main.hps_run_boundary else post
+        return bool(self.bit & int(mask))
+
+    def trigger_mask(self, trig):
+        """Pre-HPS and HPS bitmasks of a trigger (see `trigger_masks`)."""
+        try:
+            return self.trig_masks[trig]
+        except KeyError:
+            self.get_trigger_bit(trig) # informative error
+            raise
 
     def should_apply_lepton_veto(self, tcomb):
         """Whether to apply 3rd lepton veto. The veto is always applied to MC."""
         if not self.isdata:
             return True
+
+        if self.plan is not None and tcomb in self.plan.lepton_veto:
+            return self.plan.lepton_veto[tcomb]
         
         # if (tcomb in self.cfg.inters_general['MET'] or
         #     tcomb in self.cfg.inters['etau']['MET'] or
@@ -374,15 +514,7 @@ class EventSelection:
     def trigger_bits(self, trig):
         if trig in self.cfg.trig_custom:
             return self.set_custom_trigger_bit(trig)
-        else:
-            flag = False
-            bits = self.get_trigger_bit(trig)
-            if isinstance(bits, (tuple,list)):
-                for bit in bits:
-                    flag = flag or self.check_bit(bit)
-            else:
-                flag = self.check_bit(bits)
-            return flag
+        return bool(self.bit & int(self.trigger_mask(trig)[1]))
 
     def var_cuts(self, trig, variables, nocut_dummy_str):
         """
@@ -460,3 +592,250 @@ class EventSelection:
             res = {nocut_dummy_str: True}
 
         return res
+
+class ColumnarEventSelection(EventSelection):
+    """
+    Vectorized version of `EventSelection`.
+    `entries` is a chunk of events (a dict of numpy arrays, as returned by
+    `uproot.iterate(..., library='np')`). All event-dependent methods return
+    boolean masks which agree with the scalar version event by event.
+    """
+    supported_categories = ('baseline',)
+
+    def __init__(self, entries, isdata, year='2018', configuration=None, debug=False, plan=None):
+        super().__init__(entries, isdata, year, configuration, debug, plan)
+        self.bit = self.bit.astype(np.uint64)
+        self.nevents = len(self.bit)
+
+    @classmethod
+    def check_category(cls, category):
+        """Rejects categories without columnar selection, before any event is processed."""
+        if category not in cls.supported_categories:
+            mes = 'Category {} is not supported by the columnar backend. '.format(category)
+            mes += 'Supported categories: {}.'.format(', '.join(cls.supported_categories))
+            raise ValueError(mes)
+
+    def _ones(self):
+        return np.ones(self.nevents, dtype=bool)
+
+    def _and(self, flag, other):
+        return flag & other()
+    
+    def check_bit(self, bitpos):
+        return (self.bit & (np.uint64(1) << np.uint64(bitpos))) != 0
+
+    def dataset_triggers(self, tcomb, channel, trigs, dataset):
+        if self.plan is None or trigs != self.plan.triggers:
+            self._check_dataset_triggers(trigs, dataset)
+
+        reference = self.find_inters_for_reference(tcomb, channel)
+        if reference is None:
+            raise OverflowError('Intersection is too long.')
+
+        pass_trg = self.pass_triggers(self.dataset_ref_trigs[reference])
+        if all(x in main.lep_triggers for x in self.dataset_ref_trigs[reference]):
+            pass_trg = pass_trg & self.entries['isLeptrigger'].astype(bool)
+        return pass_trg, self.dataset_ref_trigs[reference]
+
+    def pass_triggers(self, trigs):
+        flag = np.zeros(self.nevents, dtype=bool)
+        for trig in trigs:
+            flag |= self.trigger_bits(trig)
+        return flag
+
+    def sel_category(self, category):
+        assert category in self.categories
+        self.check_category(category)
+        return self._ones()
+
+    def selection_cuts(self, iso_cuts=dict(), lepton_veto=True, bjets_cut=True,
+                       mass_cut='inverted', custom_cut=None):
+        """
+        Applies selection cuts to all events in the chunk.
+        Returns a mask which is `True` only where all selection cuts pass.
+        """
+        res = self.entries['isOS'].astype(bool)
+
+        # custom user-provided cut, written for a single event
+        if custom_cut is not None:
+            if not isinstance(custom_cut, CustomCut):
+                custom_cut = compile_custom_cut(custom_cut)
+            res &= custom_cut.columnar(self)
+
+        if lepton_veto:
+            res &= ~(self.entries['nleps'] > 0)
+        if bjets_cut:
+            res &= ~(self.entries['nbjetscand'] <= 1)
+
+        iso_allowed = { 'dau1_ele': 1., 'dau1_mu': 0.15, 'dau2_mu': 0.15,
+                        'dau1_tau': 5., 'dau2_tau': 5. }
+        if any(x not in iso_allowed for x in iso_cuts.keys()):
+            mes = 'At least one of the keys is not allowed. '
+            mes += 'Keys introduced: {}.'.format(iso_cuts.keys())
+            raise ValueError(mes)
+        iso = dict(iso_allowed, **iso_cuts)
+
+        pairtype    = self.entries['pairType']
+        dau1_eleiso = self.entries['dau1_eleMVAiso']
+        dau1_muiso  = self.entries['dau1_iso']
+        dau2_muiso  = self.entries['dau2_iso']
+        dau1_tauiso = self.entries['dau1_deepTauVsJet']
+        dau2_tauiso = self.entries['dau2_deepTauVsJet']
+        bool0 = (pairtype==0) & ((dau1_muiso >= iso['dau1_mu']) |
+                                 (dau2_tauiso < iso['dau2_tau']))
+        bool1 = (pairtype==1) & ((dau1_eleiso != iso['dau1_ele']) |
+                                 (dau2_tauiso < iso['dau2_tau']))
+        bool2 = (pairtype==2) & ((dau1_tauiso < iso['dau1_tau']) |
+                                 (dau2_tauiso < iso['dau2_tau']))
+        bool3 = (pairtype==3) & ((dau1_muiso >= iso['dau1_mu']) &
+                                 (dau2_muiso >= iso['dau2_mu']))
+        res &= ~(bool0 | bool1 | bool2 | bool3)
+
+        tauH_mass = self.entries['tauH_mass']
+        bH_mass   = self.entries['bH_mass_raw']
+        mcut = (bH_mass > 50) & (bH_mass < 270) & (tauH_mass > 20) & (tauH_mass < 130)
+        mcutinv = (bH_mass < 50) | (bH_mass > 270) | (tauH_mass < 20) | (tauH_mass > 130)
+        opt = ('standard', 'inverted')
+        if mass_cut == opt[0]:
+            res &= ~mcutinv
+        elif mass_cut == opt[1]:
+            res &= ~mcut
+        elif mass_cut is not None:
+            mes = 'Mass cut option {} is not supported!'.format(mass_cut)
+            raise ValueError(mes)
+
+        return res
+
+    def set_custom_trigger_bit(self, trigger):
+        """
+        The VBF trigger was updated during data taking, adding HPS
+        https://twiki.cern.ch/twiki/bin/viewauth/CMS/TauTrigger
+        """
+        if trigger not in self.cfg.trig_custom:
+            mes = '[set_custom_trigger_bit] option {} not supported.'.format(trigger)
+            raise ValueError(mes)
+
+        pre, post = self.trigger_mask(trigger)
+        if not self.isdata:
+            return (self.bit & post) != 0
+        mask = np.where(self.run < main.hps_run_boundary, pre, post)
+        return (self.bit & mask) != 0
+
+    def trigger_bits(self, trig):
+        if trig in self.cfg.trig_custom:
+            return self.set_custom_trigger_bit(trig)
+        return (self.bit & self.trigger_mask(trig)[1]) != 0
+
+    def var_cuts(self, trig, variables, nocut_dummy_str):
+        """
+        Same as `EventSelection.var_cuts`, with one mask per cut combination.
+        """
+        flagnameJoin = lambda var,sign,val: ('_'.join([str(x) for x in [var,sign,val]])).replace('.','p')
+        dflags = defaultdict(lambda: [])
+
+        try:
+            trig_cuts = self.cfg.cuts[trig]
+        except KeyError: # the trigger has no cut associated
+            return {nocut_dummy_str: True}
+
+        for avar,acut in trig_cuts.items():
+            ignore = any(avar in main.cuts_ignored[k] for k in variables
+                         if k in main.cuts_ignored)
+            if avar not in variables and not ignore:
+                value = self.entries[avar]
+                for c in acut[1]:
+                    flagname = flagnameJoin(avar, acut[0], c)
+                    if acut[0]=='>':
+                        dflags[avar].append( (flagname, value > c) )
+                    elif acut[0]=='<':
+                        dflags[avar].append( (flagname, value < c) )
+                    else:
+                        mes = 'The operator for the cut is currently '
+                        mes += 'not supported: Use `>` or `<`.'
+                        raise ValueError(mes)
+
+        if not dflags:
+            return {nocut_dummy_str: True}
+
+        res = {}
+        allNames = sorted(dflags)
+        for comb in it.product(*(dflags[name] for name in allNames)):
+            joinFlag = functools.reduce(np.logical_and, [k[1] for k in comb])
+            res[ (main.inters_str).join([k[0] for k in comb]) ] = joinFlag
+        return res
+
+class SelectionPlan:
+    """
+    Configuration lookups which do not change within a job, computed once
+    and shared by all `EventSelection` instances via their `plan` argument:
+    - datasets, reference triggers and trigger masks;
+    - integer IDs and names of the trigger intersections of each channel;
+    - routing of each intersection to its reference selection (dataset and lepton veto),
+      where intersections sharing the same reference selection form a group;
+    - cut combination keys, their IDs and the corresponding histogram names.
+    """
+    def __init__(self, configuration, isdata, year, dataset, channels, variables=(),
+                 nocut_dummy_str=main.nocut_dummy, inters_str=main.inters_str):
+        from inclusion.utils import utils
+        
+        self.cfg = configuration
+        self.isdata = isdata
+        self.year = year
+        self.dataset = dataset
+        self.channels = tuple(channels)
+        self.triggers = self.cfg.triggers
+        self.custom_cut = compile_custom_cut(self.cfg.custom_cut)
+
+        # the entries of this selection are never used
+        sel = EventSelection(defaultdict(int), isdata, year=year, configuration=configuration)
+        self.datasets, self.dataset_ref_trigs = sel.datasets, sel.dataset_ref_trigs
+        self.trig_masks = sel.trig_masks
+        sel._check_dataset_triggers(self.triggers, dataset)
+
+        self.triggercomb, self.tcomb_ids, self.cstr = {}, {}, {}
+        self.reference, self.in_dataset, self.lepton_veto = {}, {}, {}
+        self.groups, self.group_of = {}, {}
+        for chn in self.channels:
+            self.triggercomb[chn] = utils.generate_trigger_combinations(chn, self.triggers,
+                                                                        self.cfg.exclusive)
+            self.tcomb_ids[chn] = {tc: i for i,tc in enumerate(self.triggercomb[chn])}
+            self.groups[chn] = {}
+            for tcomb in self.triggercomb[chn]:
+                self.cstr[tcomb] = inters_str.join(tcomb)
+                self.reference[(tcomb, chn)] = sel.find_inters_for_reference(tcomb, chn)
+                self.in_dataset[(tcomb, chn)] = sel.check_inters_with_dataset(tcomb, chn, dataset)
+                self.lepton_veto[tcomb] = sel.should_apply_lepton_veto(tcomb)
+                if self.in_dataset[(tcomb, chn)] and self.reference[(tcomb, chn)] is not None:
+                    group = (self.reference[(tcomb, chn)], self.lepton_veto[tcomb])
+                    self.groups[chn].setdefault(group, []).append(tcomb)
+                    self.group_of[(tcomb, chn)] = group
+
+        # cut options per trigger: they depend on the variables being displayed
+        vars2D = {utils.add_vnames(*j): tuple(j) for j in it.chain(*self.cfg.pairs2D.values())}
+        self.cut_options = {}
+        for var in variables:
+            self.cut_options[var] = {t: tuple(sel.var_cuts(t, [var], nocut_dummy_str).keys())
+                                     for t in self.triggers}
+        for vname, pair in vars2D.items():
+            self.cut_options[vname] = {t: tuple(sel.var_cuts(t, list(pair), nocut_dummy_str).keys())
+                                       for t in self.triggers}
+
+        # cut combinations per intersection, ordered as in `it.product`
+        self.cut_keys, self.cut_ids, self.hnames = ({} for _ in range(3))
+        for chn in self.channels:
+            self.cut_keys[chn], self.cut_ids[chn], self.hnames[chn] = ({} for _ in range(3))
+            for var in self.cut_options:
+                is2D = var in vars2D
+                opt_ref, opt_trig = ('Ref2D', 'Trig2D') if is2D else ('Ref1D', 'Trig1D')
+                self.cut_keys[chn][var], self.cut_ids[chn][var] = {}, {}
+                self.hnames[chn][var] = {}
+                for tcomb in self.triggercomb[chn]:
+                    keys = tuple(inters_str.join(elem) for elem in
+                                 it.product(*(self.cut_options[var][t] for t in tcomb)))
+                    self.cut_keys[chn][var][tcomb] = keys
+                    self.cut_ids[chn][var][tcomb] = {k: i for i,k in enumerate(keys)}
+
+                    base_str = utils.get_hnames(opt_trig)(chn, var, self.cstr[tcomb])
+                    self.hnames[chn][var][tcomb] = {
+                        'ref': utils.get_hnames(opt_ref)(chn, var, self.cstr[tcomb]),
+                        'trig': {k: utils.rewrite_cut_string(base_str, k) for k in keys}}
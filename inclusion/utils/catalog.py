@@ -0,0 +1,176 @@
+# coding: utf-8
+
+_all_ = [ 'build_catalog', 'build_catalog_outputs', 'is_up_to_date', 'load_catalog',
+          'get_root_inputs', 'sample_nfiles', 'total_sum_weights', 'file_info' ]
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 3 * '/..')
+sys.path.insert(0, parent_dir)
+
+import json
+import glob
+import functools
+import argparse
+import uproot as up
+
+import inclusion
+from inclusion.config import main
+from inclusion.utils import utils
+
+@utils.set_pure_input_namespace
+def build_catalog_outputs(args):
+    assert os.path.splitext(args.catalog_filename)[1] == '.json'
+    return args.catalog_filename
+
+def _goodfiles_paths(proc, inputdir):
+    return sorted(glob.glob(os.path.join(inputdir, proc + '*/goodfiles.txt')))
+
+def _goodfiles(proc, inputdir):
+    """Files listed in the `goodfiles.txt` of each folder of a sample."""
+    res = {}
+    for inp in _goodfiles_paths(proc, inputdir):
+        with open(inp) as fIn:
+            res[os.path.dirname(inp)] = [line.strip() for line in fIn if '.root' in line]
+    return res
+
+def _file_info(fname, isdata, old):
+    """
+    Number of entries, size and generator weights of a single file.
+    Files not modified since the previous catalog are not opened again.
+    """
+    stat = os.stat(fname)
+    if old is not None and old['mtime'] == stat.st_mtime and old['size'] == stat.st_size:
+        return old
+
+    with up.open(fname) as f:
+        entries = None if fname in main.corrupted_files else f['HTauTauTree'].num_entries
+        # same as `h_eff->GetBinContent(1)`
+        sumw = None if isdata else float(f['h_eff'].values()[0])
+    return {'mtime': stat.st_mtime, 'size': stat.st_size, 'entries': entries, 'sumw': sumw}
+
+@utils.set_pure_input_namespace
+def build_catalog(args):
+    """
+    Records the input files of each sample, together with their number of entries,
+    sizes and summed generator weights (`h_eff`), so that later steps do not have to
+    parse the `goodfiles.txt` lists or open the files again.
+    Files are keyed by path and modification time: an existing catalog is updated
+    by opening only the files that changed.
+    """
+    outname = build_catalog_outputs(args)
+    old = {}
+    if os.path.exists(outname):
+        with open(outname) as f:
+            old = json.load(f)['files']
+
+    samples = [(p, True) for p in args.data_vals] + [(p, False) for p in args.mc_vals]
+    catalog = {'files': {}, 'samples': {}, 'sum_weights': {}}
+    for proc, isdata in samples:
+        filelist, inputdir = utils.get_root_inputs(proc, args.indir)
+        filelist = [x.strip() for x in filelist]
+        goodfiles = _goodfiles(proc, inputdir)
+        catalog['samples'][proc] = {'inputdir': inputdir, 'files': filelist, 'isdata': isdata,
+                                    'goodfiles': _goodfiles_paths(proc, inputdir)}
+
+        # the sum of weights runs over all files listed in the same `goodfiles.txt`
+        for folder, flist in goodfiles.items():
+            for fname in flist:
+                if fname not in catalog['files']:
+                    catalog['files'][fname] = _file_info(fname, isdata, old.get(fname))
+            if not isdata:
+                sumw = sum(catalog['files'][x]['sumw'] for x in flist)
+                for x in set([folder] + [os.path.dirname(y) for y in flist]):
+                    catalog['sum_weights'][x] = sumw
+
+        print('Catalogued {} files for sample {}.'.format(len(filelist), proc), flush=True)
+
+    with open(outname, 'w') as f:
+        json.dump(catalog, f, indent=1)
+
+@utils.set_pure_input_namespace
+def is_up_to_date(args):
+    """
+    Whether the catalog exists, covers all samples and no `goodfiles.txt`
+    was added or modified after it was built.
+    """
+    outname = build_catalog_outputs(args)
+    if not os.path.exists(outname):
+        return False
+
+    with open(outname) as f:
+        samples = json.load(f)['samples']
+    tcatalog = os.path.getmtime(outname)
+    for proc in tuple(args.data_vals) + tuple(args.mc_vals):
+        if proc not in samples:
+            return False
+        paths = _goodfiles_paths(proc, samples[proc]['inputdir'])
+        if paths != samples[proc]['goodfiles']:
+            return False
+        if any(os.path.getmtime(x) > tcatalog for x in paths):
+            return False
+    return True
+
+@functools.lru_cache(maxsize=None)
+def load_catalog(fname):
+    with open(fname) as f:
+        return json.load(f)
+
+def get_root_inputs(proc, indir, include_tree=False, catalog=None):
+    """Same as `utils.get_root_inputs`, using the catalog when available."""
+    if catalog is None:
+        return utils.get_root_inputs(proc, indir, include_tree=include_tree)
+
+    try:
+        sample = load_catalog(catalog)['samples'][proc]
+    except KeyError:
+        mes = 'Sample {} is not present in catalog {}.'.format(proc, catalog)
+        raise ValueError(mes)
+
+    filelist = sample['files']
+    if include_tree:
+        filelist = [x + ':HTauTauTree' for x in filelist]
+    return filelist, sample['inputdir']
+
+@utils.set_pure_input_namespace
+def sample_nfiles(args):
+    """
+    Number of input files of each sample, without opening any of them: from the file lists
+    of the catalog when it is up to date, and from the `goodfiles.txt` lists otherwise.
+    """
+    samples = {}
+    if is_up_to_date(args):
+        # not cached: the catalog may be rebuilt later by the same process
+        with open(build_catalog_outputs(args)) as f:
+            samples = json.load(f)['samples']
+    return {proc: len(samples[proc]['files']) if proc in samples
+            else len(utils.get_root_inputs(proc, args.indir)[0])
+            for proc in tuple(args.data_vals) + tuple(args.mc_vals)}
+
+def total_sum_weights(f, isdata, catalog=None):
+    """Same as `utils.total_sum_weights`, using the catalog when available."""
+    if isdata:
+        return 1.
+    if catalog is None:
+        return utils.total_sum_weights(f, isdata)
+
+    try:
+        return load_catalog(catalog)['sum_weights'][os.path.dirname(f)]
+    except KeyError:
+        mes = 'The folder of file {} is not present in catalog {}.'.format(f, catalog)
+        raise ValueError(mes)
+
+def file_info(f, catalog):
+    """Number of entries, size and sum of generator weights of a catalogued file."""
+    return load_catalog(catalog)['files'][f]
+
+# -- Parse options
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the input files catalog.')
+    parser.add_argument('--indir', required=True, nargs='+', help='input directories')
+    parser.add_argument('--catalog_filename', required=True, help='output JSON file')
+    parser.add_argument('--data_vals', default=(), nargs='+', type=str, help='data samples')
+    parser.add_argument('--mc_vals', default=(), nargs='+', type=str, help='MC samples')
+    args = parser.parse_args()
+
+    build_catalog(args)
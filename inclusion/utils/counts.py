@@ -0,0 +1,152 @@
+# coding: utf-8
+
+_all_ = [ 'TriggerCounts', 'event_weight', 'output_name' ]
+
+import os
+import itertools as it
+import numpy as np
+
+import inclusion
+from inclusion.config import main
+from inclusion.utils import patterns
+from inclusion.utils.counts_tensor import CountsTensor
+from inclusion.utils.utils import join_name_trigger_intersection as joinNTC
+
+weight_branches = ('MC_weight', 'PUReweight', 'L1pref_weight', 'trigSF',
+                   'IdSF_deep_2d', 'PUjetID_SF')
+
+def event_weight(entries, isdata, category):
+    """
+    Weight of the events entering the trigger counts.
+    Works for single events and for arrays of events. Missing (NaN) weights are set to one.
+    The product is computed in double precision, as with PyROOT.
+    """
+    weight = 1.
+    for b in weight_branches:
+        weight = weight * np.nan_to_num(np.asarray(entries[b], dtype=float), nan=1.)
+    if isdata and np.any(weight != 1.):
+        raise RuntimeError('The weight for data is {}!'.format(weight))
+
+    if category != "baseline" and category != "boosted":
+        # can be '-1' when no bjets are present
+        weight = weight * np.nan_to_num(np.asarray(entries['bTagweightReshape'], dtype=float), nan=1.)
+
+    if isdata and np.any(abs(weight) != 1.):
+        raise RuntimeError('The weight for data is {}!'.format(weight))
+    return weight
+
+def output_name(outdir, tprefix, filename, subtag):
+    file_id = ''.join(c for c in filename[-10:] if c.isdigit())
+    proc_folder = os.path.dirname(filename).split('/')[-1]
+    return os.path.join(outdir, tprefix + proc_folder + '_' + file_id + subtag + '.npz')
+
+class TriggerCounts:
+    """
+    Counts and sums of weights per channel, reference selection and fired-trigger pattern.
+    The intersections are resolved with a superset-sum transform when writing.
+    """
+    def __init__(self, plan, channels):
+        self.plan = plan
+        self.channels = channels
+        self.chntrigs, self.layout, self._nocut = ({} for _ in range(3))
+        self.c, self.w, self.w2 = ({} for _ in range(3))
+        for chn in channels:
+            self.chntrigs[chn] = sorted(set(it.chain(*plan.triggercomb[chn])))
+            self.layout[chn] = patterns.PatternLayout({t: (main.nocut_dummy,) for t in self.chntrigs[chn]})
+            self._nocut[chn] = {t: {main.nocut_dummy: True} for t in self.chntrigs[chn]}
+            self.c[chn], self.w[chn], self.w2[chn] = ({} for _ in range(3))
+            for group in plan.groups[chn]:
+                self.c[chn][group] = np.zeros(self.layout[chn].npatterns, dtype=np.int64)
+                self.w[chn][group] = np.zeros(self.layout[chn].npatterns)
+                self.w2[chn][group] = np.zeros(self.layout[chn].npatterns)
+
+    def __getstate__(self):
+        # the selection plan holds the configuration module and is not sent between processes
+        state = self.__dict__.copy()
+        state['plan'] = None
+        return state
+
+    def merge(self, other):
+        """Adds the counts of another object filled with the same selection plan."""
+        for chn in self.channels:
+            for group in self.c[chn]:
+                self.c[chn][group] += other.c[chn][group]
+                self.w[chn][group] += other.w[chn][group]
+                self.w2[chn][group] += other.w2[chn][group]
+        return self
+
+    def fill(self, chn, group, fired, weights):
+        """
+        Adds events passing the reference selection `group`.
+        `fired`: dict with one boolean (or boolean array) per trigger.
+        """
+        pattern = self.layout[chn].patterns(fired, self._nocut[chn])
+        if np.ndim(pattern) == 0:
+            pattern = int(pattern)
+            self.c[chn][group][pattern] += 1
+            self.w[chn][group][pattern] += weights
+            self.w2[chn][group][pattern] += weights*weights
+        else:
+            n = self.layout[chn].npatterns
+            self.c[chn][group] += np.bincount(pattern, minlength=n)
+            self.w[chn][group] += np.bincount(pattern, weights=weights, minlength=n)
+            self.w2[chn][group] += np.bincount(pattern, weights=weights*weights, minlength=n)
+
+    def fill_event(self, chn, pass_ref, pass_trigger, weight):
+        """Adds a single event to all the reference selections it passes."""
+        pattern = None
+        for group in self.plan.groups[chn]:
+            if not pass_ref[group]:
+                continue
+            if pattern is None:
+                pattern = int(self.layout[chn].patterns(pass_trigger, self._nocut[chn]))
+            self.c[chn][group][pattern] += 1
+            self.w[chn][group][pattern] += weight
+            self.w2[chn][group][pattern] += weight*weight
+
+    def resolve(self, chn):
+        """
+        Counts, sums of weights and of squared weights for the reference (pattern 0)
+        and the intersection of each trigger combination.
+        """
+        plan = self.plan
+        ref, inters = {}, {}
+        zeta = {group: [patterns.superset_sums(x[chn][group], self.layout[chn].nbits)
+                        for x in (self.c, self.w, self.w2)] for group in plan.groups[chn]}
+        for tcomb in plan.triggercomb[chn]:
+            tstr = plan.cstr[tcomb]
+            if (tcomb, chn) not in plan.group_of:
+                ref[tstr], inters[tstr] = (0, 0., 0.), (0, 0., 0.)
+                continue
+            _, pattern = next(self.layout[chn].combinations(tcomb))
+            ref[tstr] = tuple(x[0] for x in zeta[plan.group_of[(tcomb, chn)]])
+            inters[tstr] = tuple(x[pattern] for x in zeta[plan.group_of[(tcomb, chn)]])
+        return ref, inters
+
+    def tensor(self, norm_factor=None):
+        """
+        Counts of all channels as a `CountsTensor`. Sums of weights are multiplied by `norm_factor`,
+        and sums of squared weights by its square, when provided.
+        """
+        plan = self.plan
+        tcombs = list(dict.fromkeys(plan.cstr[tc] for chn in self.channels for tc in plan.triggercomb[chn]))
+        references = np.full((len(self.channels), len(tcombs)), '', dtype=object)
+        values = np.zeros((len(self.channels), len(tcombs), 2, 3))
+        for ichn, chn in enumerate(self.channels):
+            ref, inters = self.resolve(chn)
+            for tcomb in plan.triggercomb[chn]:
+                reference = plan.reference[(tcomb, chn)]
+                if reference is None: # intersection too long
+                    continue
+                itc = tcombs.index(plan.cstr[tcomb])
+                references[ichn, itc] = joinNTC(plan.dataset_ref_trigs[reference])
+                values[ichn, itc] = ref[plan.cstr[tcomb]], inters[plan.cstr[tcomb]]
+
+        if norm_factor is not None:
+            values[..., 1] *= norm_factor
+            values[..., 2] *= norm_factor**2
+        return CountsTensor(self.channels, tcombs, references.astype(str), values)
+
+    def write(self, outname, norm_factor=None):
+        """Stores the counts tensor (see `tensor`)."""
+        self.tensor(norm_factor).write(outname)
@@ -0,0 +1,64 @@
+# coding: utf-8
+
+_all_ = [ 'CountsTensor', 'merge_tensors' ]
+
+import numpy as np
+
+class CountsTensor:
+    """
+    Trigger counts of all channels and trigger intersections in a single array, with axes
+    channel x intersection x (reference, intersection) x (count, sum of weights, sum of squared weights).
+    `references` labels the reference triggers of each channel and intersection. Empty strings
+    flag intersections which are not defined in a channel; their values stay at zero.
+    """
+    def __init__(self, channels, tcombs, references, values=None):
+        self.channels = list(channels)
+        self.tcombs = list(tcombs)
+        self.references = np.array(references, dtype=str).reshape(len(self.channels), len(self.tcombs))
+        shape = (len(self.channels), len(self.tcombs), 2, 3)
+        self.values = np.zeros(shape) if values is None else np.asarray(values, dtype=float)
+        if self.values.shape != shape:
+            mes = 'The counts have shape {} instead of {}.'.format(self.values.shape, shape)
+            raise ValueError(mes)
+
+    def index(self, chn, tcomb):
+        return self.channels.index(chn), self.tcombs.index(tcomb)
+
+    def defined(self, chn):
+        """Intersections defined in a channel, with their reference triggers."""
+        ichn = self.channels.index(chn)
+        return [(tc, ref) for tc, ref in zip(self.tcombs, self.references[ichn]) if ref]
+
+    def same_labels(self, other):
+        return (self.channels == other.channels and self.tcombs == other.tcombs and
+                np.array_equal(self.references, other.references))
+
+    def merge(self, other):
+        """Adds the counts of another tensor with the same labels."""
+        if not self.same_labels(other):
+            mes = 'Counts with different channels, intersections or references cannot be added.'
+            raise ValueError(mes)
+        self.values += other.values
+        return self
+
+    def write(self, fname):
+        # a file object prevents numpy from appending the extension
+        with open(fname, 'wb') as f:
+            np.savez(f, values=self.values, channels=np.array(self.channels, dtype=str),
+                     tcombs=np.array(self.tcombs, dtype=str), references=self.references)
+
+    @classmethod
+    def read(cls, fname):
+        with np.load(fname) as f:
+            return cls(f['channels'].tolist(), f['tcombs'].tolist(), f['references'], f['values'])
+
+def merge_tensors(outname, infiles):
+    """Adds counts tensors with the same labels."""
+    tensor = CountsTensor.read(infiles[0])
+    for afile in infiles[1:]:
+        try:
+            tensor.merge(CountsTensor.read(afile))
+        except ValueError:
+            mes = 'The labels of {} differ from the ones of {}.'.format(afile, infiles[0])
+            raise ValueError(mes)
+    tensor.write(outname)
@@ -0,0 +1,92 @@
+# coding: utf-8
+
+_all_ = [ 'clopper_pearson', 'normal_interval', 'is_weighted', 'efficiencies',
+          'normalized', 'scale_factors', 'bin_centers' ]
+
+import numpy as np
+from scipy.special import betaincinv, ndtri
+
+cl_1sigma = 0.682689492137086
+
+def bin_centers(edges):
+    """Bin centers and half widths, as the points of a TGraphAsymmErrors built from a histogram."""
+    edges = np.asarray(edges, dtype=float)
+    return 0.5*(edges[1:] + edges[:-1]), 0.5*(edges[1:] - edges[:-1])
+
+def clopper_pearson(npass, ntot, level=cl_1sigma):
+    """
+    Central Clopper-Pearson interval for any array of (possibly non-integer) entries,
+    as TEfficiency::ClopperPearson. Requires ntot > 0.
+    """
+    npass, ntot = np.broadcast_arrays(np.asarray(npass, dtype=float), np.asarray(ntot, dtype=float))
+    npass = np.clip(npass, 0., ntot)
+    alpha = (1. - level) / 2.
+    low, up = np.zeros_like(npass), np.ones_like(npass)
+    m = npass > 0.
+    low[m] = betaincinv(npass[m], ntot[m] - npass[m] + 1., alpha)
+    m = npass < ntot
+    up[m] = betaincinv(npass[m] + 1., ntot[m] - npass[m], 1. - alpha)
+    return low, up
+
+def normal_interval(sumw_pass, sumw2_pass, sumw_tot, sumw2_tot, level=cl_1sigma):
+    """
+    Normal approximation of the efficiency interval for weighted entries, as computed by
+    TGraphAsymmErrors::Divide for weighted histograms, clipped to [0, 1]. Requires sumw_tot > 0.
+    """
+    sumw_pass, sumw2_pass, sumw_tot, sumw2_tot = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (sumw_pass, sumw2_pass, sumw_tot, sumw2_tot)))
+    eff = sumw_pass / sumw_tot
+    variance = (sumw2_pass * (1. - 2.*eff) + sumw2_tot * eff**2) / sumw_tot**2
+    delta = np.sqrt(np.clip(variance, 0., None)) * ndtri(1. - (1. - level) / 2.)
+    return np.clip(eff - delta, 0., 1.), np.clip(eff + delta, 0., 1.)
+
+def is_weighted(sumw, sumw2):
+    """Whether each slice (last axis) holds weighted entries: its sums of weights and of squared weights differ."""
+    return np.abs(np.sum(sumw, axis=-1) - np.sum(sumw2, axis=-1)) > 1.e-6
+
+def efficiencies(sumw_pass, sumw_tot, sumw2_pass=None, sumw2_tot=None, level=cl_1sigma):
+    """
+    Efficiencies and their uncertainties for any number of slices at once, following
+    TGraphAsymmErrors::Divide with the "cp" option: Clopper-Pearson intervals for unweighted
+    slices, and the Normal approximation (with the sums of squared weights of both histograms)
+    as soon as the passing or total slice is weighted, since ROOT does not support "cp" with weights.
+    The arrays are broadcast together, the last axis being the binning: a single reference
+    can be shared by the cut combinations stacked along the first axes.
+    Bins without entries in the reference follow an explicit convention: efficiency of zero,
+    with the interval of a single trial without success.
+    Returns the efficiencies and their lower and upper uncertainties.
+    """
+    sumw_pass, sumw_tot = np.broadcast_arrays(np.asarray(sumw_pass, dtype=float), np.asarray(sumw_tot, dtype=float))
+    sumw2_pass = sumw_pass if sumw2_pass is None else np.broadcast_to(np.asarray(sumw2_pass, dtype=float), sumw_pass.shape)
+    sumw2_tot = sumw_tot if sumw2_tot is None else np.broadcast_to(np.asarray(sumw2_tot, dtype=float), sumw_tot.shape)
+
+    empty = sumw_tot <= 0.
+    npass, ntot = np.where(empty, 0., sumw_pass), np.where(empty, 1., sumw_tot)
+    eff = npass / ntot
+    low, up = clopper_pearson(npass, ntot, level)
+
+    weighted = is_weighted(sumw_pass, sumw2_pass) | is_weighted(sumw_tot, sumw2_tot)
+    normal = weighted[...,None] & ~empty
+    if normal.any():
+        nlow, nup = normal_interval(sumw_pass[normal], sumw2_pass[normal], sumw_tot[normal], sumw2_tot[normal], level)
+        low[normal], up[normal] = nlow, nup
+    return eff, eff - low, up - eff
+
+def normalized(sumw, sumw2):
+    """Distributions normalized to unit integral (kept as they are when empty) and their uncertainties."""
+    sumw = np.asarray(sumw, dtype=float)
+    integral = sumw.sum(axis=-1, keepdims=True)
+    integral = np.where(integral == 0., 1., integral)
+    return sumw / integral, np.sqrt(sumw2) / integral
+
+def scale_factors(eff_data, eff_mc, errs_data, errs_mc):
+    """
+    Ratios of data and MC efficiencies, set to zero when the MC efficiency vanishes.
+    `errs_data` and `errs_mc` hold the lower and upper uncertainties, added in quadrature
+    for non-zero ratios.
+    Returns the ratios and their lower and upper uncertainties.
+    """
+    eff_data, eff_mc = np.broadcast_arrays(np.asarray(eff_data, dtype=float), np.asarray(eff_mc, dtype=float))
+    sf = np.divide(eff_data, eff_mc, out=np.zeros_like(eff_data), where=eff_mc != 0.)
+    errs = [np.where(sf == 0., 0., np.hypot(ed, em)) for ed, em in zip(errs_data, errs_mc)]
+    return sf, errs[0], errs[1]
@@ -0,0 +1,138 @@
+# coding: utf-8
+
+_all_ = [ 'default_start', 'sigmoid', 'sigmoid_ratio', 'fit_hash',
+          'neighbour_starts', 'fit_sigmoids' ]
+
+import hashlib
+import numpy as np
+from scipy.special import expit
+
+default_start = (0.05, 175., 0.95)
+sigmoid_formula = '[2]/(1+exp(-[0]*(x-[1])))'
+
+def sigmoid(x, pars):
+    """Turn-on curves p2/(1+exp(-p0*(x-p1))), one per row of `pars` (or a single one) evaluated at `x`."""
+    pars = np.asarray(pars, dtype=float)
+    return pars[...,2:3] * expit(pars[...,0:1] * (np.asarray(x, dtype=float) - pars[...,1:2]))
+
+def sigmoid_ratio(x, pars_data, pars_mc):
+    """Ratios of data and MC turn-on curves, set to zero where the MC curve vanishes."""
+    num, den = np.broadcast_arrays(sigmoid(x, pars_data), sigmoid(x, pars_mc))
+    return np.divide(num, den, out=np.zeros_like(num), where=den != 0.)
+
+def fit_hash(*arrays):
+    """Digest of the inputs of a fit, used to reuse the results of earlier runs."""
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a, dtype=float)
+        h.update(str(a.shape).encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+def _pad(arrays, fill=0.):
+    """Stacks arrays of different lengths along a new first axis, padding them at the end."""
+    out = np.full((len(arrays), max(len(a) for a in arrays)), fill)
+    for i, a in enumerate(arrays):
+        out[i, :len(a)] = a
+    return out
+
+def _residuals(pars, x, y, eyl, eyh, ex, mask):
+    """
+    Normalized residuals and their jacobian, with the uncertainties of TGraphAsymmErrors fits:
+    the lower or upper uncertainty depending on the side of the curve, and the
+    uncertainty along x propagated with the derivative of the curve.
+    Points outside of the mask, or without uncertainty, do not contribute.
+    """
+    p0, p1, p2 = (pars[:,i:i+1] for i in range(3))
+    s = expit(p0 * (x - p1))
+    ds = s * (1. - s)
+    f = p2 * s
+    sigma = np.hypot(np.where(f > y, eyh, eyl), p2 * ds * p0 * ex)
+    valid = mask & (sigma > 0.)
+    w = np.divide(1., sigma, out=np.zeros_like(sigma), where=valid)
+    r = (y - f) * w
+    jac = np.stack((p2 * ds * (x - p1), -p2 * ds * p0, s), axis=-1) * w[...,None]
+    return r, jac, valid
+
+def _chi2(pars, *data):
+    r, _, _ = _residuals(pars, *data)
+    return (r**2).sum(axis=1)
+
+def _levenberg_marquardt(start, data, max_iter, tol):
+    """Levenberg-Marquardt minimization of all curves at once; each curve has its own damping and convergence."""
+    pars = np.array(start, dtype=float)
+    lam = np.full(len(pars), 1.e-3)
+    chi2 = _chi2(pars, *data)
+    active = np.ones(len(pars), dtype=bool)
+    converged = np.zeros(len(pars), dtype=bool)
+    for _ in range(max_iter):
+        r, jac, _ = _residuals(pars, *data)
+        hess = np.einsum('nbi,nbj->nij', jac, jac)
+        grad = np.einsum('nbi,nb->ni', jac, r)
+        damped = hess + lam[:,None,None] * hess * np.eye(3)
+        step = np.einsum('nij,nj->ni', np.linalg.pinv(damped), grad)
+        trial = pars + step
+        chi2_trial = _chi2(trial, *data)
+
+        better = active & np.isfinite(chi2_trial) & (chi2_trial < chi2)
+        done = better & (chi2 - chi2_trial <= tol * np.maximum(chi2, 1.))
+        # no step improves the minimum anymore
+        done |= active & ~better & (lam > 1.e10)
+        pars[better] = trial[better]
+        chi2 = np.where(better, chi2_trial, chi2)
+        lam = np.where(better, lam / 10., lam * 10.)
+        converged |= done
+        active &= ~done
+        if not active.any():
+            break
+
+    _, jac, valid = _residuals(pars, *data)
+    cov = np.linalg.pinv(np.einsum('nbi,nbj->nij', jac, jac))
+    errors = np.sqrt(np.clip(np.diagonal(cov, axis1=1, axis2=2), 0., None))
+    return pars, errors, chi2, valid.sum(axis=1) - 3, converged
+
+def neighbour_starts(groups, pars, ok):
+    """
+    Starting parameters of each curve taken from the closest successful curve (by index) of the same group,
+    such as the fits of neighbouring cut combinations. Curves without successful neighbours keep their parameters.
+    """
+    groups = np.asarray(groups)
+    starts = np.array(pars, dtype=float)
+    idx = np.arange(len(groups))
+    for i in idx:
+        cands = idx[(groups == groups[i]) & ok & (idx != i)]
+        if len(cands) > 0:
+            starts[i] = pars[cands[np.abs(cands - i).argmin()]]
+    return starts
+
+def fit_sigmoids(x, y, eyl, eyh, ex, franges, starts=None, groups=None, max_iter=200, tol=1.e-8):
+    """
+    Least-squares fits of sigmoid turn-on curves to any number of graphs at once, each with its own
+    points (`x`, `y`, lower and upper uncertainties, half bin widths) and fit range `franges`.
+    Fits which did not converge are started again from the result of a converged neighbour of the
+    same group, if any, and the lowest chi2 is kept.
+    Returns the parameters, their uncertainties, the chi2, the number of degrees of freedom and the convergence flags.
+    """
+    ncurves = len(y)
+    xs = _pad(x)
+    franges = np.asarray(franges, dtype=float).reshape(ncurves, 2)
+    mask = _pad([np.ones(len(a), dtype=bool) for a in x], fill=False).astype(bool)
+    mask &= (xs >= franges[:,0:1]) & (xs <= franges[:,1:2])
+    data = (xs, _pad(y), _pad(eyl), _pad(eyh), _pad(ex), mask)
+
+    if starts is None:
+        starts = np.tile(default_start, (ncurves, 1))
+    pars, errors, chi2, ndf, converged = _levenberg_marquardt(starts, data, max_iter, tol)
+
+    if groups is not None and not converged.all():
+        retry = ~converged
+        nstarts = neighbour_starts(groups, pars, converged)
+        sub = tuple(d[retry] for d in data)
+        rpars, rerrors, rchi2, rndf, rconv = _levenberg_marquardt(nstarts[retry], sub, max_iter, tol)
+        better = rchi2 < chi2[retry]
+        for arr, new in ((pars, rpars), (errors, rerrors), (chi2, rchi2), (ndf, rndf), (converged, rconv)):
+            view = arr[retry]
+            view[better] = new[better]
+            arr[retry] = view
+
+    return pars, errors, chi2, ndf, converged
@@ -0,0 +1,274 @@
+# coding: utf-8
+
+_all_ = [ 'HistAccumulator', 'PatternHist', 'write_shard', 'read_shard',
+          'read_shard_slice', 'merge_shards', 'output_name' ]
+
+import os
+import bisect
+import h5py
+import numpy as np
+
+import inclusion
+from inclusion.utils import patterns
+
+def output_name(outdir, tprefix, sample, filename, subtag, ext):
+    """Histograms file of the job whose first input file is `filename`."""
+    file_id = ''.join(c for c in filename[-10:] if c.isdigit())
+    return os.path.join(outdir, tprefix + sample + '_' + file_id + subtag + '.' + ext)
+
+class HistAccumulator:
+    """
+    Sums of weights of all trigger histograms sharing the same binning, stored in dense
+    arrays with axes (trigger intersection, cut combination, bins...).
+    Cut combination 0 holds the reference histogram of each intersection.
+    Bins include underflow and overflow, following the ROOT convention.
+
+    `keys`: dict mapping each trigger intersection to the names of its cut combinations.
+    `edges`: one array of bin edges per dimension.
+    """
+    def __init__(self, keys, *edges):
+        self.tcombs = tuple(keys)
+        self.tcomb_ids = {tc: i for i,tc in enumerate(self.tcombs)}
+        self.keys = {tc: tuple(k) for tc,k in keys.items()}
+        self.key_ids = {tc: {k: i+1 for i,k in enumerate(v)} for tc,v in self.keys.items()}
+        self.edges = tuple(np.asarray(e, dtype=float) for e in edges)
+        self._edges = tuple(e.tolist() for e in self.edges) # faster scalar lookup
+
+        nslots = 1 + max((len(k) for k in self.keys.values()), default=0)
+        shape = (len(self.tcombs), nslots) + tuple(len(e)+1 for e in self.edges)
+        self.sumw, self.sumw2, self.counts = (np.zeros(shape) for _ in range(3))
+        self.weighted = False
+
+    def find_bin(self, *values):
+        """Same convention as `TAxis::FindBin`: the upper edge belongs to the overflow."""
+        return tuple(bisect.bisect_right(e, v) for e,v in zip(self._edges, values))
+
+    def fill(self, ibin, weight, itcombs, slots):
+        """
+        Fills bin `ibin` of the (intersection index, cut combination slot) pairs
+        given by `itcombs` and `slots`. Pairs can be repeated.
+        """
+        idx = (np.asarray(itcombs, dtype=int), np.asarray(slots, dtype=int)) + ibin
+        np.add.at(self.sumw, idx, weight)
+        np.add.at(self.sumw2, idx, weight**2)
+        np.add.at(self.counts, idx, 1)
+        if weight != 1.:
+            self.weighted = True
+
+    def add(self, tcomb, key, sumw, sumw2, counts):
+        """Adds full bin contents to the reference (`key=None`) or to a cut combination."""
+        idx = self.tcomb_ids[tcomb], self.slot(tcomb, key)
+        self.sumw[idx] += sumw
+        self.sumw2[idx] += sumw2
+        self.counts[idx] += counts
+
+    def merge(self, other):
+        """Adds the contents of an accumulator with the same keys and binning."""
+        self.sumw += other.sumw
+        self.sumw2 += other.sumw2
+        self.counts += other.counts
+        self.weighted = self.weighted or other.weighted
+        return self
+
+    def slot(self, tcomb, key=None):
+        return 0 if key is None else self.key_ids[tcomb][key]
+
+    def entries(self, tcomb, key=None):
+        return self.counts[self.tcomb_ids[tcomb], self.slot(tcomb, key)].sum()
+
+    def scale(self, factor):
+        self.sumw *= factor
+        self.sumw2 *= factor**2
+        if factor != 1.:
+            self.weighted = True
+
+    def _valid_slots(self):
+        """
+        Cut combination histograms only exist for intersections whose reference was filled.
+        References without cut combination histograms are left untouched.
+        """
+        valid = np.zeros(self.sumw.shape[:2], dtype=bool)
+        for tc,i in self.tcomb_ids.items():
+            if len(self.keys[tc]) > 0 and self.counts[i,0].sum() > 0:
+                valid[i,:1+len(self.keys[tc])] = True
+        return valid
+
+    def remove_negative_bins(self):
+        """
+        Sets negative bins to zero (overflow excluded) and rescales the modified histograms
+        to their original integral. Afterwards, checks that cut combinations never exceed
+        their reference. Only supported for 1D histograms.
+        """
+        if len(self.edges) != 1:
+            mes = 'Negative bins removal is only supported for 1D histograms.'
+            raise ValueError(mes)
+
+        valid = self._valid_slots()
+        old = self.sumw[..., 1:-1].sum(axis=-1)
+        neg = (self.sumw[..., :-1] < 0.) & valid[..., None]
+        self.sumw[..., :-1][neg] = 0.
+
+        ref, trg = self.sumw[:, :1, :-1], self.sumw[:, 1:, :-1]
+        wrong = (ref < trg) & valid[:, 1:, None]
+        if np.any(wrong):
+            itc, islot, ibin = (x[0] for x in np.nonzero(wrong))
+            print('Denominator: {} | Numerator: {}'.format(ref[itc,0,ibin], trg[itc,islot,ibin]))
+            print('NegRef? {} | NegTrg? {}'.format(neg[itc,0].any(), neg[itc,islot+1].any()))
+            raise AssertionError()
+
+        rescale = neg.any(axis=-1)
+        if np.any(rescale):
+            new = self.sumw[..., 1:-1].sum(axis=-1)
+            factor = np.ones_like(old)
+            factor[rescale] = old[rescale] / new[rescale]
+            self.sumw *= factor[..., None]
+            self.sumw2 *= factor[..., None]**2
+            self.weighted = True
+
+    def to_root(self, name, tcomb, key=None):
+        """ROOT histogram of the reference (`key=None`) or of a cut combination."""
+        import ROOT # only needed when writing
+        idx = self.tcomb_ids[tcomb], self.slot(tcomb, key)
+        if len(self.edges) == 1:
+            h = ROOT.TH1D(name, '', len(self.edges[0])-1, self.edges[0])
+        else:
+            h = ROOT.TH2D(name, '', len(self.edges[0])-1, self.edges[0],
+                          len(self.edges[1])-1, self.edges[1])
+
+        # ROOT global bins run faster along the x axis
+        h.SetContent(np.ravel(self.sumw[idx], order='F'))
+        if self.weighted:
+            h.Sumw2()
+            h.SetError(np.ravel(np.sqrt(self.sumw2[idx]), order='F'))
+        h.SetEntries(self.counts[idx].sum())
+        return h
+
+class PatternHist:
+    """
+    Accumulates ROOT-like bin contents (including underflow and overflow)
+    separately for each fired-trigger pattern (see `patterns.PatternLayout`).
+    The histogram of any trigger intersection is obtained with a superset-sum
+    transform when resolving; pattern 0 corresponds to the reference histogram.
+    """
+    def __init__(self, layout, *edges):
+        self.layout = layout
+        self.edges = edges
+        self.shape = tuple(len(e)+1 for e in edges)
+        self.sumw, self.sumw2, self.counts = (np.zeros((layout.npatterns,) + self.shape)
+                                              for _ in range(3))
+        self.weighted = False
+        self._zeta = None
+
+    def fill(self, patterns, weights, *values):
+        """Same bin convention as `TAxis::FindBin`: the upper edge belongs to the overflow."""
+        idx = [np.searchsorted(e, v, side='right') for e,v in zip(self.edges, values)]
+        flat = np.ravel_multi_index([patterns] + idx, self.sumw.shape)
+        size = self.sumw.size
+        self.sumw += np.bincount(flat, weights=weights, minlength=size).reshape(self.sumw.shape)
+        self.sumw2 += np.bincount(flat, weights=weights**2, minlength=size).reshape(self.sumw.shape)
+        self.counts += np.bincount(flat, minlength=size).reshape(self.sumw.shape)
+        self.weighted = self.weighted or bool(np.any(weights != 1.))
+        self._zeta = None
+
+    def merge(self, other):
+        """Adds the contents of a pattern histogram with the same layout and binning."""
+        self.sumw += other.sumw
+        self.sumw2 += other.sumw2
+        self.counts += other.counts
+        self.weighted = self.weighted or other.weighted
+        self._zeta = None
+        return self
+
+    def resolve(self, acc, tcomb, sep, mult=1):
+        """
+        Adds the reference and cut combination histograms of intersection `tcomb`,
+        filled `mult` times, to the accumulator `acc`.
+        """
+        if self._zeta is None:
+            self._zeta = tuple(patterns.superset_sums(x, self.layout.nbits)
+                               for x in (self.sumw, self.sumw2, self.counts))
+        acc.add(tcomb, None, *(mult * x[0] for x in self._zeta))
+        for key, pattern in self.layout.combinations(tcomb, sep=sep):
+            acc.add(tcomb, key, *(mult * x[pattern] for x in self._zeta))
+        acc.weighted = acc.weighted or self.weighted
+
+def write_shard(fname, accs, tcomb_names=None):
+    """
+    Stores accumulators in a histogram shard: an HDF5 file with one group per channel and variable,
+    holding the dense arrays of the accumulator, its bin edges and the labels of its axes.
+    Each intersection is a separate chunk, so that it can be read on its own.
+    `accs`: dict of dicts of accumulators, with channels and variables as keys
+    `tcomb_names`: dict mapping intersections to the string stored as label (identity when not provided)
+    """
+    strtype = h5py.string_dtype()
+    with h5py.File(fname, 'w') as f:
+        for chn in accs:
+            for var, acc in accs[chn].items():
+                g = f.create_group(chn + '/' + var)
+                names = [tc if tcomb_names is None else tcomb_names[tc] for tc in acc.tcombs]
+                nkeys = acc.sumw.shape[1] - 1
+                keys = [list(acc.keys[tc]) + ['']*(nkeys-len(acc.keys[tc])) for tc in acc.tcombs]
+                g.create_dataset('tcombs', data=np.array(names, dtype=object), dtype=strtype)
+                g.create_dataset('keys', data=np.array(keys, dtype=object).reshape(len(names), nkeys),
+                                 dtype=strtype)
+                for i, e in enumerate(acc.edges):
+                    g.create_dataset('edges{}'.format(i), data=e)
+                chunks = (1,) + acc.sumw.shape[1:] if len(names) > 0 else None
+                for name in ('sumw', 'sumw2', 'counts'):
+                    g.create_dataset(name, data=getattr(acc, name), chunks=chunks, compression='lzf')
+                g.attrs['weighted'] = acc.weighted
+
+def _shard_accumulator(g, itcombs):
+    """Accumulator of the intersections `itcombs` (slice or list of indexes) of a shard group."""
+    tcombs = [x.decode() for x in g['tcombs'][itcombs]]
+    keys = {tc: tuple(k.decode() for k in ks if k) for tc, ks in zip(tcombs, g['keys'][itcombs])}
+    edges = [g['edges{}'.format(i)][:] for i in range(len(g['sumw'].shape) - 2)]
+    acc = HistAccumulator(keys, *edges)
+    nslots = acc.sumw.shape[1]
+    for name in ('sumw', 'sumw2', 'counts'):
+        setattr(acc, name, g[name][itcombs, :nslots])
+    acc.weighted = bool(g.attrs['weighted'])
+    return acc
+
+def read_shard(fname):
+    """All accumulators of a histogram shard, keyed by channel and variable. Intersections are labelled by strings."""
+    accs = {}
+    with h5py.File(fname, 'r') as f:
+        for chn in f:
+            accs[chn] = {var: _shard_accumulator(f[chn][var], slice(None)) for var in f[chn]}
+    return accs
+
+def read_shard_slice(fname, chn, var, tcomb):
+    """Accumulator of a single intersection, reading only the corresponding part of the shard."""
+    with h5py.File(fname, 'r') as f:
+        try:
+            g = f[chn][var]
+        except KeyError:
+            mes = 'Channel {} and variable {} are not present in {}.'.format(chn, var, fname)
+            raise ValueError(mes)
+        tcombs = [x.decode() for x in g['tcombs'][:]]
+        if tcomb not in tcombs:
+            mes = 'Intersection {} is not present in {} for channel {} and variable {}.'.format(tcomb, fname, chn, var)
+            raise ValueError(mes)
+        itc = tcombs.index(tcomb)
+        return _shard_accumulator(g, [itc])
+
+def merge_shards(outname, infiles):
+    """Adds histogram shards with the same channels, variables, labels and binning."""
+    accs = read_shard(infiles[0])
+    for afile in infiles[1:]:
+        other = read_shard(afile)
+        for chn in accs:
+            for var, acc in accs[chn].items():
+                try:
+                    oacc = other[chn][var]
+                except KeyError:
+                    mes = 'Channel {} and variable {} are missing in {}.'.format(chn, var, afile)
+                    raise ValueError(mes)
+                same = (oacc.keys == acc.keys and oacc.tcombs == acc.tcombs and
+                        all(np.array_equal(x, y) for x,y in zip(oacc.edges, acc.edges)))
+                if not same:
+                    mes = 'The labels or binning of channel {} and variable {} differ in {} and {}.'
+                    raise ValueError(mes.format(chn, var, infiles[0], afile))
+                acc.merge(oacc)
+    write_shard(outname, accs)
@@ -0,0 +1,89 @@
+# coding: utf-8
+
+_all_ = [ 'tree_depth', 'tree_shape', 'chunk', 'partial_name',
+          'merge_csv', 'merge_root', 'merge_files' ]
+
+import os
+import subprocess
+
+import inclusion
+from inclusion.utils import histos
+from inclusion.utils.counts_tensor import merge_tensors
+
+def tree_depth(ninputs, fanin):
+    """Number of layers needed to merge `ninputs` files, at most `fanin` at a time."""
+    if fanin < 2:
+        mes = 'The merging fan-in must be at least 2 (got {}).'.format(fanin)
+        raise ValueError(mes)
+    depth = 1
+    while ninputs > fanin:
+        ninputs = -(-ninputs // fanin)
+        depth += 1
+    return depth
+
+def tree_shape(ninputs, fanin, depth):
+    """
+    Number of jobs in each of the `depth` layers merging `ninputs` files.
+    The last layer has a single job. When fewer layers would do, the fan-in
+    is reduced so that the merging is spread evenly over all layers.
+    """
+    if ninputs > fanin**depth:
+        mes = '{} files cannot be merged in {} layers with fan-in {}.'.format(ninputs, depth, fanin)
+        raise ValueError(mes)
+    f = 2
+    while f**depth < ninputs:
+        f += 1
+    return [max(1, -(-ninputs // f**(l+1))) for l in range(depth)]
+
+def chunk(items, njobs, index):
+    """Items of job `index` when `items` are split into `njobs` contiguous chunks of similar size."""
+    return items[index*len(items)//njobs : (index+1)*len(items)//njobs]
+
+def partial_name(target, layer, index):
+    """Intermediate output of job `index` of `layer` in the tree producing `target`."""
+    base, ext = os.path.splitext(os.path.basename(target))
+    return os.path.join(os.path.dirname(target), 'merge', '{}_L{}_{}{}'.format(base, layer, index, ext))
+
+def merge_csv(outname, infiles):
+    """
+    Sums trigger counts files written by `TriggerCounts.write`, line by line.
+    Lines are identified by their type, trigger combination, channel and reference.
+    """
+    sep = ','
+    sums = {}
+    for afile in infiles:
+        with open(afile, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                *key, val = line.strip().split(sep)
+                key = tuple(key)
+                if key[0] in ('Reference', 'Intersection'):
+                    sums[key] = sums.get(key, 0) + int(val)
+                else:
+                    sums[key] = sums.get(key, 0.) + float(val)
+
+    with open(outname, 'w') as f:
+        for key, val in sums.items():
+            f.write( sep.join(key + (str(val),)) + '\n' )
+
+def merge_root(outname, infiles):
+    """Adds ROOT files with `hadd`."""
+    proc = subprocess.run(['hadd', '-f', outname] + list(infiles))
+    if proc.returncode != 0:
+        mes = 'hadd failed with exit code {} when writing {}.'.format(proc.returncode, outname)
+        raise RuntimeError(mes)
+
+def merge_files(outname, infiles):
+    ext = os.path.splitext(outname)[1]
+    if ext == '.root':
+        merge_root(outname, infiles)
+    elif ext == '.hdf5':
+        histos.merge_shards(outname, infiles)
+    elif ext == '.npz':
+        merge_tensors(outname, infiles)
+    elif ext == '.csv':
+        merge_csv(outname, infiles)
+    else:
+        mes = 'Files with extension {} cannot be merged.'.format(ext)
+        raise ValueError(mes)
@@ -0,0 +1,143 @@
+# coding: utf-8
+
+_all_ = [ 'cluster_ranges', 'split_ranges', 'basket_spans', 'prefetch_ranges',
+          'merge_results', 'process_ranges' ]
+
+import threading
+import concurrent.futures as cf
+import uproot as up
+
+def cluster_ranges(filenames, nranges, treename='HTauTauTree'):
+    """
+    Splits the entries of all files into about `nranges` ranges of similar size.
+    Ranges never cross files and start and end at TTree cluster boundaries,
+    so that no basket is read by more than one range.
+    Returns a list of (file, first entry, last entry + 1).
+    """
+    offsets = {}
+    for fname in filenames:
+        with up.open(fname) as f:
+            offsets[fname] = f[treename].common_entry_offsets()
+
+    total = sum(x[-1] for x in offsets.values())
+    target = max(total / max(nranges, 1), 1)
+
+    ranges = []
+    for fname in filenames:
+        start = 0
+        for stop in offsets[fname][1:]:
+            if stop - start >= target or stop == offsets[fname][-1]:
+                if stop > start:
+                    ranges.append((fname, start, stop))
+                start = stop
+    return ranges
+
+def split_ranges(ranges, nchunks):
+    """
+    Splits entry ranges into at most `nchunks` contiguous chunks with similar numbers of entries,
+    one per worker. Contiguous chunks keep the ranges of the same file together.
+    """
+    total = sum(stop - start for _, start, stop in ranges)
+    chunks = [[] for _ in range(nchunks)]
+    done = 0
+    for rng in ranges:
+        size = rng[2] - rng[1]
+        # chunk containing the middle entry of the range
+        chunks[min(int((done + size / 2) * nchunks / total), nchunks - 1)].append(rng)
+        done += size
+    return [x for x in chunks if len(x) > 0]
+
+def basket_spans(fname, branches, start=0, stop=None, treename='HTauTauTree'):
+    """
+    Byte spans (position, size) in `fname` of the baskets of `branches` holding the entries
+    from `start` to `stop` (excluded, `None` standing for the last entry), sorted by position.
+    Branches missing from the tree, and baskets stored with the tree metadata, are skipped.
+    """
+    spans = []
+    with up.open(fname) as f:
+        tree = f[treename]
+        for name in branches:
+            if name not in tree:
+                continue
+            branch = tree[name]
+            offsets = branch.entry_offsets
+            seeks, sizes = branch.member('fBasketSeek'), branch.member('fBasketBytes')
+            for i in range(branch.member('fWriteBasket')):
+                if offsets[i+1] > start and (stop is None or offsets[i] < stop):
+                    spans.append((int(seeks[i]), int(sizes[i])))
+    return sorted(spans)
+
+def _prefetch(rng, branches, treename):
+    fname, start, stop = rng
+    with open(fname, 'rb') as f:
+        for seek, size in basket_spans(fname, branches, start, stop, treename):
+            f.seek(seek)
+            f.read(size)
+
+def prefetch_ranges(ranges, branches, treename='HTauTauTree'):
+    """
+    Yields the entry ranges (file, start, stop) in order, while the baskets of `branches` needed by
+    the next range are read in a background thread, so that they are already in the page cache
+    when its turn comes. The other branches are never read.
+    Remote files (for instance `root://`) are not prefetched.
+    """
+    branches = tuple(branches)
+    thread = None
+    for i,rng in enumerate(ranges):
+        if thread is not None:
+            thread.join()
+            thread = None
+        if i+1 < len(ranges) and '://' not in ranges[i+1][0]:
+            thread = threading.Thread(target=_prefetch, args=(ranges[i+1], branches, treename), daemon=True)
+            thread.start()
+        yield rng
+
+def merge_results(a, b):
+    """
+    Adds two results of the same structure: nested dicts, tuples and lists of objects
+    with a `merge` method (accumulators), numbers or `None`.
+    """
+    if a is None:
+        return None
+    if isinstance(a, dict):
+        for k in a:
+            a[k] = merge_results(a[k], b[k])
+        return a
+    if isinstance(a, (tuple, list)):
+        return type(a)(merge_results(x, y) for x,y in zip(a, b))
+    if isinstance(a, (int, float)):
+        return a + b
+    return a.merge(b)
+
+_worker = {}
+
+def _init_worker(setup, fill, args):
+    # setup done once per process: configuration, selection plan, binning, ...
+    _worker['fill'] = fill
+    _worker['args'] = args
+    _worker['setup'] = setup(args)
+
+def _fill_ranges(ranges):
+    return _worker['fill'](_worker['args'], *_worker['setup'], ranges)
+
+def process_ranges(fill, args, state, files, ncpus, setup, ranges_per_cpu=4):
+    """
+    Runs `fill(args, *state, ranges)` over all entries of `files` and returns its result.
+    Ranges are (file, first entry, last entry + 1), with `None` standing for the last entry.
+    With more than one cpu, the files are split into cluster-aligned ranges, and the ranges
+    into one chunk per process of a pool of `ncpus` processes. Each process builds its own state
+    with `setup(args)` and fills a single set of accumulators over its whole chunk, which is
+    returned once and added at the end to the (empty) result of the current process.
+    """
+    if ncpus <= 1:
+        return fill(args, *state, [(f, 0, None) for f in files])
+
+    res = fill(args, *state, [])
+    ranges = cluster_ranges(files, ranges_per_cpu*ncpus)
+    if len(ranges) > 0:
+        chunks = split_ranges(ranges, ncpus)
+        with cf.ProcessPoolExecutor(max_workers=len(chunks), initializer=_init_worker,
+                                    initargs=(setup, fill, args)) as pool:
+            for out in pool.map(_fill_ranges, chunks):
+                res = merge_results(res, out)
+    return res
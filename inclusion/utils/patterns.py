@@ -0,0 +1,73 @@
+# coding: utf-8
+
+_all_ = [ 'PatternLayout', 'superset_sums' ]
+
+import itertools as it
+import numpy as np
+
+import inclusion
+from inclusion.config import main
+
+# 2^max_bits patterns are stored per histogram bin
+max_bits = 20
+
+def superset_sums(arr, nbits):
+    """
+    Superset-sum (zeta) transform over the first axis of `arr`, of length 2^nbits.
+    After the transform, element `p` holds the sum of all elements whose pattern
+    contains all bits of `p`. Element 0 is thus the sum over all patterns.
+    """
+    rest = arr.shape[1:]
+    out = np.array(arr, copy=True).reshape((2,)*nbits + rest)
+    for axis in range(nbits):
+        # reversed cumulative sum along an axis of length two
+        lo = [slice(None)] * out.ndim
+        hi = [slice(None)] * out.ndim
+        lo[axis], hi[axis] = 0, 1
+        out[tuple(lo)] += out[tuple(hi)]
+    return out.reshape((2**nbits,) + rest)
+
+class PatternLayout:
+    """
+    Assigns one bit to each (trigger, cut option) pair, so that one integer per event
+    encodes which triggers fired and which of their cuts passed.
+    A trigger intersection with one cut option per trigger corresponds to a pattern,
+    and the events passing it are the ones with a superset of that pattern.
+
+    `options`: dict mapping each trigger to its cut option names, ordered as
+    returned by `EventSelection.var_cuts`.
+    """
+    def __init__(self, options):
+        self.options = options
+        self.bits = {}
+        for trig in sorted(options):
+            for opt in options[trig]:
+                self.bits[(trig, opt)] = len(self.bits)
+
+        self.nbits = len(self.bits)
+        if self.nbits > max_bits:
+            mes = 'Too many triggers and cuts ({} bits) for pattern histograms.'.format(self.nbits)
+            raise ValueError(mes)
+        self.npatterns = 2**self.nbits
+
+    def patterns(self, fired, cuts):
+        """
+        Pattern of each event.
+        `fired`: dict with one boolean (or boolean array) per trigger.
+        `cuts`: dict with one {cut option: boolean (or array)} dict per trigger.
+        """
+        res = 0
+        for (trig, opt), bit in self.bits.items():
+            passed = np.logical_and(fired[trig], cuts[trig][opt])
+            res = res | (np.asarray(passed).astype(np.int64) << bit)
+        return res
+
+    def combinations(self, tcomb, sep=main.inters_str):
+        """
+        Yields (key, pattern) for each cut combination of a trigger intersection.
+        Keys follow `it.product` over the triggers in `tcomb`, as in the producers.
+        """
+        for elem in it.product(*(self.options[trig] for trig in tcomb)):
+            key = sep.join(elem)
+            pattern = sum(1 << self.bits[(trig, opt)] for trig,opt in zip(tcomb, elem))
+            yield key, pattern
@@ -0,0 +1,50 @@
+# coding: utf-8
+
+_all_ = [ 'results_name', 'write_results', 'read_results', 'list_results' ]
+
+import os
+import numpy as np
+import h5py
+
+results_folder = 'Results'
+
+def results_name(outdir, tcomb, subtag):
+    """Results store of a single trigger intersection, so that intersections can be computed in parallel."""
+    return os.path.join(outdir, results_folder, 'EffSF_' + tcomb + subtag + '.hdf5')
+
+def write_results(fname, records):
+    """
+    Stores the numeric efficiency and scale factor results of one trigger intersection:
+    an HDF5 file with one group per record, holding its arrays as datasets and its labels
+    (channel, variable, output names, ...) as attributes.
+    `records`: dict of records keyed by group name, each a dict with 'attrs' and 'arrays' dicts
+    """
+    with h5py.File(fname, 'w') as f:
+        for name, rec in records.items():
+            g = f.create_group(name)
+            for k, v in rec['attrs'].items():
+                g.attrs[k] = v
+            for k, v in rec['arrays'].items():
+                g.create_dataset(k, data=np.asarray(v))
+
+def _read_group(g):
+    attrs = {k: (v.decode() if isinstance(v, bytes) else v) for k, v in g.attrs.items()}
+    return {'attrs': attrs, 'arrays': {k: g[k][()] for k in g}}
+
+def list_results(fname):
+    """Names of the records of a results store."""
+    names = []
+    with h5py.File(fname, 'r') as f:
+        f.visititems(lambda name, obj: names.append(name) if isinstance(obj, h5py.Group) and len(obj.attrs) > 0 else None)
+    return names
+
+def read_results(fname, names=None):
+    """Records of a results store, keyed by group name. All records are read if `names` is not provided."""
+    if names is None:
+        names = list_results(fname)
+    with h5py.File(fname, 'r') as f:
+        try:
+            return {name: _read_group(f[name]) for name in names}
+        except KeyError:
+            mes = 'Some of the records {} are not present in {}.'.format(names, fname)
+            raise ValueError(mes)
@@ -0,0 +1,113 @@
+# coding: utf-8
+
+_all_ = [ 'TDigest' ]
+
+import numpy as np
+
+class TDigest:
+    """
+    Mergeable streaming quantile sketch (t-digest with the k1 scale function).
+    Values are summarized by weighted centroids, which are small near the tails and
+    larger around the median. The rank error of a quantile `q` is bounded by about
+    `pi * sqrt(q*(1-q)) / compression`, that is, less than 0.8% for the median with
+    the default compression, and much less near the tails. Minimum and maximum are exact.
+    Sketches filled separately (for instance, one per file) can be merged.
+
+    `compression`: controls the accuracy; the sketch holds about `compression/2` centroids.
+    """
+    def __init__(self, compression=200, buffer_size=50000):
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self._buf_x, self._buf_w = [], []
+        self._nbuf = 0
+        self.min, self.max = np.inf, -np.inf
+
+    def __len__(self):
+        """Number of centroids."""
+        self._flush()
+        return len(self.means)
+
+    def total_weight(self):
+        self._flush()
+        return self.weights.sum()
+
+    def update(self, values, weights=None):
+        """
+        Adds values with optional non-negative weights (for instance MC weights).
+        NaN values and values with zero weight are ignored.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        if weights is None:
+            weights = np.ones_like(values)
+        else:
+            weights = np.broadcast_to(np.asarray(weights, dtype=float), values.shape).ravel()
+            if np.any(weights < 0.):
+                mes = 'Quantile sketches only support non-negative weights.'
+                raise ValueError(mes)
+
+        keep = ~np.isnan(values) & (weights > 0.)
+        values, weights = values[keep], weights[keep]
+        if len(values) == 0:
+            return
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._buf_x.append(values)
+        self._buf_w.append(weights)
+        self._nbuf += len(values)
+        if self._nbuf > self.buffer_size:
+            self._flush()
+
+    def merge(self, other):
+        """Adds the contents of another sketch."""
+        other._flush()
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._buf_x.append(other.means)
+        self._buf_w.append(other.weights)
+        self._nbuf += len(other.means)
+        self._flush()
+        return self
+
+    def _flush(self):
+        if self._nbuf == 0:
+            return
+        means = np.concatenate([self.means] + self._buf_x)
+        weights = np.concatenate([self.weights] + self._buf_w)
+        self._buf_x, self._buf_w = [], []
+        self._nbuf = 0
+
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+
+        # each centroid spans at most one unit of the k1 scale k(q) = d/(2pi) asin(2q-1)
+        # items are grouped by the unit their central quantile falls in
+        total = weights.sum()
+        qmid = (np.cumsum(weights) - weights/2) / total
+        k = self.compression / (2*np.pi) * np.arcsin(np.clip(2*qmid - 1, -1., 1.))
+        bucket = np.floor(k)
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def quantile(self, q):
+        """Approximate quantile(s) `q`, linearly interpolating between centroids."""
+        self._flush()
+        if len(self.means) == 0:
+            mes = 'Cannot compute quantiles of an empty sketch.'
+            raise ValueError(mes)
+
+        cum = np.cumsum(self.weights)
+        total = cum[-1]
+        # centroid positions in cumulative weight, anchored at the exact extremes
+        xp = np.r_[0., cum - self.weights/2, total]
+        fp = np.r_[self.min, self.means, self.max]
+        return np.interp(np.asarray(q, dtype=float) * total, xp, fp)
+
+    def rank_error(self, q):
+        """Approximate bound on the rank error of quantile(s) `q`."""
+        q = np.asarray(q, dtype=float)
+        return np.pi * np.sqrt(q * (1 - q)) / self.compression
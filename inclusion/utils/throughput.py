@@ -0,0 +1,49 @@
+# coding: utf-8
+
+_all_ = [ 'record_path', 'write_record', 'measured_rate', 'event_rate' ]
+
+import os
+import glob
+import json
+
+# rough number of events processed per second and per cpu when no measurement is available
+default_rate = {'root': 1000., 'columnar': 20000.}
+
+# fixed cost of each job, in seconds: scheduling, interpreter start and imports
+job_overhead = 60.
+
+def record_path(outdir, sample, mode, infile):
+    """Where the processing time of the job whose first input is `infile` is stored."""
+    file_id = ''.join(c for c in infile[-10:] if c.isdigit())
+    proc_folder = os.path.dirname(infile).split('/')[-1]
+    return os.path.join(outdir, sample, 'timing', '{}_{}_{}.json'.format(mode, proc_folder, file_id))
+
+def write_record(fname, mode, backend, events, seconds, cpus=1):
+    """Stores the number of processed events, the time it took and the number of cpus used."""
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname, 'w') as f:
+        json.dump({'mode': mode, 'backend': backend, 'events': events, 'seconds': seconds,
+                   'cpus': cpus}, f)
+
+def measured_rate(indirs, mode, backend):
+    """
+    Events per second and per cpu measured by earlier jobs of the same mode and backend,
+    looking for records in the samples folders of `indirs`.
+    Returns `None` when no record is found.
+    """
+    events, seconds = 0, 0.
+    for indir in indirs:
+        for fname in glob.glob(os.path.join(indir, '*', 'timing', '*.json')):
+            with open(fname) as f:
+                rec = json.load(f)
+            if rec['mode'] == mode and rec['backend'] == backend:
+                events += rec['events']
+                seconds += rec['seconds'] * rec.get('cpus', 1)
+    if events == 0 or seconds <= 0.:
+        return None
+    return events / seconds
+
+def event_rate(indirs, mode, backend):
+    """Measured events per second and per cpu, or a default estimate when there are no measurements."""
+    rate = measured_rate(indirs, mode, backend)
+    return default_rate[backend] if rate is None else rate
@@ -13,6 +13,7 @@ from types import SimpleNamespace
 import inclusion
 from inclusion.config import main
 from inclusion.utils import utils
+from inclusion.utils import histos
 
 import ROOT
 
@@ -181,11 +182,9 @@ def define_used_tree_variables(cut):
                 'bjet1_bID_deepFlavor', 'bjet2_bID_deepFlavor',
                 'isVBF', 'VBFjj_mass', 'VBFjj_deltaEta',
                 'isTau1real', 'isTau2real')
-    if cut is not None:
-        _regex = tuple(set(re.findall(r'self\.entries\.(.+?)\s', cut)))
-    else:
-        _regex = ()
-    return tuple(set(_entries + _regex))
+    from inclusion.selection import compile_custom_cut
+    _cut = () if cut is None else compile_custom_cut(cut).branches
+    return tuple(set(_entries + _cut))
     
 class dot_dict(dict):
     """dot.notation access to dictionary attributes"""
@@ -193,6 +192,17 @@ class dot_dict(dict):
     __setattr__ = dict.__setitem__
     __delattr__ = dict.__delitem__
 
+def export_shard(shard, outname):
+    """Writes all histograms of a histogram shard to a ROOT file, as done by the producers."""
+    f_out = ROOT.TFile(outname, 'RECREATE')
+    f_out.cd()
+    for chn, accs in histos.read_shard(shard).items():
+        for var, acc in accs.items():
+            for tcomb in acc.tcombs:
+                for name, h in shard_histograms(acc, chn, var, tcomb).items():
+                    h.Write(name)
+    f_out.Close()
+
 def find_bin(edges, value, var):
     """
     Find the bin id corresponding to one value, given the bin edges.
@@ -261,20 +271,114 @@ def get_display_variable_name(channel, var):
         var_custom = r"MET-no\mu"
     return var_custom
 
+def get_histograms(base, channel, variable, tcomb, preload=False):
+    """
+    Histograms of the merged outputs `base` (path without extension), restricted to intersection `tcomb`.
+    When a histogram shard exists, only the corresponding part of the shard is read, unless `preload`
+    is set: the whole shard is then read once and kept in memory for the following calls.
+    Otherwise, the names come from the key index of the ROOT file, and histograms are read on request.
+    Returns the file name, the histogram names and a function returning a histogram from its name.
+    """
+    if os.path.exists(base + '.hdf5'):
+        fname = base + '.hdf5'
+        if preload:
+            shard = _shard(fname, os.path.getmtime(fname))
+            if variable not in shard.get(channel, {}) or tcomb not in shard[channel][variable].tcombs:
+                mes = 'Channel {}, variable {} and intersection {} are not present in {}.'.format(
+                    channel, variable, tcomb, fname)
+                raise ValueError(mes)
+            acc = shard[channel][variable]
+        else:
+            acc = histos.read_shard_slice(fname, channel, variable, tcomb)
+        hists = shard_histograms(acc, channel, variable, tcomb)
+        return fname, list(hists), hists.__getitem__
+
+    fname = base + '.root'
+    keys = histogram_keys(fname, channel, variable, tcomb)
+    fkey = (os.path.abspath(fname), os.path.getmtime(fname))
+    def getter(name):
+        if name not in keys:
+            mes = 'Histogram {} of channel {}, variable {} and intersection {} is not in {}.'.format(
+                name, channel, variable, tcomb, fname)
+            raise ValueError(mes)
+        # the file is shared by all calls: callers get their own copy
+        h = _root_file(*fkey).Get(name).Clone()
+        h.SetDirectory(0)
+        return h
+    return fname, keys, getter
+
+max_open_inputs = 4
+
+@functools.lru_cache(maxsize=max_open_inputs)
+def _shard(fname, mtime):
+    return histos.read_shard(fname)
+
+_root_files = {}
+
+def _root_file(fname, mtime):
+    """
+    ROOT file opened by `get_histograms`, shared by later calls. At most `max_open_inputs`
+    files stay open, the least recently used being closed first; see also `close_inputs`.
+    """
+    key = (fname, mtime)
+    afile = _root_files.pop(key, None)
+    if afile is None:
+        afile = ROOT.TFile.Open(fname, 'READ')
+        while len(_root_files) >= max_open_inputs:
+            _root_files.pop(next(iter(_root_files))).Close()
+    _root_files[key] = afile
+    return afile
+
+def close_inputs():
+    """Closes the ROOT files and drops the histogram shards kept by `get_histograms`."""
+    for afile in _root_files.values():
+        afile.Close()
+    _root_files.clear()
+    _shard.cache_clear()
+
 def get_key_list(afile, inherits=['TH1']):
-    tmp = []
-    keylist = ROOT.TIter(afile.GetListOfKeys())
-    for key in keylist:
-        cl = ROOT.gROOT.GetClass(key.GetClassName())
-
-        inherited = functools.reduce( lambda x, y: x or y,
-                                      [ cl.InheritsFrom(x) for x in inherits ] )
-        if not inherited:
-            continue
-    
-        h = key.ReadObj()
-        tmp.append( h.GetName() )
-    return tmp
+    """Names of the objects of an open ROOT file inheriting from any of the `inherits` classes."""
+    return [name for name, cl in key_index(afile.GetName()).items()
+            if inherits_from(cl, tuple(inherits))]
+
+def key_index(fname):
+    """
+    Names and class names of the objects stored in a ROOT file, read from the key metadata only
+    (no object is deserialized). Only the highest cycle of each name is kept.
+    The index is cached per file path and modification time.
+    """
+    return _key_index(os.path.abspath(fname), os.path.getmtime(fname))
+
+@functools.lru_cache(maxsize=None)
+def _key_index(fname, mtime):
+    afile = ROOT.TFile.Open(fname, 'READ')
+    if not afile or afile.IsZombie():
+        mes = 'File {} could not be opened.'.format(fname)
+        raise ValueError(mes)
+    index = {}
+    # keys are sorted by decreasing cycle
+    for key in afile.GetListOfKeys():
+        index.setdefault(key.GetName(), key.GetClassName())
+    afile.Close()
+    return index
+
+@functools.lru_cache(maxsize=None)
+def inherits_from(classname, inherits):
+    cl = ROOT.gROOT.GetClass(classname)
+    return bool(cl) and any(cl.InheritsFrom(x) for x in inherits)
+
+def histogram_keys(fname, channel, variable, tcomb, inherits=('TH1',)):
+    """
+    Names of the reference and cut histograms of a channel, variable (1D or 2D) and intersection,
+    taken from the key index of a ROOT file.
+    """
+    refs, prefixes = set(), []
+    for opt in ('1D', '2D'):
+        refs.add(get_hnames('Ref' + opt)(channel, variable, tcomb))
+        prefixes.append(rewrite_cut_string(get_hnames('Trig' + opt)(channel, variable, tcomb), ''))
+    prefixes = tuple(prefixes)
+    return [name for name, cl in key_index(fname).items()
+            if (name in refs or name.startswith(prefixes)) and inherits_from(cl, tuple(inherits))]
 
 def get_hnames(opt):
     ph = main.placeholder_cuts
@@ -309,6 +413,34 @@ def get_obj_max_min(graph, is_histo):
             vmin = val
     return vmax, vmin
 
+def hist_arrays(h):
+    """Sums of weights and of squared weights of the bins of a 1D histogram (no under- or overflow), and its bin edges."""
+    nbins = h.GetNbinsX()
+    sumw = np.array([h.GetBinContent(i) for i in range(1, nbins+1)])
+    sumw2 = np.array([h.GetBinError(i)**2 for i in range(1, nbins+1)])
+    edges = np.array([h.GetXaxis().GetBinLowEdge(i) for i in range(1, nbins+2)])
+    return sumw, sumw2, edges
+
+def hist2d_arrays(h, getter='GetBinContent'):
+    """Values returned by `getter` for the bins of a 2D histogram (no under- or overflow), with axes x and y, and the bin edges."""
+    nx, ny = h.GetNbinsX(), h.GetNbinsY()
+    get = getattr(h, getter)
+    values = np.array([[get(h.GetBin(i, j)) for j in range(1, ny+1)] for i in range(1, nx+1)])
+    edges = [np.array([ax.GetBinLowEdge(i) for i in range(1, n+2)])
+             for ax, n in ((h.GetXaxis(), nx), (h.GetYaxis(), ny))]
+    return values, edges[0], edges[1]
+
+def array_hist2d(name, values, edges_x, edges_y):
+    """2D histogram with the contents `values` (axes x and y), the inverse of `hist2d_arrays`."""
+    edges_x = np.ascontiguousarray(edges_x, dtype=np.double)
+    edges_y = np.ascontiguousarray(edges_y, dtype=np.double)
+    h = ROOT.TH2D(name, name, len(edges_x)-1, edges_x, len(edges_y)-1, edges_y)
+    h.SetDirectory(0)
+    for i, row in enumerate(values):
+        for j, v in enumerate(row):
+            h.SetBinContent(i+1, j+1, v)
+    return h
+
 def get_root_inputs(proc, indir, include_tree=False):
     #### Check input folder
     if not isinstance(indir, (tuple,list)):
@@ -476,6 +608,23 @@ def set_pure_input_namespace(func):
 
     return wrapper
 
+def shard_histograms(acc, channel, variable, tcomb):
+    """
+    ROOT histograms of intersection `tcomb` of an accumulator read from a histogram shard, keyed by name.
+    Cut combination histograms only exist when the reference was filled.
+    """
+    opt_ref, opt_trig = ('Ref2D', 'Trig2D') if len(acc.edges) == 2 else ('Ref1D', 'Trig1D')
+    names = {get_hnames(opt_ref)(channel, variable, tcomb): None}
+    if acc.entries(tcomb) > 0:
+        base_str = get_hnames(opt_trig)(channel, variable, tcomb)
+        names.update({rewrite_cut_string(base_str, k): k for k in acc.keys[tcomb]})
+
+    hists = {}
+    for name, key in names.items():
+        hists[name] = acc.to_root(name, tcomb, key)
+        hists[name].SetDirectory(0)
+    return hists
+
 def split_vnames(joinvars):
     return joinvars.split('_VERSUS_')
 
@@ -0,0 +1,69 @@
+# coding: utf-8
+
+__all__ = ['Efficiencies']
+
+import unittest
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 2 * '/..')
+sys.path.insert(0, parent_dir)
+
+import inclusion
+from inclusion.utils import efficiency
+
+import numpy as np
+from scipy.stats import beta
+
+class Efficiencies(unittest.TestCase):
+    """Clopper-Pearson and Normal intervals and scale factors of `efficiency`."""
+    def test_clopper_pearson(self):
+        npass, ntot = np.array([0., 3., 10.]), np.array([10., 10., 10.])
+        low, up = efficiency.clopper_pearson(npass, ntot)
+        alpha = (1. - efficiency.cl_1sigma) / 2.
+        self.assertEqual(low[0], 0.)
+        self.assertEqual(up[2], 1.)
+        self.assertAlmostEqual(low[1], beta.ppf(alpha, 3, 8))
+        self.assertAlmostEqual(up[1], beta.ppf(1.-alpha, 4, 7))
+
+    def test_efficiencies(self):
+        # two cut combinations sharing the same reference
+        ref = np.array([10., 0., 4.])
+        trig = np.array([[5., 0., 4.], [1., 0., 0.]])
+        eff, elow, eup = efficiency.efficiencies(trig, ref)
+        self.assertEqual(eff.shape, (2, 3))
+        self.assertTrue(np.allclose(eff, [[0.5, 0., 1.], [0.1, 0., 0.]]))
+        self.assertTrue(np.all(elow >= 0.) and np.all(eup >= 0.))
+        # empty reference: a single trial without success
+        self.assertEqual(elow[0, 1], 0.)
+        self.assertAlmostEqual(eup[0, 1], 1. - (1. - efficiency.cl_1sigma) / 2.)
+
+        # sums of squared weights equal to the sums of weights: unweighted entries
+        eff_u, elow_u, eup_u = efficiency.efficiencies(trig, ref, trig, ref)
+        self.assertTrue(np.allclose(elow_u, elow) and np.allclose(eup_u, eup))
+
+    def test_weighted(self):
+        # weighted slices use the Normal approximation of TGraphAsymmErrors::Divide
+        tw, pw2 = np.array([10., 0.]), np.array([[2., 0.], [1., 0.]])
+        pw, tw2 = np.array([[4., 0.], [0.5, 0.]]), np.array([5., 0.])
+        eff, elow, eup = efficiency.efficiencies(pw, tw, pw2, tw2)
+        sigma = np.sqrt((2. * (1. - 2.*0.4) + 5. * 0.4**2)) / 10.
+        self.assertAlmostEqual(eff[0, 0], 0.4)
+        self.assertAlmostEqual(elow[0, 0], sigma)
+        self.assertAlmostEqual(eup[0, 0], sigma)
+        # clipped to the physical range
+        self.assertAlmostEqual(elow[1, 0], 0.05)
+        self.assertTrue(eup[1, 0] > 0.05)
+        # empty reference bins keep their convention
+        self.assertAlmostEqual(eup[0, 1], 1. - (1. - efficiency.cl_1sigma) / 2.)
+
+    def test_scale_factors(self):
+        sf, elow, eup = efficiency.scale_factors([0.5, 0.2, 0.], [0.25, 0., 0.5],
+                                                 ([0.3, 0.1, 0.1], [0.3, 0.1, 0.1]),
+                                                 ([0.4, 0.1, 0.1], [0.4, 0.1, 0.1]))
+        self.assertTrue(np.allclose(sf, [2., 0., 0.]))
+        self.assertTrue(np.allclose(elow, [0.5, 0., 0.]))
+        self.assertTrue(np.allclose(eup, [0.5, 0., 0.]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# coding: utf-8
+
+__all__ = ['SigmoidFits']
+
+import unittest
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 2 * '/..')
+sys.path.insert(0, parent_dir)
+
+import inclusion
+from inclusion.utils import fitting
+
+import numpy as np
+
+class SigmoidFits(unittest.TestCase):
+    """Batched turn-on fits must recover the curves they were built from, whatever their binning."""
+    def test_batch(self):
+        truth = np.array([[0.05, 175., 0.95], [0.1, 200., 0.9], [0.03, 250., 1.]])
+        xs = [np.linspace(100., 500., n) for n in (10, 17, 25)]
+        ys = [fitting.sigmoid(x, p) for x, p in zip(xs, truth)]
+        errs = [np.full(len(x), 0.01) for x in xs]
+        zeros = [np.zeros(len(x)) for x in xs]
+        pars, errors, chi2, ndf, converged = fitting.fit_sigmoids(
+            xs, ys, errs, errs, zeros, [(100., 500.)]*3, starts=[(0.1, 300., 0.5)]*3)
+        self.assertTrue(converged.all())
+        self.assertTrue(np.allclose(pars, truth, rtol=1.e-4))
+        self.assertTrue(np.all(chi2 < 1.e-6))
+        self.assertEqual(list(ndf), [7, 14, 22])
+        self.assertTrue(np.all(errors > 0.))
+
+    def test_fit_range(self):
+        x = np.linspace(100., 500., 21)
+        y = fitting.sigmoid(x, [0.05, 175., 0.95])
+        y[x > 400.] = 0. # outside of the fit range, must be ignored
+        err = np.full(len(x), 0.01)
+        pars = fitting.fit_sigmoids([x], [y], [err], [err], [np.zeros(len(x))], [(100., 400.)])[0]
+        self.assertTrue(np.allclose(pars[0], [0.05, 175., 0.95], rtol=1.e-4))
+
+    def test_neighbour_starts(self):
+        pars = np.arange(12.).reshape(4, 3)
+        ok = np.array([True, False, False, True])
+        starts = fitting.neighbour_starts(['a', 'a', 'b', 'b'], pars, ok)
+        self.assertTrue(np.array_equal(starts[1], pars[0]))
+        self.assertTrue(np.array_equal(starts[2], pars[3]))
+        self.assertTrue(np.array_equal(starts[0], pars[0])) # no other successful curve in group 'a'
+
+    def test_ratio_and_hash(self):
+        x = np.array([0., 100., 200.])
+        ratio = fitting.sigmoid_ratio(x, [0.05, 100., 0.8], [[0.05, 100., 0.], [0.05, 100., 0.4]])
+        self.assertTrue(np.array_equal(ratio[0], np.zeros(3)))
+        self.assertTrue(np.allclose(ratio[1], 2.))
+
+        self.assertEqual(fitting.fit_hash(x, (160., 500.)), fitting.fit_hash(x.copy(), [160., 500.]))
+        self.assertNotEqual(fitting.fit_hash(x, (160., 500.)), fitting.fit_hash(x, (150., 500.)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# coding: utf-8
+
+__all__ = ['Accumulator', 'Shards']
+
+import unittest
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 2 * '/..')
+sys.path.insert(0, parent_dir)
+
+import inclusion
+from inclusion.utils import histos
+
+import tempfile
+import numpy as np
+
+class Accumulator(unittest.TestCase):
+    """Checks filling, scaling and negative bins removal of `histos.HistAccumulator`."""
+    def setUp(self):
+        self.edges = np.array([0., 10., 20., 50.])
+        self.keys = {('A',): ('c1', 'c2'), ('A', 'B'): ('c1',), ('B',): ()}
+
+    def test_fill(self):
+        acc = histos.HistAccumulator(self.keys, self.edges)
+        self.assertEqual(acc.sumw.shape, (3, 3, 5))
+        self.assertEqual(acc.find_bin(-1.), (0,))
+        self.assertEqual(acc.find_bin(10.), (2,))
+        self.assertEqual(acc.find_bin(50.), (4,))
+
+        acc.fill(acc.find_bin(15.), 2., [0, 0, 1], [0, 2, 0])
+        acc.fill(acc.find_bin(15.), 1., [0, 0], [0, 0])
+        self.assertEqual(acc.sumw[0, 0, 2], 4.)
+        self.assertEqual(acc.sumw2[0, 0, 2], 6.)
+        self.assertEqual(acc.entries(('A',)), 3)
+        self.assertEqual(acc.entries(('A',), 'c2'), 1)
+        self.assertEqual(acc.entries(('A', 'B'), 'c1'), 0)
+        self.assertTrue(acc.weighted)
+
+        acc.scale(0.5)
+        self.assertEqual(acc.sumw[0, 0, 2], 2.)
+        self.assertEqual(acc.sumw2[0, 0, 2], 1.5)
+
+    def test_negative_bins(self):
+        acc = histos.HistAccumulator(self.keys, self.edges)
+        for val, w in ((5., 3.), (15., -1.), (25., 2.), (60., -4.)):
+            acc.fill(acc.find_bin(val), w, [0, 0, 2], [0, 1, 0])
+        acc.fill(acc.find_bin(25.), 1., [0], [2])
+        old = acc.sumw[..., 1:-1].sum(axis=-1)
+
+        acc.remove_negative_bins()
+        # the overflow is rescaled but not removed
+        # references without cut combinations are left untouched
+        self.assertTrue(acc.sumw[0, 0, -1] < 0.)
+        self.assertEqual(acc.sumw[2, 0, 2], -1.)
+        self.assertTrue(np.all(acc.sumw[0, :, :-1] >= 0.))
+        self.assertTrue(np.allclose(acc.sumw[..., 1:-1].sum(axis=-1), old))
+        self.assertTrue(np.allclose(acc.sumw[0, 2], [0., 0., 0., 1., 0.]))
+
+    def test_check_reference(self):
+        acc = histos.HistAccumulator(self.keys, self.edges)
+        acc.fill(acc.find_bin(5.), 1., [0], [0])
+        acc.fill(acc.find_bin(5.), 1., [0], [1])
+        acc.remove_negative_bins()
+        acc.fill(acc.find_bin(5.), 1., [0], [1])
+        with self.assertRaises(AssertionError):
+            acc.remove_negative_bins()
+
+class Shards(unittest.TestCase):
+    """Histogram shards must be read back, sliced and merged without loss."""
+    def test_write_merge_slice(self):
+        keys = {('A',): ('c1', 'c2'), ('A', 'B'): ('c1',), ('B',): ()}
+        names = {('A',): 'A', ('A', 'B'): 'A_PLUS_B', ('B',): 'B'}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = []
+            for i in range(2):
+                acc = histos.HistAccumulator(keys, [0., 10., 20.])
+                acc.fill(acc.find_bin(15.), 1.+i, [0, 0, 1], [0, 2, 1])
+                files.append(os.path.join(tmpdir, 's{}.hdf5'.format(i)))
+                histos.write_shard(files[-1], {'etau': {'x': acc}}, names)
+            out = os.path.join(tmpdir, 'sum.hdf5')
+            histos.merge_shards(out, files)
+
+            acc = histos.read_shard(out)['etau']['x']
+            self.assertEqual(list(acc.tcombs), ['A', 'A_PLUS_B', 'B'])
+            self.assertEqual(acc.sumw[0, 2, 2], 3.)
+            self.assertEqual(acc.sumw2[0, 2, 2], 5.)
+
+            sl = histos.read_shard_slice(out, 'etau', 'x', 'A_PLUS_B')
+            self.assertEqual(sl.sumw.shape, (1, 2, 4))
+            self.assertEqual(sl.sumw[0, 1, 2], 3.)
+            with self.assertRaises(ValueError):
+                histos.read_shard_slice(out, 'etau', 'x', 'C')
+
+if __name__ == '__main__':
+    unittest.main()
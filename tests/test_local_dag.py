@@ -0,0 +1,78 @@
+# coding: utf-8
+
+__all__ = ['LocalDAG']
+
+import unittest
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 2 * '/..')
+sys.path.insert(0, parent_dir)
+
+import inclusion
+from inclusion.condor import local_dag
+
+import tempfile
+
+class LocalDAG(unittest.TestCase):
+    """The local executor must follow the dependencies and the cpus requested by each job."""
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.tmpdir.name, 'log.txt')
+        script = os.path.join(self.tmpdir.name, 'job.sh')
+        with open(script, 'w') as f:
+            f.write('#!/bin/sh\necho "start $1 $(date +%s.%N)" >> {0}\nsleep 0.2\necho "end $1 $(date +%s.%N)" >> {0}\n'
+                    .format(self.log))
+        os.chmod(script, 0o755)
+
+        subs = {}
+        for job, cpus in (('A', 2), ('B', 1)):
+            subs[job] = os.path.join(self.tmpdir.name, job + '.sub')
+            with open(subs[job], 'w') as f:
+                f.write('Universe = vanilla\nExecutable = {}\nArguments = $(name)\n'.format(script))
+                f.write('output = {}/$(name).out\nerror = {}/$(name).err\n'.format(self.tmpdir.name, self.tmpdir.name))
+                f.write('request_cpus = {}\nqueue name from (\n  {}1\n  {}2\n)\n'.format(cpus, job, job))
+        self.dag = os.path.join(self.tmpdir.name, 'workflow.dag')
+        with open(self.dag, 'w') as f:
+            f.write('JOB A {}\nJOB B {}\nPARENT A CHILD B\n'.format(subs['A'], subs['B']))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def intervals(self):
+        times = {}
+        with open(self.log) as f:
+            for line in f:
+                kind, name, t = line.split()
+                times.setdefault(name, {})[kind] = float(t)
+        return {k: (v['start'], v['end']) for k,v in times.items()}
+
+    def test_parse_submission(self):
+        sub = local_dag.parse_submission(os.path.join(self.tmpdir.name, 'A.sub'))
+        self.assertEqual(sub['cpus'], 2)
+        self.assertEqual([x['name'] for x in sub['items']], ['A1', 'A2'])
+
+    def test_cpu_budget(self):
+        self.assertTrue(local_dag.LocalDAGExecutor(self.dag, workers=2).run())
+        iv = self.intervals()
+        # the items of A use the whole budget: they run one after the other
+        self.assertTrue(iv['A1'][1] <= iv['A2'][0] or iv['A2'][1] <= iv['A1'][0])
+        # B starts after A, and its single-cpu items share the budget
+        self.assertTrue(min(iv['B1'][0], iv['B2'][0]) >= max(iv['A1'][1], iv['A2'][1]))
+        self.assertTrue(iv['B1'][0] < iv['B2'][1] and iv['B2'][0] < iv['B1'][1])
+
+    def test_resume(self):
+        self.assertTrue(local_dag.LocalDAGExecutor(self.dag, workers=2).run())
+        os.remove(self.log)
+        # nothing is run again when nothing changed
+        self.assertTrue(local_dag.LocalDAGExecutor(self.dag, workers=2).run())
+        self.assertFalse(os.path.exists(self.log))
+
+        # a modified parent runs again, and so does its child
+        with open(os.path.join(self.tmpdir.name, 'A.sub'), 'a') as f:
+            f.write('# modified\n')
+        self.assertTrue(local_dag.LocalDAGExecutor(self.dag, workers=2).run())
+        self.assertEqual(sorted(self.intervals()), ['A1', 'A2', 'B1', 'B2'])
+
+if __name__ == '__main__':
+    unittest.main()
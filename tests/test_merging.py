@@ -0,0 +1,69 @@
+# coding: utf-8
+
+__all__ = ['MergingTree']
+
+import unittest
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 2 * '/..')
+sys.path.insert(0, parent_dir)
+
+import inclusion
+from inclusion.utils import merging
+from inclusion.utils.counts_tensor import CountsTensor
+
+import tempfile
+
+class MergingTree(unittest.TestCase):
+    """Each layer must respect the fan-in and every file must be merged exactly once."""
+    def test_tree_shape(self):
+        for ninputs, fanin in ((1, 20), (21, 20), (400, 20), (401, 20), (1000, 10)):
+            depth = merging.tree_depth(ninputs, fanin)
+            self.assertLessEqual(ninputs, fanin**depth)
+            for d in (depth, depth+1):
+                shape = merging.tree_shape(ninputs, fanin, d)
+                self.assertEqual(shape[-1], 1)
+                for nprev, njobs in zip([ninputs] + shape[:-1], shape):
+                    chunks = [merging.chunk(list(range(nprev)), njobs, i) for i in range(njobs)]
+                    self.assertEqual(sum(chunks, []), list(range(nprev)))
+                    self.assertTrue(all(0 < len(x) <= fanin for x in chunks))
+        with self.assertRaises(ValueError):
+            merging.tree_shape(401, 20, 2)
+
+    def test_merge_csv(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = []
+            for i in range(3):
+                files.append(os.path.join(tmpdir, 'c{}.csv'.format(i)))
+                with open(files[-1], 'w') as f:
+                    f.write('Reference,A,etau,R,{}\n'.format(i))
+                    f.write('Reference_weighted,A,etau,R,{}\n'.format(0.5*i))
+            out = os.path.join(tmpdir, 'sum.csv')
+            merging.merge_csv(out, files)
+            with open(out) as f:
+                self.assertEqual(f.read(), 'Reference,A,etau,R,3\nReference_weighted,A,etau,R,1.5\n')
+
+    def test_merge_tensors(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = []
+            for i in range(3):
+                t = CountsTensor(['etau', 'mutau'], ['A', 'A_PLUS_B'], [['R', 'R'], ['R', '']])
+                t.values[0, 1] = [[10, 2., 4.], [i, 1., 1.]]
+                files.append(os.path.join(tmpdir, 'c{}.npz'.format(i)))
+                t.write(files[-1])
+            out = os.path.join(tmpdir, 'sum.npz')
+            merging.merge_files(out, files)
+
+            t = CountsTensor.read(out)
+            self.assertEqual(t.defined('mutau'), [('A', 'R')])
+            self.assertEqual(t.values[0, 1].tolist(), [[30., 6., 12.], [3., 3., 3.]])
+            self.assertEqual(t.values[1].sum(), 0.)
+
+            other = CountsTensor(['etau'], ['A'], [['R']])
+            other.write(files[0])
+            with self.assertRaises(ValueError):
+                merging.merge_files(out, files)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# coding: utf-8
+
+__all__ = ['EntryRanges']
+
+import unittest
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 2 * '/..')
+sys.path.insert(0, parent_dir)
+
+import inclusion
+from inclusion.utils import multicore, histos
+
+import tempfile
+import numpy as np
+import uproot as up
+
+def _setup(args):
+    return ()
+
+def _count(args, ranges):
+    # number of entries and of calls
+    return sum(stop - start for _, start, stop in ranges), 1
+
+class EntryRanges(unittest.TestCase):
+    """Entry ranges must cover all entries once, on cluster boundaries, and results must add up."""
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.files = []
+        for nentries in (2500, 300):
+            fname = os.path.join(self.tmpdir.name, 'output_{}.root'.format(len(self.files)))
+            with up.recreate(fname) as f:
+                f.mktree('HTauTauTree', {'x': np.float32})
+                for i in range(0, nentries, 500):
+                    f['HTauTauTree'].extend({'x': np.zeros(min(500, nentries-i), dtype=np.float32)})
+            self.files.append(fname)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_cluster_ranges(self):
+        ranges = multicore.cluster_ranges(self.files, nranges=4)
+        self.assertEqual(ranges[0], (self.files[0], 0, 1000))
+        for fname, nentries in zip(self.files, (2500, 300)):
+            rngs = [(start, stop) for f,start,stop in ranges if f == fname]
+            self.assertEqual(rngs[0][0], 0)
+            self.assertEqual(rngs[-1][1], nentries)
+            for (_, stop), (start, _) in zip(rngs[:-1], rngs[1:]):
+                self.assertEqual(stop, start)
+                self.assertEqual(stop % 500, 0)
+
+    def test_split_ranges(self):
+        ranges = multicore.cluster_ranges(self.files, nranges=8)
+        chunks = multicore.split_ranges(ranges, 3)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(sum(chunks, []), ranges)
+        sizes = [sum(stop - start for _, start, stop in x) for x in chunks]
+        self.assertTrue(max(sizes) - min(sizes) <= 1000)
+        # never more chunks than ranges
+        self.assertEqual(multicore.split_ranges(ranges[:2], 4), [[ranges[0]], [ranges[1]]])
+
+    def test_basket_spans(self):
+        spans = multicore.basket_spans(self.files[0], ['x', 'missing'])
+        self.assertEqual(len(spans), 5)
+        self.assertEqual(spans, sorted(spans))
+        # only the baskets of the requested entries
+        self.assertEqual(multicore.basket_spans(self.files[0], ['x'], 1000, 1500), spans[2:3])
+        self.assertEqual(multicore.basket_spans(self.files[0], ['x'], 900, 1600), spans[1:4])
+
+    def test_prefetch_ranges(self):
+        ranges = multicore.cluster_ranges(self.files, nranges=4)
+        self.assertEqual(list(multicore.prefetch_ranges(ranges, ['x'])), ranges)
+
+    def test_process_ranges(self):
+        # one result per worker, added to the empty result of the current process
+        nentries, ncalls = multicore.process_ranges(_count, None, (), self.files, 2, _setup)
+        self.assertEqual(nentries, 2800)
+        self.assertEqual(ncalls, 3)
+
+    def test_merge_results(self):
+        keys = {('A',): ('c1',)}
+        res = []
+        for _ in range(2):
+            acc = histos.HistAccumulator(keys, [0., 1., 2.])
+            acc.fill(acc.find_bin(0.5), 2., [0, 0], [0, 1])
+            res.append(({'etau': {'x': acc}}, None, 10))
+        acc, counts, nevents = multicore.merge_results(*res)
+        self.assertIsNone(counts)
+        self.assertEqual(nevents, 20)
+        self.assertEqual(acc['etau']['x'].sumw[0, 1, 1], 4.)
+        self.assertTrue(acc['etau']['x'].weighted)
+
+if __name__ == '__main__':
+    unittest.main()
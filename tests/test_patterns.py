@@ -0,0 +1,51 @@
+# coding: utf-8
+
+__all__ = ['TriggerPatterns']
+
+import unittest
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 2 * '/..')
+sys.path.insert(0, parent_dir)
+
+import inclusion
+from inclusion.utils import patterns
+
+import functools
+import itertools as it
+import numpy as np
+
+class TriggerPatterns(unittest.TestCase):
+    """Intersections from the superset-sum transform must match explicit logical ANDs."""
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.n = 5000
+        self.trigs = ('A', 'B', 'C', 'D')
+        self.options = {'A': ('NoCut',), 'B': ('x_>_1', 'x_>_2'), 'C': ('NoCut',), 'D': ('y_<_1',)}
+        self.fired = {t: rng.random(self.n) < 0.5 for t in self.trigs}
+        self.cuts = {t: {o: rng.random(self.n) < 0.6 for o in self.options[t]} for t in self.trigs}
+        self.cuts['A']['NoCut'] = True
+        self.cuts['C']['NoCut'] = True
+        self.bins = rng.integers(0, 5, self.n)
+
+    def test_intersections(self):
+        layout = patterns.PatternLayout(self.options)
+        self.assertEqual(layout.nbits, 5)
+
+        pats = layout.patterns(self.fired, self.cuts)
+        hist = np.zeros((layout.npatterns, 5))
+        np.add.at(hist, (pats, self.bins), 1)
+        zeta = patterns.superset_sums(hist, layout.nbits)
+        self.assertTrue(np.array_equal(zeta[0], np.bincount(self.bins, minlength=5)))
+
+        for tcomb in it.chain(*(it.combinations(self.trigs, r) for r in range(1, 5))):
+            for key, pattern in layout.combinations(tcomb, sep='_PLUS_'):
+                passed = functools.reduce(np.logical_and,
+                                          [self.fired[t] & self.cuts[t][k]
+                                           for t,k in zip(tcomb, key.split('_PLUS_'))])
+                self.assertTrue(np.array_equal(zeta[pattern],
+                                               np.bincount(self.bins[passed], minlength=5)))
+
+if __name__ == '__main__':
+    unittest.main()
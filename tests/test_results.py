@@ -0,0 +1,41 @@
+# coding: utf-8
+
+__all__ = ['ResultsStore']
+
+import unittest
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 2 * '/..')
+sys.path.insert(0, parent_dir)
+
+import inclusion
+from inclusion.utils import results
+
+import tempfile
+import numpy as np
+
+class ResultsStore(unittest.TestCase):
+    """Records written to a results store must be read back unchanged, alone or together."""
+    def test_write_read(self):
+        records = {'1D/etau/dau1_pt/Trig1D_CUTS_a': {'attrs': {'kind': '1D', 'channel': 'etau', 'frange': (160., 500.)},
+                                                     'arrays': {'x': np.arange(3.), 'fit_dt': [0.05, 175., 0.95]}},
+                   '2D/etau/dau1_pt_VERSUS_dau2_pt/Trig2D_CUTS_b': {'attrs': {'kind': '2D', 'channel': 'etau'},
+                                                                    'arrays': {'Data2D': np.ones((2, 3))}}}
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = results.results_name(tmp, 'IsoMu24', '_default')
+            os.makedirs(os.path.dirname(fname))
+            results.write_results(fname, records)
+
+            self.assertEqual(sorted(results.list_results(fname)), sorted(records))
+            name = '1D/etau/dau1_pt/Trig1D_CUTS_a'
+            rec = results.read_results(fname, [name])[name]
+            self.assertEqual(rec['attrs']['channel'], 'etau')
+            self.assertTrue(np.array_equal(rec['attrs']['frange'], (160., 500.)))
+            self.assertTrue(np.array_equal(rec['arrays']['x'], np.arange(3.)))
+            self.assertEqual(len(results.read_results(fname)), 2)
+            with self.assertRaises(ValueError):
+                results.read_results(fname, ['1D/mutau'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+# coding: utf-8
+
+__all__ = ['ColumnarSelection']
+
+import unittest
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 2 * '/..')
+sys.path.insert(0, parent_dir)
+
+import inclusion
+from inclusion import selection
+
+from types import SimpleNamespace
+import numpy as np
+
+class ColumnarSelection(unittest.TestCase):
+    """Checks `ColumnarEventSelection` against `EventSelection` event by event."""
+    def setUp(self):
+        self.nevents = 2000
+        rng = np.random.default_rng(42)
+        n = self.nevents
+        self.entries = {
+            'triggerbit'        : rng.integers(0, 2**45, n, dtype=np.int64),
+            'RunNumber'         : rng.integers(316000, 319000, n),
+            'isLeptrigger'      : rng.integers(0, 2, n),
+            'pairType'          : rng.integers(0, 4, n),
+            'isOS'              : rng.integers(0, 2, n),
+            'dau1_eleMVAiso'    : rng.integers(0, 2, n).astype(float),
+            'dau1_iso'          : rng.random(n) * 0.3,
+            'dau2_iso'          : rng.random(n) * 0.3,
+            'dau1_deepTauVsJet' : rng.integers(0, 8, n),
+            'dau2_deepTauVsJet' : rng.integers(0, 8, n),
+            'nleps'             : rng.integers(0, 2, n),
+            'nbjetscand'        : rng.integers(0, 4, n),
+            'tauH_mass'         : rng.random(n) * 200,
+            'bH_mass_raw'       : rng.random(n) * 300,
+            'dau1_pt'           : rng.random(n) * 250,
+            'dau2_pt'           : rng.random(n) * 250,
+            'metnomu_et'        : rng.random(n) * 300,
+            'mhtnomu_et'        : rng.random(n) * 300,
+        }
+
+        combs = (('METNoMu120',), ('IsoMu24',), ('IsoMuIsoTauCustom',),
+                 ('IsoMu24', 'METNoMu120'), ('IsoMuIsoTauCustom', 'METNoMu120'))
+        self.cfg = SimpleNamespace(
+            bjets_cut = True,
+            mass_cut = 'inverted',
+            custom_cut = '(self.entries.dau1_pt < 190 and self.entries.dau2_pt > 40 )',
+            triggers = ('METNoMu120', 'IsoMu24', 'IsoMuIsoTauCustom'),
+            trig_custom = {'IsoMuIsoTauCustom'},
+            cuts = {'METNoMu120': {'metnomu_et': ('>', [120,180]),
+                                   'mhtnomu_et': ('>', [100.5,])}},
+            inters_general = {'MET': (), 'EG': (), 'Mu': combs, 'Tau': ()},
+            inters = {'mutau': {'MET': (), 'EG': (), 'Mu': (), 'Tau': ()}})
+
+    def event(self, i):
+        # same as `utils.dot_dict`, which cannot be imported without ROOT
+        class dot_dict(dict):
+            __getattr__ = dict.get
+        return dot_dict({k: v[i] for k,v in self.entries.items()})
+
+    def test_selection_cuts(self):
+        for isdata in (False, True):
+            col = selection.ColumnarEventSelection(self.entries, isdata=isdata, configuration=self.cfg)
+            for mass_cut in ('standard', 'inverted', None):
+                kwargs = dict(lepton_veto=True, bjets_cut=True, mass_cut=mass_cut,
+                              custom_cut=self.cfg.custom_cut)
+                mask = col.selection_cuts(**kwargs)
+                for i in range(self.nevents):
+                    sel = selection.EventSelection(self.event(i), isdata=isdata, configuration=self.cfg)
+                    self.assertEqual(sel.selection_cuts(**kwargs), mask[i])
+
+    def test_custom_cut(self):
+        exprs = ('(self.entries.dau1_pt < 190 and self.entries.dau2_pt > 40 )',
+                 'self.entries["nleps"] == 0 or not self.entries.isOS',
+                 '40 < self.entries.dau1_pt <= 120 and abs(self.entries.dau1_iso - 0.1) > 0.05',
+                 '(self.entries.dau1_pt if self.entries.pairType == 0 else self.entries.dau2_pt) > 100')
+        col = selection.ColumnarEventSelection(self.entries, isdata=False, configuration=self.cfg)
+        for expr in exprs:
+            cut = selection.compile_custom_cut(expr)
+            mask = cut.columnar(col)
+            for i in range(self.nevents):
+                sel = selection.EventSelection(self.event(i), isdata=False, configuration=self.cfg)
+                self.assertEqual(bool(eval(expr, {}, {"self": sel})), mask[i])
+                self.assertEqual(cut.scalar(sel), mask[i])
+        self.assertEqual(selection.compile_custom_cut(exprs[2]).branches, ('dau1_iso', 'dau1_pt'))
+
+    def test_triggers(self):
+        tcombs = self.cfg.inters_general['Mu']
+        for isdata in (False, True):
+            col = selection.ColumnarEventSelection(self.entries, isdata=isdata, configuration=self.cfg)
+            bits = {t: col.trigger_bits(t) for t in self.cfg.triggers}
+            ref = {tc: col.dataset_triggers(tc, 'mutau', self.cfg.triggers, 'Mu')[0] for tc in tcombs}
+            for i in range(self.nevents):
+                sel = selection.EventSelection(self.event(i), isdata=isdata, configuration=self.cfg)
+                for t in self.cfg.triggers:
+                    self.assertEqual(sel.trigger_bits(t), bits[t][i])
+                for tc in tcombs:
+                    self.assertEqual(bool(sel.dataset_triggers(tc, 'mutau', self.cfg.triggers, 'Mu')[0]),
+                                     ref[tc][i])
+
+    def test_var_cuts(self):
+        col = selection.ColumnarEventSelection(self.entries, isdata=False, configuration=self.cfg)
+        for variables in (['metnomu_et'], ['dau1_pt'], ['metnomu_et', 'mhtnomu_et']):
+            for trig in self.cfg.triggers:
+                masks = col.var_cuts(trig, variables, 'NoCut')
+                for i in range(self.nevents):
+                    sel = selection.EventSelection(self.event(i), isdata=False, configuration=self.cfg)
+                    flags = sel.var_cuts(trig, variables, 'NoCut')
+                    self.assertEqual(flags.keys(), masks.keys())
+                    for k,v in flags.items():
+                        self.assertEqual(v, np.broadcast_to(masks[k], self.nevents)[i])
+
+    def test_categories(self):
+        col = selection.ColumnarEventSelection(self.entries, isdata=False, configuration=self.cfg)
+        self.assertTrue(col.sel_category('baseline').all())
+        with self.assertRaises(ValueError):
+            selection.ColumnarEventSelection.check_category('s2b0jresolvedMcut')
+
+if __name__ == '__main__':
+    unittest.main()
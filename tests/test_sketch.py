@@ -0,0 +1,55 @@
+# coding: utf-8
+
+__all__ = ['QuantileSketch']
+
+import unittest
+
+import os
+import sys
+parent_dir = os.path.abspath(__file__ + 2 * '/..')
+sys.path.insert(0, parent_dir)
+
+import inclusion
+from inclusion.utils import sketch
+
+import numpy as np
+
+class QuantileSketch(unittest.TestCase):
+    """Quantiles of merged `sketch.TDigest` objects must respect the stated rank error."""
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.values = rng.exponential(50., 200000)
+        self.weights = rng.uniform(0., 2., 200000)
+        self.qs = np.array([0., 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1.])
+
+    def merged(self, weights=None):
+        res = sketch.TDigest()
+        chunks = np.array_split(np.arange(len(self.values)), 13)
+        for c in chunks:
+            partial = sketch.TDigest()
+            partial.update(self.values[c], None if weights is None else weights[c])
+            res.merge(partial)
+        return res
+
+    def test_quantiles(self):
+        res = self.merged()
+        est = res.quantile(self.qs)
+        ranks = np.searchsorted(np.sort(self.values), est) / len(self.values)
+        self.assertTrue(np.all(np.abs(ranks - self.qs) <= res.rank_error(self.qs) + 1e-4))
+        self.assertEqual(est[0], self.values.min())
+        self.assertEqual(est[-1], self.values.max())
+        self.assertTrue(len(res) <= res.compression)
+
+    def test_weighted_quantiles(self):
+        res = self.merged(self.weights)
+        order = np.argsort(self.values)
+        cum = np.cumsum(self.weights[order]) / self.weights.sum()
+        est = res.quantile(self.qs[1:-1])
+        ranks = cum[np.searchsorted(self.values[order], est)]
+        self.assertTrue(np.all(np.abs(ranks - self.qs[1:-1]) <= res.rank_error(self.qs[1:-1]) + 1e-3))
+
+        with self.assertRaises(ValueError):
+            res.update([1.], [-1.])
+
+if __name__ == '__main__':
+    unittest.main()